@@ -1,14 +1,43 @@
 import numpy as np
 import tensorflow as tf
-import matplotlib.pyplot as plt
 import cv2
 import os
+import asyncio
 import base64
+import io
 import json
+import threading
+import time
+import uuid
 from collections import Counter
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
+from dataclasses import dataclass, field
+from PIL import Image as PILImage
 from datetime import datetime
+from batching import MicroBatcher
+from metrics import StageTimer
+from model_registry import ModelRegistry
+from model_host import RemoteModel, RemoteModels
+from gate import Gate
+from standin_models import register_standin_models
+from tuning import apply_threading, load_tuning_profile
+from tflite_backend import (TFLiteModel, convert_to_tflite, load_calibration_images, tflite_path,
+                            save_tflite)
+from rendering import (render_model_explanation, render_comparison, render_confidence_chart,
+                       render_agreement_matrix, encode_image, image_filename, validate_render_level,
+                       validate_image_format)
+
+# -------------------------
+# Tuning profile
+# -------------------------
+# Thread counts, SmoothGrad chunk size and inference workers measured by
+# autotune.py. Applied here, before any TensorFlow op runs (TUNING_PROFILE=""
+# disables it); SMOOTHGRAD_BATCH_SIZE / INFERENCE_WORKERS still override it.
+# Profiles tuned on stand-ins are only used when serving stand-ins
+TUNING_PROFILE = os.environ.get("TUNING_PROFILE", "./tuning_profile.json")
+TUNING = load_tuning_profile(TUNING_PROFILE, standin_models=os.environ.get("STANDIN_MODELS", "0") == "1")
+apply_threading(TUNING)
+if TUNING:
+    print(f"Applied tuning profile {TUNING_PROFILE}: {TUNING}")
 
 # -------------------------
 # All Available Models
@@ -25,17 +54,22 @@ MODEL_PATHS = {
 # -------------------------
 # Load all saved models
 # -------------------------
-models = {}
-for model_name in MODEL_NAMES:
-    try:
-        models[model_name] = load_model(MODEL_PATHS[model_name])
-        print(f"Loaded {model_name} model successfully")
-    except Exception as e:
-        print(f"Failed to load {model_name} model: {e}")
-
-# Check if any models were loaded
-if not models:
-    raise ValueError("No models were loaded successfully. Please check model paths.")
+# Nothing is loaded at import time: the server loads all models in parallel
+# at startup (or each one on first use with LAZY_MODEL_LOADING=1), and the
+# .h5 files are converted to .keras under MODEL_CACHE_DIR on first start
+LAZY_MODEL_LOADING = os.environ.get("LAZY_MODEL_LOADING", "0") == "1"
+MODEL_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", "./model/cache")
+
+# With MODEL_HOST=<socket path or host:port> this process loads no weights at
+# all: predictions and explanations are computed by a shared model host
+# process (see model_host.py / serve.py)
+MODEL_HOST = os.environ.get("MODEL_HOST") or None
+
+if MODEL_HOST:
+    models = RemoteModels(MODEL_HOST, MODEL_NAMES)
+else:
+    models = ModelRegistry({model_name: MODEL_PATHS[model_name] for model_name in MODEL_NAMES},
+                           cache_dir=MODEL_CACHE_DIR or None)
 
 # -------------------------
 # Model configuration
@@ -43,28 +77,40 @@ if not models:
 MODEL_CONFIGS = {
     "resnet50": {
         "input_size": (224, 224),
-        "preprocess_func": tf.keras.applications.resnet50.preprocess_input
+        "preprocess_func": tf.keras.applications.resnet50.preprocess_input,
+        "backend": "keras"
     },
     "vgg16": {
         "input_size": (224, 224),
-        "preprocess_func": tf.keras.applications.vgg16.preprocess_input
+        "preprocess_func": tf.keras.applications.vgg16.preprocess_input,
+        "backend": "keras"
     },
     "inceptionv3": {
         "input_size": (299, 299),
-        "preprocess_func": tf.keras.applications.inception_v3.preprocess_input
+        "preprocess_func": tf.keras.applications.inception_v3.preprocess_input,
+        "backend": "keras"
     },
     "xception": {
         "input_size": (299, 299),
-        "preprocess_func": tf.keras.applications.xception.preprocess_input
+        "preprocess_func": tf.keras.applications.xception.preprocess_input,
+        "backend": "keras"
     }
 }
 
-# Warm-up calls for all models
-for model_name, model in models.items():
-    input_size = MODEL_CONFIGS[model_name]["input_size"]
-    _dummy = np.zeros((1, input_size[0], input_size[1], 3), dtype=np.float32)
-    _ = model.predict(_dummy)
-    print(f"Warmed up {model_name} model")
+# Per-model inference backend: "keras", or "tflite" to predict with a quantized
+# TFLite copy (e.g. TFLITE_MODELS=vgg16,resnet50 TFLITE_QUANTIZATION=dynamic)
+TFLITE_MODELS = [model_name for model_name in os.environ.get("TFLITE_MODELS", "").split(",") if model_name]
+TFLITE_QUANTIZATION = os.environ.get("TFLITE_QUANTIZATION", "dynamic")
+for model_name in TFLITE_MODELS:
+    MODEL_CONFIGS[model_name]["backend"] = "tflite"
+    MODEL_CONFIGS[model_name]["quantization"] = TFLITE_QUANTIZATION
+
+# STANDIN_MODELS=1 serves small random-weight stand-ins instead of the .h5 files
+# (benchmarks, load tests); STANDIN_WEIGHT_MB pads each to a realistic weight size
+STANDIN_MODELS = os.environ.get("STANDIN_MODELS", "0") == "1"
+STANDIN_WEIGHT_MB = float(os.environ.get("STANDIN_WEIGHT_MB", "0"))
+if STANDIN_MODELS and not MODEL_HOST:
+    register_standin_models(models, MODEL_CONFIGS, weight_mb=STANDIN_WEIGHT_MB)
 
 # -------------------------
 # Class labels
@@ -76,19 +122,132 @@ class_labels = ['Bacterial Leaf Blight', 'Brown Spot', 'Healthy Rice Leaf',
 # -------------------------
 # Preprocessing function
 # -------------------------
-def preprocess_image(img_path, model_name):
-    input_size = MODEL_CONFIGS[model_name]["input_size"]
+# EXIF orientation tag -> operations that bring the stored pixels upright
+EXIF_ORIENTATION_OPS = {
+    2: [lambda img: cv2.flip(img, 1)],
+    3: [lambda img: cv2.rotate(img, cv2.ROTATE_180)],
+    4: [lambda img: cv2.flip(img, 0)],
+    5: [cv2.transpose],
+    6: [lambda img: cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)],
+    7: [cv2.transpose, lambda img: cv2.rotate(img, cv2.ROTATE_180)],
+    8: [lambda img: cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)]
+}
 
-    original_img = cv2.imread(img_path)
-    original_img = cv2.cvtColor(original_img, cv2.COLOR_BGR2RGB)
+# Longest side of the image used for figures and overlays (0 = full resolution).
+# With REDUCED_DECODE=1, large JPEGs are also decoded at 1/2, 1/4 or 1/8 scale
+# as long as that still covers the model inputs - faster and lighter, but the
+# model inputs then differ slightly from a full-resolution load_img
+MAX_WORKING_RESOLUTION = int(os.environ.get("MAX_WORKING_RESOLUTION", "1024"))
+REDUCED_DECODE = os.environ.get("REDUCED_DECODE", "0") == "1"
+REDUCED_DECODE_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
 
-    img = image.load_img(img_path, target_size=input_size)
-    img_array = image.img_to_array(img)
-    img_array = np.expand_dims(img_array, axis=0)
+def read_image_header(img_bytes):
+    """(EXIF orientation, (width, height)) from the image header, without decoding the pixels"""
+    try:
+        with PILImage.open(io.BytesIO(img_bytes)) as img:
+            return img.getexif().get(0x0112, 1), img.size
+    except Exception:
+        return 1, None
+
+def read_exif_orientation(img_bytes):
+    """Read the EXIF orientation tag from the image header (1 if missing)"""
+    return read_image_header(img_bytes)[0]
+
+def reduced_decode_factor(size):
+    """Largest decode downscale that keeps the image above every model input and the working resolution"""
+    if not REDUCED_DECODE or size is None:
+        return 1
+    model_side = max(max(config["input_size"]) for config in MODEL_CONFIGS.values())
+    for factor in (8, 4, 2):
+        if min(size) // factor >= model_side and max(size) // factor >= MAX_WORKING_RESOLUTION:
+            return factor
+    return 1
+
+def bound_resolution(img, max_side):
+    """Downscale so the longest side is at most max_side (0 = unbounded)"""
+    if max_side <= 0 or max(img.shape[:2]) <= max_side:
+        return img
+
+    # Halve with INTER_LINEAR (a 2x2 average at exactly half size) while far
+    # above the target, which is several times cheaper than one big INTER_AREA
+    while max(img.shape[:2]) >= 2 * max_side:
+        img = cv2.resize(img, (img.shape[1] // 2, img.shape[0] // 2), interpolation=cv2.INTER_LINEAR)
+
+    height, width = img.shape[:2]
+    scale = max_side / max(height, width)
+    return cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+def decode_image(img_bytes):
+    """
+    Decode image bytes once.
+    Returns: (stored_img, original_img) - both RGB; stored_img keeps the pixel
+    layout as stored in the file, original_img has the EXIF orientation applied
+    and is bounded to MAX_WORKING_RESOLUTION
+    """
+    orientation, size = read_image_header(img_bytes)
+    factor = reduced_decode_factor(size)
+    flags = REDUCED_DECODE_FLAGS[factor] if factor > 1 else cv2.IMREAD_COLOR
+
+    buffer = np.frombuffer(img_bytes, dtype=np.uint8)
+    stored_img = cv2.imdecode(buffer, flags | cv2.IMREAD_IGNORE_ORIENTATION)
+    if stored_img is None:
+        raise ValueError("Could not decode image")
+    stored_img = cv2.cvtColor(stored_img, cv2.COLOR_BGR2RGB)
+
+    # Figures and overlays never need the full sensor resolution; downscale
+    # before the EXIF ops so they move fewer pixels
+    original_img = bound_resolution(stored_img, MAX_WORKING_RESOLUTION)
+
+    # cv2.imread rotates by EXIF orientation, load_img does not - keep both views
+    for op in EXIF_ORIENTATION_OPS.get(orientation, []):
+        original_img = op(original_img)
+
+    return stored_img, original_img
+
+def resize_for_model(img, input_size):
+    """Resize a decoded RGB image to a model input size as float32 (H, W, 3)"""
+    # load_img resizes with PIL nearest-neighbour, which
+    # INTER_NEAREST_EXACT reproduces bit for bit
+    img_array = cv2.resize(img, (input_size[1], input_size[0]), interpolation=cv2.INTER_NEAREST_EXACT)
+    return img_array.astype(np.float32)
+
+def preprocess_for_models(img_bytes, model_names):
+    """
+    Decode the upload once, resize once per distinct input size and apply
+    each model's preprocess_func.
+    Returns: (original_img, inputs, stats) where inputs maps
+    model_name -> (img_tensor, img_preprocessed)
+    """
+    stored_img, original_img = decode_image(img_bytes)
+
+    resized = {}
+    inputs = {}
+    for model_name in model_names:
+        input_size = MODEL_CONFIGS[model_name]["input_size"]
+        if input_size not in resized:
+            img_array = np.expand_dims(resize_for_model(stored_img, input_size), axis=0)
+            resized[input_size] = tf.convert_to_tensor(img_array, dtype=tf.float32)
+
+        img_tensor = resized[input_size]
+        preprocess_func = MODEL_CONFIGS[model_name]["preprocess_func"]
+        inputs[model_name] = (img_tensor, preprocess_func(img_tensor))
+
+    # The per-model path decoded twice and resized once for every model
+    stats = {
+        "decodes": 1,
+        "decodes_saved": 2 * len(model_names) - 1,
+        "resizes": len(resized),
+        "resizes_saved": len(model_names) - len(resized)
+    }
+    return original_img, inputs, stats
+
+def preprocess_image(img_path, model_name):
+    with open(img_path, "rb") as f:
+        img_bytes = f.read()
 
-    img_tensor = tf.convert_to_tensor(img_array, dtype=tf.float32)
-    preprocess_func = MODEL_CONFIGS[model_name]["preprocess_func"]
-    img_preprocessed = preprocess_func(img_tensor)
+    original_img, inputs, _ = preprocess_for_models(img_bytes, [model_name])
+    img_tensor, img_preprocessed = inputs[model_name]
 
     return original_img, img_tensor, img_preprocessed
 
@@ -99,13 +258,208 @@ def create_output_directory():
     """Create output directory inside 'output/' with timestamp"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     base_dir = "output"
-    output_dir = os.path.join(base_dir, f"multi_model_explainable_ai_{timestamp}")
-    os.makedirs(output_dir, exist_ok=True)
+    # The random suffix keeps runs started within the same second apart
+    output_dir = os.path.join(base_dir, f"multi_model_explainable_ai_{timestamp}_{uuid.uuid4().hex[:8]}")
+    os.makedirs(output_dir)
     return output_dir
 
+# -------------------------
+# Ensemble Inference
+# -------------------------
+ENSEMBLE_JIT_COMPILE = os.environ.get("ENSEMBLE_JIT_COMPILE", "0") == "1"
+
+class EnsembleRunner:
+    """
+    Run every model of the ensemble in one compiled graph execution.
+    Takes one raw (unpreprocessed) batch per input size, applies each model's
+    preprocess_func inside the graph and returns the stacked probabilities
+    with shape (n_models, batch, n_classes).
+    """
+    def __init__(self, models, jit_compile=False):
+        self.models = models
+        self.model_names = list(models.keys())
+        self.input_sizes = sorted({MODEL_CONFIGS[name]["input_size"] for name in self.model_names})
+        input_signature = [
+            tf.TensorSpec(shape=(None, size[0], size[1], 3), dtype=tf.float32)
+            for size in self.input_sizes
+        ]
+        self._forward = tf.function(self._ensemble_forward, input_signature=input_signature,
+                                    jit_compile=jit_compile)
+
+    def _ensemble_forward(self, *size_inputs):
+        size_inputs = dict(zip(self.input_sizes, size_inputs))
+
+        # The backbones do not depend on each other, so TensorFlow is free to
+        # run them concurrently on the inter-op thread pool
+        outputs = []
+        for model_name in self.model_names:
+            config = MODEL_CONFIGS[model_name]
+            model_input = config["preprocess_func"](size_inputs[config["input_size"]])
+            outputs.append(self.models[model_name](model_input, training=False))
+        return tf.stack(outputs)
+
+    def __call__(self, size_inputs):
+        """size_inputs: input_size -> raw image batch (float32, 0-255)"""
+        return self._forward(*[size_inputs[size] for size in self.input_sizes]).numpy()
+
+# Runners keyed by the models they wrap, so each graph is traced once
+_ensemble_runners = {}
+
+def get_ensemble_runner(models, jit_compile=None):
+    """Return the cached EnsembleRunner for a models dict"""
+    if jit_compile is None:
+        jit_compile = ENSEMBLE_JIT_COMPILE
+    key = (tuple((name, id(model)) for name, model in models.items()), jit_compile)
+    if key not in _ensemble_runners:
+        _ensemble_runners[key] = EnsembleRunner(dict(models), jit_compile=jit_compile)
+    return _ensemble_runners[key]
+
+def size_inputs_from(model_inputs):
+    """Collect the shared raw tensor per input size from preprocess_for_models output"""
+    return {MODEL_CONFIGS[name]["input_size"]: img_tensor for name, (img_tensor, _) in model_inputs.items()}
+
+# -------------------------
+# TFLite backend
+# -------------------------
+# A TFLite-backed model predicts with its interpreter only; its Keras model is
+# unloaded after conversion. Explanations need gradients, so the first one
+# loads the Keras model again and it then stays resident for later
+# explanations (requests with render=none never load it).
+TFLITE_CACHE_DIR = os.environ.get("TFLITE_CACHE_DIR", "./model/tflite")
+TFLITE_CALIBRATION_DIR = os.environ.get("TFLITE_CALIBRATION_DIR") or None
+TFLITE_NUM_THREADS = int(os.environ.get("TFLITE_NUM_THREADS", "0")) or None
+
+_tflite_models = {}
+_tflite_locks = {}  # one per model, so different models convert in parallel
+_tflite_locks_lock = threading.Lock()
+
+def model_backend(model_name):
+    return MODEL_CONFIGS[model_name].get("backend", "keras")
+
+def get_tflite_model(models, model_name):
+    """
+    TFLite predictor for a backbone. The .tflite file is converted from the
+    Keras model on first use and reused while it is newer than the .h5 file.
+    """
+    if model_name in _tflite_models:
+        return _tflite_models[model_name]
+    with _tflite_locks_lock:
+        lock = _tflite_locks.setdefault(model_name, threading.Lock())
+    with lock:
+        if model_name in _tflite_models:
+            return _tflite_models[model_name]
+
+        config = MODEL_CONFIGS[model_name]
+        quantization = config.get("quantization", TFLITE_QUANTIZATION)
+        path = tflite_path(TFLITE_CACHE_DIR, model_name, quantization)
+        source = MODEL_PATHS.get(model_name)
+        up_to_date = os.path.exists(path) and source is not None and os.path.exists(source) and \
+            os.path.getmtime(path) >= os.path.getmtime(source)
+
+        if not up_to_date:
+            start = time.perf_counter()
+            calibration_images = None
+            if TFLITE_CALIBRATION_DIR:
+                calibration_images = load_calibration_images(TFLITE_CALIBRATION_DIR, config["input_size"])
+            save_tflite(convert_to_tflite(models[model_name], quantization, calibration_images,
+                                          config["preprocess_func"]), path)
+            print(f"Converted {model_name} to TFLite ({quantization}) in {time.perf_counter() - start:.2f}s")
+
+            # The float model is only needed again for explanations, which reload it
+            if isinstance(models, ModelRegistry):
+                release_model(models[model_name])
+                models.unload(model_name)
+
+        tflite_model = TFLiteModel.from_file(path, num_threads=TFLITE_NUM_THREADS)
+
+        # Warm up and record the cost for the cascade
+        input_size = config["input_size"]
+        dummy = np.zeros((1, input_size[0], input_size[1], 3), dtype=np.float32)
+        tflite_model.predict(dummy)
+        start = time.perf_counter()
+        tflite_model.predict(dummy)
+        record_model_cost(model_name, time.perf_counter() - start)
+        print(f"Loaded {model_name} TFLite model ({tflite_model.size_bytes / 1e6:.1f} MB)")
+
+        _tflite_models[model_name] = tflite_model
+        return tflite_model
+
+def release_model(model):
+    """
+    Drop every compiled graph, batcher and estimate cached for a Keras model,
+    so it can be freed once the registry lets go of it as well
+    """
+    model_id = id(model)
+    for key in [key for key in _ensemble_runners if any(cached_id == model_id for _, cached_id in key[0])]:
+        del _ensemble_runners[key]
+    for cache in (_smoothgrad_steps, _gradcam_steps):
+        for key in [key for key, (cached_model, _) in list(cache.items()) if cached_model is model]:
+            del cache[key]
+    _sample_memory_bytes.pop(model_id, None)
+    with _batchers_lock:
+        batcher = _batchers.pop(("smoothgrad", model_id), None)
+    if batcher is not None:
+        batcher.close()
+
+def predict_model(models, model_name, size_inputs):
+    """(batch, n_classes) probabilities of one model on its backend"""
+    if isinstance(models, RemoteModels):
+        return models.predict([model_name], size_inputs)[0]
+    config = MODEL_CONFIGS[model_name]
+    if model_backend(model_name) == "tflite":
+        img_preprocessed = config["preprocess_func"](size_inputs[config["input_size"]])
+        return get_tflite_model(models, model_name).predict(img_preprocessed)
+    return get_ensemble_runner({model_name: models[model_name]})(size_inputs)[0]
+
+def run_ensemble(models, size_inputs):
+    """
+    Stacked (n_models, batch, n_classes) probabilities. Keras-backed models
+    share one fused graph; TFLite-backed models run on their interpreters.
+    """
+    model_names = list(models.keys())
+    if isinstance(models, RemoteModels):
+        return models.predict(model_names, size_inputs)
+    keras_names = [model_name for model_name in model_names if model_backend(model_name) == "keras"]
+    if len(keras_names) == len(model_names):
+        return get_ensemble_runner(models)(size_inputs)
+
+    outputs = {}
+    if keras_names:
+        stacked = get_ensemble_runner({model_name: models[model_name] for model_name in keras_names})(size_inputs)
+        outputs.update(zip(keras_names, stacked))
+    for model_name in model_names:
+        if model_name not in outputs:
+            outputs[model_name] = predict_model(models, model_name, size_inputs)
+    return np.stack([outputs[model_name] for model_name in model_names])
+
+def load_for_serving(model_name):
+    """Startup loader: the TFLite predictor for tflite-backed models, else the Keras model"""
+    try:
+        if model_backend(model_name) == "tflite":
+            return get_tflite_model(models, model_name)
+    except Exception as e:
+        print(f"Failed to prepare TFLite {model_name} model: {e}")
+        return None
+    return models.get(model_name)
+
 # -------------------------
 # Explanation Generation Functions
 # -------------------------
+SMOOTHGRAD_BATCH_SIZE = int(os.environ.get("SMOOTHGRAD_BATCH_SIZE", TUNING.get("smoothgrad_batch_size", 10)))
+SMOOTHGRAD_SAMPLES = int(os.environ.get("SMOOTHGRAD_SAMPLES", "30"))
+# Adaptive SmoothGrad: stop sampling once the running heatmap changes by less
+# than SMOOTHGRAD_TOLERANCE (normalized L2) from one chunk of
+# SMOOTHGRAD_CHECK_EVERY samples to the next, but never below SMOOTHGRAD_MIN_SAMPLES
+SMOOTHGRAD_ADAPTIVE = os.environ.get("SMOOTHGRAD_ADAPTIVE", "0") == "1"
+SMOOTHGRAD_TOLERANCE = float(os.environ.get("SMOOTHGRAD_TOLERANCE", "0.02"))
+SMOOTHGRAD_MIN_SAMPLES = int(os.environ.get("SMOOTHGRAD_MIN_SAMPLES", "8"))
+SMOOTHGRAD_CHECK_EVERY = int(os.environ.get("SMOOTHGRAD_CHECK_EVERY", "5"))
+SMOOTHGRAD_MEMORY_CAP_MB = float(os.environ.get("SMOOTHGRAD_MEMORY_CAP_MB", "1024"))
+
+# Compiled SmoothGrad steps and per-sample memory estimates, keyed by model
+_smoothgrad_steps = {}
+_sample_memory_bytes = {}
+
 def generate_gradient_explanation(img_tensor, model, class_index=None):
     """Generate gradient-based explanation that always works"""
     with tf.GradientTape() as tape:
@@ -128,25 +482,134 @@ def generate_gradient_explanation(img_tensor, model, class_index=None):
 
     return gradients.numpy()
 
-def generate_smoothgrad_explanation(img_tensor, model, class_index=None, noise_level=0.1, n_samples=50):
-    """Generate SmoothGrad explanation - reduces noise in gradients"""
-    gradients_sum = tf.zeros_like(img_tensor)
-
-    for _ in range(n_samples):
-        # Add random noise
-        noise = tf.random.normal(tf.shape(img_tensor)) * noise_level
-        noisy_img = img_tensor + noise
-
-        with tf.GradientTape() as tape:
-            tape.watch(noisy_img)
-            predictions = model(noisy_img)
-            if class_index is None:
-                class_index = tf.argmax(predictions[0])
-            class_output = predictions[:, class_index]
+def estimate_sample_memory(model):
+    """Estimate the bytes one noisy sample keeps alive through a forward/backward pass"""
+    key = id(model)
+    if key not in _sample_memory_bytes:
+        def count_values(layer):
+            if hasattr(layer, "layers"):
+                return sum(count_values(sub_layer) for sub_layer in layer.layers)
+            try:
+                return int(np.prod(layer.output.shape[1:]))
+            except Exception:
+                return 0
+
+        n_values = count_values(model)
+        if n_values == 0:
+            # Unknown graph - assume activations are ~100x the input
+            n_values = int(np.prod(model.input_shape[1:])) * 100
+
+        # float32 activations plus their gradients
+        _sample_memory_bytes[key] = n_values * 4 * 2
+    return _sample_memory_bytes[key]
+
+def smoothgrad_chunk_size(model, batch_size=None, memory_cap_mb=None):
+    """Pick how many noisy copies to stack per pass, bounded by the memory cap"""
+    if batch_size is None:
+        batch_size = SMOOTHGRAD_BATCH_SIZE
+    if memory_cap_mb is None:
+        memory_cap_mb = SMOOTHGRAD_MEMORY_CAP_MB
+
+    if memory_cap_mb > 0:
+        fits = int(memory_cap_mb * 1024 * 1024 // estimate_sample_memory(model))
+        batch_size = min(batch_size, max(1, fits))
+    return max(1, batch_size)
+
+def get_smoothgrad_step(model, input_shape):
+    """Return the compiled forward/backward step for a model and input size"""
+    key = (id(model), tuple(input_shape))
+    if key not in _smoothgrad_steps:
+        @tf.function(input_signature=[
+            tf.TensorSpec(shape=(None,) + tuple(input_shape), dtype=tf.float32),
+            tf.TensorSpec(shape=(), dtype=tf.int32)
+        ])
+        def smoothgrad_step(noisy_batch, class_index):
+            with tf.GradientTape() as tape:
+                tape.watch(noisy_batch)
+                predictions = model(noisy_batch, training=False)
+                class_output = tf.gather(predictions, class_index, axis=1)
+
+            # Samples are independent, so the gradient of the summed outputs
+            # holds each sample's own gradient - sum them over the batch
+            gradients = tape.gradient(class_output, noisy_batch)
+            return tf.reduce_sum(gradients, axis=0, keepdims=True)
+
+        # Keep a reference to the model so its id is not reused
+        _smoothgrad_steps[key] = (model, smoothgrad_step)
+    return _smoothgrad_steps[key][1]
+
+def generate_smoothgrad_explanation(img_tensor, model, class_index=None, noise_level=0.1, n_samples=50,
+                                    batch_size=None, seed=None):
+    """Generate SmoothGrad explanation - reduces noise in gradients
+
+    Noisy copies are stacked into chunks (see smoothgrad_chunk_size) and run
+    through a compiled step instead of one eager pass per sample.
+    """
+    return run_smoothgrad(img_tensor, model, class_index, noise_level=noise_level, max_samples=n_samples,
+                          batch_size=batch_size, seed=seed)[0]
 
-        gradients = tape.gradient(class_output, noisy_img)
-        gradients_sum += gradients
+def run_smoothgrad(img_tensor, model, class_index=None, noise_level=0.1, max_samples=50, batch_size=None,
+                   seed=None, tolerance=None, min_samples=None, time_budget=None):
+    """
+    SmoothGrad with optional early stopping. With a tolerance, sampling stops
+    once the running heatmap changes by less than it (normalized L2) between
+    successive chunks; with time_budget (seconds), once the time is up.
+    Neither stops before min_samples (default SMOOTHGRAD_MIN_SAMPLES).
+    Returns: (heatmap, number of samples used)
+    """
+    start_time = time.perf_counter()
+    img_tensor = tf.convert_to_tensor(img_tensor, dtype=tf.float32)
+    if class_index is None:
+        class_index = tf.argmax(model(img_tensor, training=False)[0])
+    class_index = tf.constant(int(class_index), dtype=tf.int32)
+
+    step = get_smoothgrad_step(model, img_tensor.shape[1:])
+    chunk_size = smoothgrad_chunk_size(model, batch_size)
+    if tolerance is not None or time_budget is not None:
+        chunk_size = min(chunk_size, SMOOTHGRAD_CHECK_EVERY)
+    if min_samples is None:
+        min_samples = SMOOTHGRAD_MIN_SAMPLES
+    min_samples = min(min_samples, max_samples)
+    sample_shape = tuple(img_tensor.shape[1:])
 
+    gradients_sum = tf.zeros_like(img_tensor)
+    n_used = 0
+    previous_map = None
+    while n_used < max_samples:
+        current = min(chunk_size, max_samples - n_used)
+
+        # Add random noise - seeded noise is drawn per sample index so the
+        # result does not depend on the chunk size
+        if seed is not None:
+            noise = tf.stack([
+                tf.random.stateless_normal(sample_shape, seed=[seed, n_used + i])
+                for i in range(current)
+            ]) * noise_level
+        else:
+            noise = tf.random.normal((current,) + sample_shape) * noise_level
+
+        gradients_sum += step(img_tensor + noise, class_index)
+        n_used += current
+        if n_used >= max_samples:
+            break
+
+        if tolerance is not None:
+            current_map = smoothgrad_map(gradients_sum, n_used)
+            converged = previous_map is not None and heatmap_change(previous_map, current_map) < tolerance
+            previous_map = current_map
+            if converged and n_used >= min_samples:
+                break
+        if time_budget is not None and n_used >= min_samples and time.perf_counter() - start_time >= time_budget:
+            break
+
+    return smoothgrad_map(gradients_sum, n_used), n_used
+
+def heatmap_change(previous_map, current_map):
+    """Normalized L2 distance between two heatmaps"""
+    return float(np.linalg.norm(current_map - previous_map) / max(np.linalg.norm(current_map), 1e-12))
+
+def smoothgrad_map(gradients_sum, n_samples):
+    """Turn summed SmoothGrad gradients of shape (1, h, w, c) into a normalized heatmap"""
     # Average the gradients
     smooth_gradients = gradients_sum / n_samples
 
@@ -161,53 +624,285 @@ def generate_smoothgrad_explanation(img_tensor, model, class_index=None, noise_l
 
     return smooth_gradients.numpy()
 
-# -------------------------
-# Visualization Functions
-# -------------------------
-def create_heatmap_overlay(original_img, heatmap, colormap=cv2.COLORMAP_JET, alpha=0.4):
-    """Create heatmap overlay on original image"""
-    # Resize heatmap to match original image
-    heatmap_resized = cv2.resize(heatmap, (original_img.shape[1], original_img.shape[0]))
+def get_per_sample_gradient_step(model, input_shape):
+    """Compiled step returning each sample's gradient for its own class index"""
+    key = ("per_sample", id(model), tuple(input_shape))
+    if key not in _smoothgrad_steps:
+        @tf.function(input_signature=[
+            tf.TensorSpec(shape=(None,) + tuple(input_shape), dtype=tf.float32),
+            tf.TensorSpec(shape=(None,), dtype=tf.int32)
+        ])
+        def per_sample_step(noisy_batch, class_indices):
+            with tf.GradientTape() as tape:
+                tape.watch(noisy_batch)
+                predictions = model(noisy_batch, training=False)
+                class_output = tf.gather(predictions, class_indices, axis=1, batch_dims=1)
+            return tape.gradient(class_output, noisy_batch)
+
+        _smoothgrad_steps[key] = (model, per_sample_step)
+    return _smoothgrad_steps[key][1]
+
+# model id -> (model, Grad-CAM step); built once per model when it is loaded
+_gradcam_steps = {}
+
+def find_last_conv_layer(model):
+    """Index of the last top-level layer with a spatial (4D) output - a conv layer or a nested backbone"""
+    for i in range(len(model.layers) - 1, -1, -1):
+        layer = model.layers[i]
+        if isinstance(layer, tf.keras.layers.InputLayer):
+            continue
+        try:
+            if len(layer.output.shape) == 4:
+                return i
+        except Exception:
+            continue
+    raise ValueError(f"Model {model.name} has no layer with a spatial output for Grad-CAM")
 
-    # Convert to 0-255 range
-    heatmap_uint8 = np.uint8(255 * heatmap_resized)
+def build_gradcam_model(model):
+    """
+    Callable returning (last conv feature maps, predictions) for a batch.
+    A flat functional graph is cut with a two-output sub-model; models whose
+    backbone is a nested layer are split into a feature and a head part.
+    """
+    index = find_last_conv_layer(model)
+    layer = model.layers[index]
+    if not isinstance(layer, tf.keras.Model):
+        try:
+            return tf.keras.Model(model.inputs, [layer.output, model.output])
+        except Exception:
+            pass  # not a connected functional graph - fall back to splitting
+
+    # Only valid for a linear top level (input -> backbone -> head), which is
+    # how the transfer-learned models are built
+    feature_layers = [feature_layer for feature_layer in model.layers[:index + 1]
+                      if not isinstance(feature_layer, tf.keras.layers.InputLayer)]
+    head_layers = model.layers[index + 1:]
+
+    def gradcam_model(inputs, training=False):
+        features = inputs
+        for feature_layer in feature_layers:
+            features = feature_layer(features, training=training)
+        predictions = features
+        for head_layer in head_layers:
+            predictions = head_layer(predictions, training=training)
+        return features, predictions
+    return gradcam_model
+
+def get_gradcam_step(model, input_shape):
+    """Compiled Grad-CAM step for a model and input size"""
+    key = (id(model), tuple(input_shape))
+    if key not in _gradcam_steps:
+        gradcam_model = build_gradcam_model(model)
+
+        @tf.function(input_signature=[
+            tf.TensorSpec(shape=(None,) + tuple(input_shape), dtype=tf.float32),
+            tf.TensorSpec(shape=(), dtype=tf.int32)
+        ])
+        def gradcam_step(img_batch, class_index):
+            with tf.GradientTape() as tape:
+                features, predictions = gradcam_model(img_batch, training=False)
+                class_output = tf.gather(predictions, class_index, axis=1)
+
+            # Channel weights are the spatially averaged gradients
+            gradients = tape.gradient(class_output, features)
+            weights = tf.reduce_mean(gradients, axis=(1, 2), keepdims=True)
+            return tf.nn.relu(tf.reduce_sum(features * weights, axis=-1))[0]
+
+        _gradcam_steps[key] = (model, gradcam_step)
+    return _gradcam_steps[key][1]
+
+def generate_gradcam_explanation(img_tensor, model, class_index=None):
+    """Grad-CAM heatmap from the last conv layer - one backward pass, upsampled to the input size"""
+    img_tensor = tf.convert_to_tensor(img_tensor, dtype=tf.float32)
+    if class_index is None:
+        class_index = tf.argmax(model(img_tensor, training=False)[0])
+
+    cam = get_gradcam_step(model, img_tensor.shape[1:])(img_tensor, tf.constant(int(class_index), dtype=tf.int32))
+    cam = cam.numpy()
+    cam_range = cam.max() - cam.min()
+    cam = (cam - cam.min()) / cam_range if cam_range > 0 else np.zeros_like(cam)
+
+    # The map has the conv layer's resolution (e.g. 7x7)
+    return cv2.resize(cam, (img_tensor.shape[2], img_tensor.shape[1]), interpolation=cv2.INTER_LINEAR)
 
-    # Apply colormap
-    heatmap_colored = cv2.applyColorMap(heatmap_uint8, colormap)
-    heatmap_colored = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
+# -------------------------
+# Micro-batching
+# -------------------------
+# Concurrent requests hand their inputs to a per-model batcher, which runs one
+# batched pass and scatters the rows back. Needs INFERENCE_WORKERS > 1 to fill.
+BATCHING_ENABLED = os.environ.get("BATCHING_ENABLED", "0") == "1"
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_DELAY_MS = float(os.environ.get("BATCH_MAX_DELAY_MS", "5"))
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+def _get_batcher(key, fn, name):
+    with _batchers_lock:
+        if key not in _batchers:
+            _batchers[key] = MicroBatcher(fn, max_batch_size=BATCH_MAX_SIZE,
+                                          max_delay=BATCH_MAX_DELAY_MS / 1000, name=name)
+        return _batchers[key]
+
+def get_ensemble_batcher(models):
+    """Batcher that stacks size_inputs from several requests into one ensemble run"""
+    def run_batch(items):
+        size_inputs = {size: tf.concat([item[size] for item in items], axis=0) for size in items[0]}
+        probabilities = run_ensemble(models, size_inputs)
+        return [probabilities[:, k:k + 1] for k in range(len(items))]
+
+    return _get_batcher(("ensemble", id(models), tuple(models.keys())), run_batch, "ensemble-batcher")
+
+def get_smoothgrad_batcher(model_name, model):
+    """Batcher that pools the noisy samples of several requests for one model"""
+    def run_batch(items):
+        # items: (img_preprocessed, class_index, n_samples, noise_level)
+        images = tf.concat([tf.convert_to_tensor(item[0], dtype=tf.float32) for item in items], axis=0)
+        sample_owner = np.repeat(np.arange(len(items), dtype=np.int32), [item[2] for item in items])
+        class_indices = np.array([item[1] for item in items], dtype=np.int32)[sample_owner]
+        noise_levels = np.array([item[3] for item in items], dtype=np.float32)[sample_owner]
+
+        step = get_per_sample_gradient_step(model, images.shape[1:])
+        chunk_size = smoothgrad_chunk_size(model, SMOOTHGRAD_BATCH_SIZE * len(items))
+
+        gradients_sum = tf.zeros_like(images)
+        for start in range(0, len(sample_owner), chunk_size):
+            owners = sample_owner[start:start + chunk_size]
+            noisy = tf.gather(images, owners)
+            noise = tf.random.normal(tf.shape(noisy)) * noise_levels[start:start + chunk_size, None, None, None]
+            gradients = step(noisy + noise, class_indices[start:start + chunk_size])
+            gradients_sum += tf.math.unsorted_segment_sum(gradients, owners, len(items))
+
+        return [smoothgrad_map(gradients_sum[k:k + 1], item[2]) for k, item in enumerate(items)]
+
+    return _get_batcher(("smoothgrad", id(model)), run_batch, f"smoothgrad-batcher-{model_name}")
+
+def predict_ensemble(models, size_inputs):
+    """Stacked (n_models, 1, n_classes) probabilities, micro-batched across requests when enabled"""
+    if not BATCHING_ENABLED:
+        return run_ensemble(models, size_inputs)
+    return get_ensemble_batcher(models).submit(size_inputs)
+
+def explain_smoothgrad(model_name, model, img_preprocessed, class_index, time_budget=None, noise_level=0.1):
+    """
+    (SmoothGrad heatmap, samples used) for one request. Micro-batched across
+    requests when enabled, which always uses SMOOTHGRAD_SAMPLES; otherwise
+    stops early when adaptive or when time_budget (seconds) runs out.
+    """
+    if not BATCHING_ENABLED:
+        return run_smoothgrad(img_preprocessed, model, class_index, noise_level=noise_level,
+                              max_samples=SMOOTHGRAD_SAMPLES,
+                              tolerance=SMOOTHGRAD_TOLERANCE if SMOOTHGRAD_ADAPTIVE else None,
+                              time_budget=time_budget)
+    heatmap = get_smoothgrad_batcher(model_name, model).submit(
+        (img_preprocessed, int(class_index), SMOOTHGRAD_SAMPLES, noise_level))
+    return heatmap, SMOOTHGRAD_SAMPLES
+
+def batching_stats():
+    with _batchers_lock:
+        return {batcher.name: batcher.stats() for batcher in _batchers.values()}
 
-    # Create overlay
-    overlay = cv2.addWeighted(original_img, 1-alpha, heatmap_colored, alpha, 0)
-    return overlay, heatmap_colored
+# -------------------------
+# Explainers
+# -------------------------
+# name -> explain(model_name, model, img_preprocessed, class_index, time_budget)
+# returning (heatmap, samples used), the number of forward/backward passes it
+# costs and the fewest it can stop at when time_budget runs out, most detailed
+# first. A request picks one by name, or gives budget_ms and gets the most
+# detailed explainer whose estimated cost for all models fits, at its fewest
+# passes (the cheapest one if none does).
+def explain_gradcam(model_name, model, img_preprocessed, class_index, time_budget=None):
+    return generate_gradcam_explanation(img_preprocessed, model, class_index), 1
+
+def explain_gradient(model_name, model, img_preprocessed, class_index, time_budget=None):
+    return generate_gradient_explanation(tf.convert_to_tensor(img_preprocessed, dtype=tf.float32), model,
+                                         class_index), 1
+
+EXPLAINERS = {
+    "smoothgrad": {"explain": explain_smoothgrad, "passes": SMOOTHGRAD_SAMPLES,
+                   "min_passes": SMOOTHGRAD_SAMPLES if BATCHING_ENABLED else SMOOTHGRAD_MIN_SAMPLES},
+    "gradcam": {"explain": explain_gradcam, "passes": 1, "min_passes": 1},
+    "gradient": {"explain": explain_gradient, "passes": 1, "min_passes": 1}
+}
+EXPLAINER = os.environ.get("EXPLAINER", "smoothgrad")
+# One forward plus backward pass, relative to a forward pass
+BACKWARD_COST_FACTOR = 3.0
+DEFAULT_MODEL_COST = 0.05
+
+# (explainer, model_name) -> moving average of measured seconds
+_explainer_costs = {}
+
+def validate_explainer(explainer):
+    """Return the explainer name, falling back to EXPLAINER when None"""
+    if explainer is None:
+        explainer = EXPLAINER
+    if explainer not in EXPLAINERS:
+        raise ValueError(f"Unknown explainer '{explainer}', expected one of {tuple(EXPLAINERS)}")
+    return explainer
+
+def record_explainer_cost(explainer, model_name, seconds):
+    with _model_costs_lock:
+        previous = _explainer_costs.get((explainer, model_name))
+        _explainer_costs[(explainer, model_name)] = seconds if previous is None else \
+            (1 - MODEL_COST_SMOOTHING) * previous + MODEL_COST_SMOOTHING * seconds
+
+def estimate_explainer_cost(explainer, model_names):
+    """Estimated seconds to explain every model; unmeasured ones are derived from the predict cost"""
+    with _model_costs_lock:
+        explainer_costs = dict(_explainer_costs)
+        model_costs = dict(_model_costs)
+
+    total = 0.0
+    for model_name in model_names:
+        measured = explainer_costs.get((explainer, model_name))
+        if measured is None:
+            measured = EXPLAINERS[explainer]["passes"] * BACKWARD_COST_FACTOR * \
+                model_costs.get(model_name, DEFAULT_MODEL_COST)
+        total += measured
+    return total
+
+def choose_explainer(explainer, budget_ms, model_names):
+    """Explainer for a request: the named one, else the most detailed one that fits budget_ms"""
+    if explainer is not None or budget_ms is None:
+        return validate_explainer(explainer)
+
+    costs = {name: estimate_explainer_cost(name, model_names) for name in EXPLAINERS}
+    for name, spec in EXPLAINERS.items():
+        if costs[name] * spec["min_passes"] / spec["passes"] * 1000 <= budget_ms:
+            return name
+    return min(costs, key=costs.get)
+
+def explain_model(explainer, model_name, model, img_preprocessed, class_index, time_budget=None):
+    """Run an explainer for one model and record how long it took; returns (heatmap, samples used)"""
+    start = time.perf_counter()
+    if isinstance(model, RemoteModel):
+        explanation, samples = model.explain(explainer, img_preprocessed, class_index, time_budget)
+    else:
+        explanation, samples = EXPLAINERS[explainer]["explain"](model_name, model, img_preprocessed, class_index,
+                                                                time_budget)
+    # Costs are kept for the full number of passes, however early it stopped
+    passes = EXPLAINERS[explainer]["passes"]
+    record_explainer_cost(explainer, model_name, (time.perf_counter() - start) * passes / max(min(samples, passes), 1))
+    return explanation, samples
 
-def save_model_explanation(original_img, explanation, model_name, pred_class, confidence, filename, output_dir):
+# -------------------------
+# Visualization Functions
+# -------------------------
+def save_model_explanation(original_img, explanation, model_name, pred_class, confidence, filename, output_dir,
+                           image_format=None):
     """Save explanation for a single model"""
-    fig, axes = plt.subplots(1, 3, figsize=(15, 5))
-
-    # Original image
-    axes[0].imshow(original_img)
-    axes[0].set_title("Original Image")
-    axes[0].axis('off')
-
-    # Explanation heatmap
-    axes[1].imshow(explanation, cmap='hot')
-    axes[1].set_title(f"{model_name} Heatmap")
-    axes[1].axis('off')
-
-    # Overlay
-    overlay, _ = create_heatmap_overlay(original_img, explanation, cv2.COLORMAP_JET)
-    axes[2].imshow(overlay)
-    axes[2].set_title(f"{model_name} Overlay")
-    axes[2].axis('off')
-
-    plt.suptitle(f"{model_name}: {class_labels[pred_class]} ({confidence:.1f}%)", fontsize=16)
-    plt.tight_layout()
-    plt.savefig(os.path.join(output_dir, filename), dpi=300, bbox_inches='tight')
-    plt.close()
+    figure = render_model_explanation(
+        original_img, explanation, model_name,
+        f"{model_name}: {class_labels[pred_class]} ({confidence:.1f}%)"
+    )
+    with open(os.path.join(output_dir, filename), "wb") as f:
+        f.write(encode_image(figure, image_format))
 
 # -------------------------
 # Paddy Leaf Detection Logic
 # -------------------------
+MIN_AGREEING_MODELS = 3
+
 def is_paddy_leaf(predictions_dict, class_labels):
     """
     Determine if the image is a paddy leaf based on model agreement.
@@ -231,7 +926,7 @@ def is_paddy_leaf(predictions_dict, class_labels):
         most_common_class, count = most_common[0]
 
         # Check if at least 3 models agree
-        if count >= 3:
+        if count >= MIN_AGREEING_MODELS:
             # Find the model with highest confidence for this class
             best_model = None
             best_confidence = 0
@@ -248,6 +943,169 @@ def is_paddy_leaf(predictions_dict, class_labels):
     else:
         return False, "Not a paddy leaf", 0, None
 
+def is_paddy_leaf_batch(probabilities):
+    """
+    is_paddy_leaf for a whole batch of stacked (n_models, batch, n_classes)
+    probabilities, as arrays over the batch.
+    Returns: (is_paddy, final_class, confidence, best_model) - final_class and
+    best_model (index into the model order) are -1 and confidence (percent)
+    is 0 where the models do not agree
+    """
+    pred_classes = probabilities.argmax(axis=-1)
+    confidences = probabilities.max(axis=-1) * 100
+
+    # Votes per class for every image: (batch, n_classes)
+    votes = (pred_classes[..., np.newaxis] == np.arange(probabilities.shape[-1])).sum(axis=0)
+    top_class = votes.argmax(axis=-1)
+    is_paddy = votes.max(axis=-1) >= MIN_AGREEING_MODELS
+
+    # Most confident model among those voting for the winning class
+    agreeing_confidences = np.where(pred_classes == top_class, confidences, -1.0)
+    best_model = agreeing_confidences.argmax(axis=0)
+    confidence = agreeing_confidences.max(axis=0)
+
+    return (is_paddy, np.where(is_paddy, top_class, -1), np.where(is_paddy, confidence, 0.0),
+            np.where(is_paddy, best_model, -1))
+
+def vote_decided(pred_classes, n_remaining):
+    """
+    True once the agreement rule cannot change with more votes: some class
+    already has MIN_AGREEING_MODELS votes, or no class can still reach it.
+    """
+    top_count = Counter(pred_classes).most_common(1)[0][1] if pred_classes else 0
+    return top_count >= MIN_AGREEING_MODELS or top_count + n_remaining < MIN_AGREEING_MODELS
+
+# -------------------------
+# Early-exit cascade
+# -------------------------
+# Opt-in (CASCADE_ENABLED=1): evaluate backbones cheapest first and stop as
+# soon as the vote is decided. The cascade runs the models one at a time, so
+# it bypasses the fused ensemble graph, the ensemble micro-batcher and the
+# model host's batched predict. The final confidence and best model are taken
+# over the models that actually ran; skipped models take no part in them.
+# full_ensemble=True runs every model for a single request.
+CASCADE_ENABLED = os.environ.get("CASCADE_ENABLED", "0") == "1"
+MODEL_COST_SMOOTHING = 0.2
+
+# model_name -> moving average of measured predict latency in seconds
+_model_costs = {}
+_model_costs_lock = threading.Lock()
+
+def record_model_cost(model_name, seconds):
+    with _model_costs_lock:
+        previous = _model_costs.get(model_name)
+        _model_costs[model_name] = seconds if previous is None else \
+            (1 - MODEL_COST_SMOOTHING) * previous + MODEL_COST_SMOOTHING * seconds
+
+def model_size_prior(models, model_name):
+    """Weight size in bytes, used to rank models that have not been timed yet"""
+    path = MODEL_PATHS.get(model_name)
+    if path and os.path.exists(path):
+        return os.path.getsize(path)
+    return models[model_name].count_params() * 4
+
+def cascade_order(models):
+    """Model names ordered by measured cost; unmeasured models are estimated from their weight size"""
+    with _model_costs_lock:
+        costs = dict(_model_costs)
+
+    sizes = {model_name: model_size_prior(models, model_name) for model_name in models.keys()}
+    measured = [model_name for model_name in sizes if model_name in costs]
+    seconds_per_byte = np.mean([costs[name] / sizes[name] for name in measured]) if measured else 1.0
+
+    def estimated_cost(model_name):
+        return costs.get(model_name, sizes[model_name] * seconds_per_byte)
+
+    return sorted(models.keys(), key=estimated_cost)
+
+def run_cascade(models, size_inputs, timer=None):
+    """
+    Predict model by model, cheapest first, until the vote is decided.
+    Returns: (probabilities by model name with shape (1, n_classes), skipped model names)
+    """
+    order = cascade_order(models)
+    probabilities = {}
+    for k, model_name in enumerate(order):
+        start = time.perf_counter()
+        probabilities[model_name] = predict_model(models, model_name, size_inputs)
+        seconds = time.perf_counter() - start
+        record_model_cost(model_name, seconds)
+        if timer is not None:
+            timer.add(f"predict.{model_name}", seconds)
+
+        pred_classes = [int(np.argmax(p[0])) for p in probabilities.values()]
+        if vote_decided(pred_classes, len(order) - k - 1):
+            break
+
+    skipped_models = [model_name for model_name in order if model_name not in probabilities]
+    return probabilities, skipped_models
+
+# -------------------------
+# Paddy-leaf gate
+# -------------------------
+# Optional small CNN (gate.py, trained with train_gate.py) that rejects clear
+# non-leaf uploads before any backbone runs. With GATE_ENABLED=1 it screens
+# every request, with or without the cascade; full_ensemble=True bypasses it.
+# GATE_THRESHOLD overrides the calibrated one.
+GATE_ENABLED = os.environ.get("GATE_ENABLED", "0") == "1"
+GATE_MODEL_PATH = os.environ.get("GATE_MODEL_PATH", "./model/gate_model.keras")
+GATE_THRESHOLD = float(os.environ["GATE_THRESHOLD"]) if os.environ.get("GATE_THRESHOLD") else None
+
+_gate = None
+_gate_version = None
+_gate_failed = False
+_gate_lock = threading.Lock()
+
+def get_gate():
+    """The loaded gate, or None when it is disabled or could not be loaded"""
+    global _gate, _gate_version, _gate_failed
+    if not GATE_ENABLED or _gate_failed:
+        return None
+    with _gate_lock:
+        if _gate is None and not _gate_failed:
+            try:
+                _gate = Gate.load(GATE_MODEL_PATH, GATE_THRESHOLD)
+                _gate_version = f"gate:{os.path.getmtime(GATE_MODEL_PATH)}:{_gate.threshold:g}"
+                print(f"Loaded gate model from {GATE_MODEL_PATH} (threshold {_gate.threshold:.3f})")
+            except Exception as e:
+                _gate_failed = True
+                print(f"Gate disabled, failed to load {GATE_MODEL_PATH}: {e}")
+        return _gate
+
+def gate_version():
+    """Cache-key part for the gate, without loading it (it may still be loading in the background)"""
+    if _gate_failed:
+        return "nogate"
+    return _gate_version or "gate:loading"
+
+# -------------------------
+# Warm-up
+# -------------------------
+def warm_up_model(model_name, model):
+    """
+    Trace the model's compiled graph and record its cost for the cascade.
+    TFLite-backed models are skipped: their Keras model is only used to
+    convert and to explain, and warming it up would keep it in memory.
+    """
+    if model_backend(model_name) == "tflite":
+        return
+    input_size = MODEL_CONFIGS[model_name]["input_size"]
+    size_inputs = {input_size: tf.zeros((1, input_size[0], input_size[1], 3), dtype=tf.float32)}
+    runner = get_ensemble_runner({model_name: model})
+    runner(size_inputs)
+    start = time.perf_counter()
+    runner(size_inputs)
+    record_model_cost(model_name, time.perf_counter() - start)
+
+    # Build (and trace) the Grad-CAM sub-model once instead of per request
+    try:
+        get_gradcam_step(model, (input_size[0], input_size[1], 3))(size_inputs[input_size], tf.constant(0))
+    except Exception as e:
+        print(f"Grad-CAM is not available for {model_name}: {e}")
+    print(f"Warmed up {model_name} model")
+
+models.on_load = warm_up_model
+
 # -------------------------
 # Custom JSON Encoder for NumPy types
 # -------------------------
@@ -263,265 +1121,435 @@ class NumpyEncoder(json.JSONEncoder):
             return bool(obj)
         return super(NumpyEncoder, self).default(obj)
 
+# -------------------------
+# Analysis Result
+# -------------------------
+@dataclass
+class AnalysisResult:
+    """Everything one analysis produces, kept in memory until a sink needs it"""
+    image_name: str
+    analysis_date: str
+    analysis_data: dict
+    agreement_matrix: np.ndarray
+    is_paddy: bool
+    final_prediction: str
+    final_confidence: float
+    best_model: str = None
+    render_level: str = "full"
+    image_format: str = None
+    summary: dict = field(default_factory=dict)
+    report: str = ""
+    images: dict = field(default_factory=dict)  # file name -> encoded bytes
+    skipped_models: list = field(default_factory=list)  # not evaluated by the cascade
+    explainer: str = None  # None when no explanations were generated
+    explanation_samples: dict = field(default_factory=dict)  # model name -> samples the explainer used
+    heatmaps: dict = field(default_factory=dict)  # model name -> (h, w) explanation in [0, 1]
+    gate_score: float = None  # None when the gate did not run
+    gate_rejected: bool = False  # declared not a paddy leaf by the gate, no backbone ran
+    timings: dict = field(default_factory=dict)  # stage name -> seconds, see metrics.StageTimer
+
+    def summary_json(self):
+        """The JSON summary as written to multi_model_summary.json"""
+        return json.dumps(self.summary, indent=4, cls=NumpyEncoder)
+
+def compute_agreement_matrix(analysis_data):
+    """Pairwise agreement weighted by the average confidence of agreeing models"""
+    model_names_list = list(analysis_data.keys())
+    agreement_matrix = np.zeros((len(model_names_list), len(model_names_list)))
+
+    for i, model1 in enumerate(model_names_list):
+        for j, model2 in enumerate(model_names_list):
+            if i == j:
+                agreement_matrix[i, j] = 1.0  # Same model always agrees
+            else:
+                # Calculate agreement based on prediction similarity
+                pred1 = analysis_data[model1]["pred_class"]
+                pred2 = analysis_data[model2]["pred_class"]
+                conf1 = analysis_data[model1]["confidence"]
+                conf2 = analysis_data[model2]["confidence"]
+
+                if pred1 == pred2:
+                    # Models agree on class, weight by average confidence
+                    agreement_matrix[i, j] = (conf1 + conf2) / 200
+                else:
+                    # Models disagree
+                    agreement_matrix[i, j] = 0
+
+    return agreement_matrix
+
+def build_json_summary(result, class_labels):
+    """Build the JSON summary of an analysis"""
+    analysis_data = result.analysis_data
+    model_names_list = list(analysis_data.keys())
+
+    json_summary = {
+        "image_path": result.image_name,
+        "analysis_date": result.analysis_date,
+        "is_paddy_leaf": bool(result.is_paddy),  # Convert numpy bool to Python bool
+        "final_prediction": str(result.final_prediction),
+        "final_confidence": float(result.final_confidence),
+        "best_model": str(result.best_model) if result.best_model else None,
+        "skipped_models": list(result.skipped_models),
+        "explainer": result.explainer,
+        "explanation_samples": dict(result.explanation_samples),
+        "gate_score": result.gate_score,
+        "model_predictions": {},
+        "model_agreement": {}
+    }
+
+    # Add model predictions
+    for model_name, data in analysis_data.items():
+        json_summary["model_predictions"][model_name] = {
+            "predicted_class": str(class_labels[data["pred_class"]]),
+            "confidence": float(data["confidence"]),
+            "all_predictions": {str(class_labels[i]): float(prob * 100) for i, prob in enumerate(data["predictions"])}
+        }
+
+    # Add model agreement
+    for i, model1 in enumerate(model_names_list):
+        for j, model2 in enumerate(model_names_list):
+            if i != j:
+                key = f"{model1}_{model2}"
+                pred1 = analysis_data[model1]["pred_class"]
+                pred2 = analysis_data[model2]["pred_class"]
+                json_summary["model_agreement"][key] = {
+                    "agree": bool(pred1 == pred2),  # Convert numpy bool to Python bool
+                    "class1": str(class_labels[pred1]),
+                    "class2": str(class_labels[pred2]),
+                    "agreement_score": float(result.agreement_matrix[i, j])
+                }
+
+    return json_summary
+
+def build_report(result, class_labels):
+    """Build the plain-text analysis report"""
+    lines = [
+        "MULTI-MODEL EXPLAINABLE AI ANALYSIS REPORT",
+        "=" * 60,
+        "",
+        f"Image: {result.image_name}",
+        f"Analysis Date: {result.analysis_date}",
+        "",
+        "FINAL DETERMINATION:",
+        "-" * 30
+    ]
+    if result.is_paddy:
+        lines.append(f"This is a paddy leaf with {result.final_prediction}")
+        lines.append(f"Highest confidence: {result.final_confidence:.2f}% from {result.best_model}")
+    elif result.gate_rejected:
+        lines.append("This is NOT a paddy leaf")
+        lines.append(f"Rejected by the gate model (score {result.gate_score:.3f}), no backbone was run")
+    else:
+        lines.append("This is NOT a paddy leaf")
+        lines.append("Not enough model agreement to identify a paddy leaf disease")
+
+    lines += ["", "MODEL PREDICTIONS:", "-" * 30]
+    for model_name, data in result.analysis_data.items():
+        lines.append(f"{model_name}: {class_labels[data['pred_class']]} ({data['confidence']:.2f}%)")
+
+    for model_name in result.skipped_models:
+        lines.append(f"{model_name}: skipped ({'rejected by the gate' if result.gate_rejected else 'vote already decided'})")
+
+    lines += ["", "DETAILED PREDICTIONS:", "-" * 30]
+    for model_name, data in result.analysis_data.items():
+        lines.append(f"\n{model_name}:")
+        top_5_indices = np.argsort(data["predictions"])[-5:][::-1]
+        for idx in top_5_indices:
+            lines.append(f"  {class_labels[idx]}: {data['predictions'][idx]*100:.2f}%")
+
+    summary_figures = {
+        "multi_model_comparison": "Side-by-side model comparisons",
+        "confidence_comparison": "Confidence scores across classes",
+        "agreement_matrix": "Model agreement visualization"
+    }
+    lines += ["", "Generated Files:"]
+    for stem, description in summary_figures.items():
+        fname = image_filename(stem, result.image_format)
+        if fname in result.images:
+            lines.append(f"- {fname} - {description}")
+    lines.append("- multi_model_summary.json - JSON summary of all results")
+    for model_name in result.analysis_data.keys():
+        fname = image_filename(model_name + "_explanation", result.image_format)
+        if fname in result.images:
+            samples = result.explanation_samples.get(model_name)
+            lines.append(f"- {fname} - Individual model explanation ({result.explainer}"
+                         + (f", {samples} samples)" if samples else ")"))
+
+    return "\n".join(lines) + "\n"
+
 # -------------------------
 # Main Multi-Model Explainable AI Function
 # -------------------------
-def generate_multi_model_explanations(img_path, models, class_labels, output_dir=None):
+def analyze_image_bytes(img_bytes, models, class_labels, image_name="upload", render_level=None, image_format=None,
+                        cascade=None, timer=None, on_event=None, explainer=None, budget_ms=None, use_gate=None):
     """
-    Generate explainable AI visualizations for all models and save as images
+    Run the full multi-model analysis on encoded image bytes, entirely in memory.
+    cascade: stop evaluating models once the agreement vote is decided and skip
+    explanations for non-paddy images (defaults to CASCADE_ENABLED)
+    use_gate: reject clear non-leaf images with the gate before any model runs
+    (defaults to GATE_ENABLED)
+    timer: StageTimer that receives the stage durations (a new one if None)
+    on_event: optional on_event(event, payload) callback fired as partial
+    results become available - "diagnosis" once the vote is decided,
+    "figure" / "explanation" as each figure is encoded
+    explainer: one of EXPLAINERS (defaults to EXPLAINER); with budget_ms and no
+    explainer, the most detailed one expected to finish within the budget
+    Returns: AnalysisResult with predictions, agreement, determination,
+    report/summary, the encoded figures and the stage timings
     """
-    if output_dir is None:
-        output_dir = create_output_directory()
+    render_level = validate_render_level(render_level)
+    if explainer is not None:
+        validate_explainer(explainer)
+    if cascade is None:
+        cascade = CASCADE_ENABLED
+    if use_gate is None:
+        use_gate = GATE_ENABLED
+    if timer is None:
+        timer = StageTimer()
+    emit = on_event or (lambda event, payload: None)
 
     print(f"Generating explainable AI visualizations for all models...")
-    print(f"Output directory: {output_dir}")
 
-    try:
-        # Create a summary figure comparing all models
-        n_models = len(models)
-        fig, axes = plt.subplots(n_models, 4, figsize=(20, 5 * n_models))
-
-        if n_models == 1:
-            axes = axes.reshape(1, -1)  # Ensure 2D array even for single model
-
-        analysis_data = {}
-
-        # Print header for predictions
-        print("\n" + "="*80)
-        print("MODEL PREDICTIONS:")
-        print("="*80)
-
-        for i, (model_name, model) in enumerate(models.items()):
-            print(f"Processing {model_name}...")
-
-            # Preprocess image for this specific model
-            original_img, img_tensor, img_preprocessed = preprocess_image(img_path, model_name)
-
-            # Get predictions
-            predictions = model.predict(img_preprocessed)
-            pred_class = np.argmax(predictions[0])
-            confidence = predictions[0][pred_class] * 100
-
-            # Print prediction to terminal
-            print(f"{model_name.upper():<15}: {class_labels[pred_class]:<30} ({confidence:.2f}%)")
-
-            # Store analysis data
-            analysis_data[model_name] = {
-                "pred_class": pred_class,
-                "confidence": confidence,
-                "predictions": predictions[0]
-            }
-
-            # Generate explanation
-            explanation = generate_smoothgrad_explanation(img_preprocessed, model, pred_class, n_samples=30)
-
-            # Save individual model explanation
-            save_model_explanation(
-                original_img, explanation, model_name, pred_class, confidence,
-                f"{model_name}_explanation.png", output_dir
-            )
-
-            # Add to summary figure
-            # Original image (only once)
-            if i == 0:
-                axes[i, 0].imshow(original_img)
-                axes[i, 0].set_title("Original Image")
-            else:
-                axes[i, 0].axis('off')
-
-            # Heatmap
-            axes[i, 1].imshow(explanation, cmap='hot')
-            axes[i, 1].set_title(f"{model_name} Heatmap")
-            axes[i, 1].axis('off')
-
-            # Overlay
-            overlay, _ = create_heatmap_overlay(original_img, explanation, cv2.COLORMAP_JET)
-            axes[i, 2].imshow(overlay)
-            axes[i, 2].set_title(f"{model_name} Overlay")
-            axes[i, 2].axis('off')
-
-            # Prediction text
-            axes[i, 3].text(0.1, 0.5,
-                           f"Model: {model_name}\n"
-                           f"Prediction: {class_labels[pred_class]}\n"
-                           f"Confidence: {confidence:.1f}%",
-                           fontsize=12, va='center')
-            axes[i, 3].axis('off')
-
-        print("="*80)
-
-        plt.suptitle(f"Multi-Model Explainable AI Analysis", fontsize=20)
-        plt.tight_layout()
-        plt.savefig(os.path.join(output_dir, 'multi_model_comparison.png'), dpi=300, bbox_inches='tight')
-        plt.close()
+    analysis_data = {}
+    explanations = {}
+    images = {}
+
+    # Decode once and share the resized tensors across the ensemble
+    with timer.stage("preprocess"):
+        original_img, model_inputs, preprocess_stats = preprocess_for_models(img_bytes, list(models.keys()))
+    print(f"Preprocessing: {preprocess_stats['decodes']} decode, "
+          f"{preprocess_stats['resizes']} resizes ({preprocess_stats['decodes_saved']} decodes saved)")
+
+    size_inputs = size_inputs_from(model_inputs)
+    gate = get_gate() if use_gate else None
+    gate_score = None
+    if gate is not None:
+        with timer.stage("gate"):
+            gate_score = gate.score(original_img)
+    gate_rejected = gate is not None and not gate.passes(gate_score)
+    if gate_rejected:
+        # Clearly not a leaf - skip the backbones and explanations altogether
+        print(f"Gate: not a paddy leaf (score {gate_score:.3f} < {gate.threshold:.3f})")
+        probabilities, skipped_models = {}, list(models.keys())
+    elif cascade:
+        # Cheapest models first, stopping once the vote is decided
+        probabilities, skipped_models = run_cascade(models, size_inputs, timer)
+    else:
+        # Run all models in one graph execution
+        with timer.stage("predict.ensemble"):
+            stacked = predict_ensemble(models, size_inputs)
+        probabilities = {model_name: stacked[i] for i, model_name in enumerate(models.keys())}
+        skipped_models = []
+
+    # Print header for predictions
+    print("\n" + "="*80)
+    print("MODEL PREDICTIONS:")
+    print("="*80)
+
+    for model_name in models.keys():
+        if model_name not in probabilities:
+            print(f"{model_name.upper():<15}: skipped ({'rejected by the gate' if gate_rejected else 'vote already decided'})")
+            continue
+
+        # Get predictions
+        predictions = probabilities[model_name]
+        pred_class = np.argmax(predictions[0])
+        confidence = predictions[0][pred_class] * 100
+
+        # Print prediction to terminal
+        print(f"{model_name.upper():<15}: {class_labels[pred_class]:<30} ({confidence:.2f}%)")
+
+        # Store analysis data
+        analysis_data[model_name] = {
+            "pred_class": pred_class,
+            "confidence": confidence,
+            "predictions": predictions[0]
+        }
 
-        # Create prediction confidence comparison
-        plt.figure(figsize=(12, 8))
-        x_pos = np.arange(len(class_labels))
-        colors = plt.cm.Set3(np.linspace(0, 1, len(models)))
-
-        for j, (model_name, data) in enumerate(analysis_data.items()):
-            plt.plot(x_pos, data["predictions"] * 100, 'o-', color=colors[j],
-                    label=model_name, linewidth=2, markersize=8)
-
-        plt.xlabel('Class Labels')
-        plt.ylabel('Confidence (%)')
-        plt.title('Model Confidence Comparison Across Classes')
-        plt.xticks(x_pos, class_labels, rotation=45, ha='right')
-        plt.legend()
-        plt.grid(True, alpha=0.3)
-        plt.tight_layout()
-        plt.savefig(os.path.join(output_dir, 'confidence_comparison.png'), dpi=300, bbox_inches='tight')
-        plt.close()
-
-        # Create agreement matrix
-        agreement_matrix = np.zeros((len(models), len(models)))
-        model_names_list = list(models.keys())
-
-        for i, model1 in enumerate(model_names_list):
-            for j, model2 in enumerate(model_names_list):
-                if i == j:
-                    agreement_matrix[i, j] = 1.0  # Same model always agrees
+    print("="*80)
+
+    # Create agreement matrix
+    agreement_matrix = compute_agreement_matrix(analysis_data)
+    model_names_list = list(analysis_data.keys())
+
+    # Print agreement summary to terminal
+    print("\nMODEL AGREEMENT SUMMARY:")
+    print("="*80)
+    for i, model1 in enumerate(model_names_list):
+        for j, model2 in enumerate(model_names_list):
+            if i < j:  # Only show each pair once
+                pred1 = analysis_data[model1]["pred_class"]
+                pred2 = analysis_data[model2]["pred_class"]
+
+                if pred1 == pred2:
+                    print(f"{model1.upper()} and {model2.upper():<10}: AGREE on {class_labels[pred1]}")
                 else:
-                    # Calculate agreement based on prediction similarity
-                    pred1 = analysis_data[model1]["pred_class"]
-                    pred2 = analysis_data[model2]["pred_class"]
-                    conf1 = analysis_data[model1]["confidence"]
-                    conf2 = analysis_data[model2]["confidence"]
-
-                    if pred1 == pred2:
-                        # Models agree on class, weight by average confidence
-                        agreement_matrix[i, j] = (conf1 + conf2) / 200
-                    else:
-                        # Models disagree
-                        agreement_matrix[i, j] = 0
-
-        # Print agreement summary to terminal
-        print("\nMODEL AGREEMENT SUMMARY:")
-        print("="*80)
-        for i, model1 in enumerate(model_names_list):
-            for j, model2 in enumerate(model_names_list):
-                if i < j:  # Only show each pair once
-                    pred1 = analysis_data[model1]["pred_class"]
-                    pred2 = analysis_data[model2]["pred_class"]
-
-                    if pred1 == pred2:
-                        print(f"{model1.upper()} and {model2.upper():<10}: AGREE on {class_labels[pred1]}")
-                    else:
-                        print(f"{model1.upper()} and {model2.upper():<10}: DISAGREE ({class_labels[pred1]} vs {class_labels[pred2]})")
-        print("="*80)
-
-        # Determine if it's a paddy leaf
-        is_paddy, final_prediction, final_confidence, best_model = is_paddy_leaf(analysis_data, class_labels)
-
-        # Print final determination
-        print("\nFINAL DETERMINATION:")
-        print("="*80)
-        if is_paddy:
-            print(f"✓ This is a paddy leaf with {final_prediction}")
-            print(f"  Highest confidence: {final_confidence:.2f}% from {best_model}")
-        else:
-            print(f"✗ This is NOT a paddy leaf")
-            print(f"  Not enough model agreement to identify a paddy leaf disease")
-        print("="*80)
+                    print(f"{model1.upper()} and {model2.upper():<10}: DISAGREE ({class_labels[pred1]} vs {class_labels[pred2]})")
+    print("="*80)
+
+    # Determine if it's a paddy leaf
+    is_paddy, final_prediction, final_confidence, best_model = is_paddy_leaf(analysis_data, class_labels)
+
+    # Print final determination
+    print("\nFINAL DETERMINATION:")
+    print("="*80)
+    if is_paddy:
+        print(f"✓ This is a paddy leaf with {final_prediction}")
+        print(f"  Highest confidence: {final_confidence:.2f}% from {best_model}")
+    else:
+        print(f"✗ This is NOT a paddy leaf")
+        print(f"  Not enough model agreement to identify a paddy leaf disease")
+    print("="*80)
+
+    # The diagnosis is final here - streaming clients get it before any figure
+    emit("diagnosis", {
+        "is_paddy": bool(is_paddy),
+        "disease": str(final_prediction),
+        "confidence": float(final_confidence),
+        "best_model": best_model,
+        "predictions": {model_name: {"class": class_labels[data["pred_class"]],
+                                     "confidence": float(data["confidence"])}
+                        for model_name, data in analysis_data.items()},
+        "skipped_models": list(skipped_models),
+        "gate_score": gate_score
+    })
+
+    # The charts only need the predictions, so they go out before the explanations
+    if render_level != "none" and analysis_data:
+        # Create prediction confidence comparison
+        add_figure(images, "confidence_comparison", image_format, timer, lambda: render_confidence_chart(
+            {model_name: data["predictions"] for model_name, data in analysis_data.items()}, class_labels
+        ), emit)
 
         # Plot agreement matrix
-        plt.figure(figsize=(10, 8))
-        plt.imshow(agreement_matrix, cmap='RdYlGn', vmin=0, vmax=1)
-        plt.colorbar(label='Agreement Score')
-        plt.xticks(np.arange(len(model_names_list)), model_names_list, rotation=45)
-        plt.yticks(np.arange(len(model_names_list)), model_names_list)
-        plt.title('Model Agreement Matrix')
-
-        # Add text annotations
-        for i in range(len(model_names_list)):
-            for j in range(len(model_names_list)):
-                plt.text(j, i, f'{agreement_matrix[i, j]:.2f}',
-                        ha='center', va='center', color='black' if agreement_matrix[i, j] > 0.5 else 'black')
-
-        plt.tight_layout()
-        plt.savefig(os.path.join(output_dir, 'agreement_matrix.png'), dpi=300, bbox_inches='tight')
-        plt.close()
-
-        # Create JSON summary
-        json_summary = {
-            "image_path": img_path,
-            "analysis_date": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            "is_paddy_leaf": bool(is_paddy),  # Convert numpy bool to Python bool
-            "final_prediction": str(final_prediction),
-            "final_confidence": float(final_confidence),
-            "best_model": str(best_model) if best_model else None,
-            "model_predictions": {},
-            "model_agreement": {}
-        }
+        add_figure(images, "agreement_matrix", image_format, timer,
+                   lambda: render_agreement_matrix(agreement_matrix, model_names_list), emit)
+
+    # Explanations are only needed when figures are rendered, and the cascade
+    # does not explain images that are not paddy leaves
+    explain = render_level != "none" and (is_paddy or not cascade)
+    explainer = choose_explainer(explainer, budget_ms, list(analysis_data)) if explain else None
+    if explain:
+        print(f"Explainer: {explainer}")
+    explanation_samples = {}
+    explain_start = time.perf_counter()
+    for k, (model_name, data) in enumerate(analysis_data.items() if explain else []):
+        print(f"Explaining {model_name}...")
+        _, img_preprocessed = model_inputs[model_name]
+        pred_class, confidence = data["pred_class"], data["confidence"]
+
+        # With a budget, each model gets an equal share of what is left of it
+        time_budget = None
+        if budget_ms is not None:
+            remaining = budget_ms / 1000 - (time.perf_counter() - explain_start)
+            time_budget = max(remaining, 0.0) / (len(analysis_data) - k)
+
+        # Generate explanation
+        with timer.stage(f"{explainer}.{model_name}"):
+            explanation, samples = explain_model(explainer, model_name, models[model_name], img_preprocessed,
+                                                 pred_class, time_budget)
+        explanations[model_name] = explanation
+        explanation_samples[model_name] = samples
+        print(f"{explainer} for {model_name} used {samples} sample(s)")
+
+        # Individual model explanation
+        if render_level == "full":
+            add_figure(images, f"{model_name}_explanation", image_format, timer, lambda: render_model_explanation(
+                original_img, explanation, model_name,
+                f"{model_name}: {class_labels[pred_class]} ({confidence:.1f}%)"
+            ), emit, model_name=model_name, samples=samples)
+        else:
+            emit("explanation", {"model": model_name, "name": None, "image": None, "samples": samples})
+
+    # Summary figures
+    if render_level != "none" and explanations:
+        comparison_rows = [{
+            "model_name": model_name,
+            "explanation": explanation,
+            "lines": [f"Model: {model_name}",
+                      f"Prediction: {class_labels[analysis_data[model_name]['pred_class']]}",
+                      f"Confidence: {analysis_data[model_name]['confidence']:.1f}%"]
+        } for model_name, explanation in explanations.items()]
+        add_figure(images, "multi_model_comparison", image_format, timer,
+                   lambda: render_comparison(original_img, comparison_rows), emit)
+
+    result = AnalysisResult(
+        image_name=image_name,
+        analysis_date=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        analysis_data=analysis_data,
+        agreement_matrix=agreement_matrix,
+        is_paddy=bool(is_paddy),
+        final_prediction=str(final_prediction),
+        final_confidence=float(final_confidence),
+        best_model=best_model,
+        render_level=render_level,
+        image_format=image_format,
+        images=images,
+        skipped_models=skipped_models,
+        explainer=explainer,
+        explanation_samples=explanation_samples,
+        heatmaps=explanations,
+        gate_score=gate_score,
+        gate_rejected=gate_rejected,
+        timings=timer.durations
+    )
+    with timer.stage("report"):
+        result.summary = build_json_summary(result, class_labels)
+        result.report = build_report(result, class_labels)
+
+    print(f"\nMulti-model explainable AI analysis complete!")
+    return result
+
+def add_figure(images, stem, image_format, timer, render_fn, emit, model_name=None, samples=None):
+    """Render a figure, store its encoded bytes (timing both steps) and emit it"""
+    with timer.stage("render"):
+        figure = render_fn()
+    fname = image_filename(stem, image_format)
+    with timer.stage("encode"):
+        images[fname] = encode_image(figure, image_format)
+
+    if model_name is None:
+        emit("figure", {"name": fname, "image": images[fname]})
+    else:
+        emit("explanation", {"model": model_name, "name": fname, "image": images[fname], "samples": samples})
 
-        # Add model predictions
-        for model_name, data in analysis_data.items():
-            json_summary["model_predictions"][model_name] = {
-                "predicted_class": str(class_labels[data["pred_class"]]),
-                "confidence": float(data["confidence"]),
-                "all_predictions": {str(class_labels[i]): float(prob * 100) for i, prob in enumerate(data["predictions"])}
-            }
-
-        # Add model agreement
-        for i, model1 in enumerate(model_names_list):
-            for j, model2 in enumerate(model_names_list):
-                if i != j:
-                    key = f"{model1}_{model2}"
-                    pred1 = analysis_data[model1]["pred_class"]
-                    pred2 = analysis_data[model2]["pred_class"]
-                    json_summary["model_agreement"][key] = {
-                        "agree": bool(pred1 == pred2),  # Convert numpy bool to Python bool
-                        "class1": str(class_labels[pred1]),
-                        "class2": str(class_labels[pred2]),
-                        "agreement_score": float(agreement_matrix[i, j])
-                    }
-
-        # Save JSON summary with custom encoder
-        with open(os.path.join(output_dir, 'multi_model_summary.json'), 'w') as f:
-            json.dump(json_summary, f, indent=4, cls=NumpyEncoder)
-
-        # Create analysis report
-        with open(os.path.join(output_dir, 'multi_model_analysis_report.txt'), 'w') as f:
-            f.write("MULTI-MODEL EXPLAINABLE AI ANALYSIS REPORT\n")
-            f.write("=" * 60 + "\n\n")
-            f.write(f"Image: {img_path}\n")
-            f.write(f"Analysis Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-
-            f.write("FINAL DETERMINATION:\n")
-            f.write("-" * 30 + "\n")
-            if is_paddy:
-                f.write(f"This is a paddy leaf with {final_prediction}\n")
-                f.write(f"Highest confidence: {final_confidence:.2f}% from {best_model}\n")
-            else:
-                f.write("This is NOT a paddy leaf\n")
-                f.write("Not enough model agreement to identify a paddy leaf disease\n")
-
-            f.write("\nMODEL PREDICTIONS:\n")
-            f.write("-" * 30 + "\n")
-            for model_name, data in analysis_data.items():
-                f.write(f"{model_name}: {class_labels[data['pred_class']]} ({data['confidence']:.2f}%)\n")
-
-            f.write("\nDETAILED PREDICTIONS:\n")
-            f.write("-" * 30 + "\n")
-            for model_name, data in analysis_data.items():
-                f.write(f"\n{model_name}:\n")
-                top_5_indices = np.argsort(data["predictions"])[-5:][::-1]
-                for idx in top_5_indices:
-                    f.write(f"  {class_labels[idx]}: {data['predictions'][idx]*100:.2f}%\n")
-
-            f.write(f"\nGenerated Files:\n")
-            f.write("- multi_model_comparison.png - Side-by-side model comparisons\n")
-            f.write("- confidence_comparison.png - Confidence scores across classes\n")
-            f.write("- agreement_matrix.png - Model agreement visualization\n")
-            f.write("- multi_model_summary.json - JSON summary of all results\n")
-            for model_name in models.keys():
-                f.write(f"- {model_name}_explanation.png - Individual model explanation\n")
-
-        print(f"\nMulti-model explainable AI analysis complete!")
-        print(f"All visualizations saved in: {output_dir}")
+def write_artifacts(result, output_dir):
+    """Disk sink: write the figures, JSON summary and report of a result to output_dir"""
+    os.makedirs(output_dir, exist_ok=True)
 
-        return output_dir
+    for fname, img_bytes in result.images.items():
+        with open(os.path.join(output_dir, fname), "wb") as f:
+            f.write(img_bytes)
+
+    # Save JSON summary with custom encoder
+    with open(os.path.join(output_dir, 'multi_model_summary.json'), 'w') as f:
+        f.write(result.summary_json())
+
+    # Create analysis report
+    with open(os.path.join(output_dir, 'multi_model_analysis_report.txt'), 'w') as f:
+        f.write(result.report)
+
+    print(f"All visualizations saved in: {output_dir}")
+    return output_dir
+
+def generate_multi_model_explanations(img_path, models, class_labels, output_dir=None, render_level=None,
+                                      image_format=None):
+    """
+    Generate explainable AI visualizations for all models and save as images.
+    render_level: "none" (diagnosis only), "summary" or "full" - see rendering.RENDER_LEVELS
+    """
+    if output_dir is None:
+        output_dir = create_output_directory()
+
+    print(f"Output directory: {output_dir}")
+
+    try:
+        with open(img_path, "rb") as f:
+            img_bytes = f.read()
+
+        result = analyze_image_bytes(img_bytes, models, class_labels, image_name=img_path,
+                                     render_level=render_level, image_format=image_format)
+        return write_artifacts(result, output_dir)
 
     except Exception as e:
         print(f"Error during multi-model analysis: {e}")
@@ -534,12 +1562,40 @@ def generate_multi_model_explanations(img_path, models, class_labels, output_dir
 # -------------------------
 # FastAPI Backend
 # -------------------------
-from fastapi import FastAPI, File, UploadFile
-from fastapi.responses import JSONResponse
-import shutil
-
-app = FastAPI()
-app = FastAPI()
+from email.utils import formatdate
+import mimetypes
+from fastapi import FastAPI, File, Query, Request, UploadFile
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from contextlib import asynccontextmanager
+from executor import InferenceExecutor, QueueFullError
+from cache import ResultCache
+from artifacts import ArtifactStore, artifact_etag, parse_byte_range
+from upload_limit import UploadLimitMiddleware
+from metrics import (FIRST_RESULT_SECONDS, IN_FLIGHT, MODEL_LOAD_SECONDS, MODELS_READY, QUEUE_DEPTH, REQUEST_SECONDS, REQUESTS,
+                     RESPONSE_BYTES, observe_stages, render_metrics, server_timing_header, timings_ms)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Load models in the background so the server binds right away;
+    # /ready reports 503 until every model is loaded and warmed up
+    if LAZY_MODEL_LOADING:
+        models.mark_ready()
+    else:
+        models.start_background_load(loader=load_for_serving)
+    if GATE_ENABLED:
+        threading.Thread(target=get_gate, name="gate-load", daemon=True).start()
+    if artifact_store is not None:
+        artifact_store.start_sweeper()
+    yield
+    if artifact_store is not None:
+        artifact_store.stop_sweeper()
+    inference_executor.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+# Uploads are capped while the body streams in, before multipart parsing buffers it
+MAX_UPLOAD_MB = float(os.environ.get("MAX_UPLOAD_MB", "25"))
+app.add_middleware(UploadLimitMiddleware, max_bytes=int(MAX_UPLOAD_MB * 1024 * 1024), paths=["/analyze"])
 
 # Define disease classes
 DISEASE_CLASSES = [
@@ -549,66 +1605,579 @@ DISEASE_CLASSES = [
 ]
 HEALTHY_CLASS = "Healthy Rice Leaf"
 
+WRITE_ARTIFACTS = os.environ.get("WRITE_ARTIFACTS", "0") == "1"
+# Send per-stage durations in a Server-Timing header; ?timings=true adds them to the body
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "1") == "1"
+
+# -------------------------
+# Inference executor
+# -------------------------
+def default_inference_workers():
+    """One worker per intra-op thread group, so concurrent requests do not oversubscribe the CPU"""
+    intra_op_threads = tf.config.threading.get_intra_op_parallelism_threads() or os.cpu_count()
+    workers = max(1, os.cpu_count() // intra_op_threads)
+
+    # Batchers can only fill up when enough requests are in flight at once
+    if BATCHING_ENABLED:
+        workers = max(workers, BATCH_MAX_SIZE)
+    return workers
+
+INFERENCE_EXECUTOR = os.environ.get("INFERENCE_EXECUTOR", "thread")
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "0")) or TUNING.get("inference_workers") or \
+    default_inference_workers()
+INFERENCE_QUEUE_SIZE = int(os.environ.get("INFERENCE_QUEUE_SIZE", "8"))
+INFERENCE_RETRY_AFTER = int(os.environ.get("INFERENCE_RETRY_AFTER", "5"))
+
+inference_executor = InferenceExecutor(INFERENCE_WORKERS, INFERENCE_QUEUE_SIZE, kind=INFERENCE_EXECUTOR,
+                                       retry_after=INFERENCE_RETRY_AFTER)
+
+# -------------------------
+# Artifact store
+# -------------------------
+# With WRITE_ARTIFACTS=1 every request's figures, summary and report go to
+# ARTIFACT_DIR/<artifact_id>/; a background sweeper deletes them after
+# ARTIFACT_MAX_AGE_HOURS and evicts the least recently used ones beyond ARTIFACT_MAX_MB
+ARTIFACT_DIR = os.environ.get("ARTIFACT_DIR", "./output/artifacts")
+ARTIFACT_MAX_AGE_HOURS = float(os.environ.get("ARTIFACT_MAX_AGE_HOURS", "24"))
+ARTIFACT_MAX_MB = float(os.environ.get("ARTIFACT_MAX_MB", "1024"))
+ARTIFACT_SWEEP_SECONDS = float(os.environ.get("ARTIFACT_SWEEP_SECONDS", "300"))
+
+artifact_store = ArtifactStore(
+    ARTIFACT_DIR,
+    max_age_seconds=ARTIFACT_MAX_AGE_HOURS * 3600 or None,
+    max_bytes=int(ARTIFACT_MAX_MB * 1024 * 1024) or None,
+    sweep_interval=ARTIFACT_SWEEP_SECONDS
+) if WRITE_ARTIFACTS else None
+
+def save_artifacts(result):
+    """Write a result to its own store directory; returns the artifact ID, or None if writing failed"""
+    try:
+        with artifact_store.reserve() as (artifact_id, output_dir):
+            write_artifacts(result, output_dir)
+        return artifact_id
+    except Exception as e:
+        # The partial directory is already removed - the diagnosis is still returned
+        print(f"Could not write artifacts: {e}")
+        return None
+
+def artifact_urls(artifact_id):
+    """File name -> GET /artifacts URL of everything stored for a request"""
+    return {fname: f"/artifacts/{artifact_id}/{fname}" for fname in sorted(os.listdir(artifact_store.path(artifact_id)))}
+
+# -------------------------
+# Result cache
+# -------------------------
+CACHE_ENABLED = os.environ.get("CACHE_ENABLED", "1") == "1"
+CACHE_MEMORY_MAX_MB = float(os.environ.get("CACHE_MEMORY_MAX_MB", "256"))
+CACHE_DISK_DIR = os.environ.get("CACHE_DISK_DIR") or None
+CACHE_DISK_MAX_MB = float(os.environ.get("CACHE_DISK_MAX_MB", "2048"))
+CACHE_PERCEPTUAL = os.environ.get("CACHE_PERCEPTUAL", "0") == "1"
+CACHE_PERCEPTUAL_DISTANCE = int(os.environ.get("CACHE_PERCEPTUAL_DISTANCE", "4"))
+
+def compute_model_version(models):
+    """Identify the loaded model set by name and weight file size/mtime"""
+    parts = []
+    for model_name in models.keys():
+        backend = model_backend(model_name)
+        if backend == "tflite":
+            backend += "-" + MODEL_CONFIGS[model_name].get("quantization", TFLITE_QUANTIZATION)
+        path = MODEL_PATHS.get(model_name)
+        if path and os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f"{model_name}:{backend}:{stat.st_size}:{int(stat.st_mtime)}")
+        else:
+            parts.append(f"{model_name}:{backend}:{id(models[model_name])}")
+    return ",".join(parts)
+
+_model_version = (None, None)
+
+def model_version(models):
+    """compute_model_version, recomputed only when the model set or the registry's loads change"""
+    global _model_version
+    state = (tuple(models), getattr(models, "generation", None))
+    cached_state, version = _model_version
+    if state != cached_state:
+        version = compute_model_version(models)
+        _model_version = (state, version)
+    return version
+
+result_cache = ResultCache(
+    memory_max_bytes=int(CACHE_MEMORY_MAX_MB * 1024 * 1024),
+    disk_dir=CACHE_DISK_DIR,
+    disk_max_bytes=int(CACHE_DISK_MAX_MB * 1024 * 1024),
+    perceptual=CACHE_PERCEPTUAL,
+    max_distance=CACHE_PERCEPTUAL_DISTANCE
+) if CACHE_ENABLED else None
+
+def cache_variant(render_level, image_format, cascade, explainer=None, budget_ms=None, response_format="full",
+                  use_gate=False):
+    """Everything besides the image bytes that changes the /analyze response"""
+    # The budget picks the explainer when none is named, and always caps how
+    # many SmoothGrad samples are taken
+    explanation = validate_explainer(explainer) if explainer is not None or budget_ms is None else "auto"
+    if budget_ms is not None:
+        explanation += f"+budget{budget_ms:g}"
+    return f"{model_version(models)}|{render_level}|{image_format}|{'cascade' if cascade else 'full'}|" \
+           f"{gate_version() if use_gate else 'nogate'}|{explanation}|{response_format}"
+
+def run_analysis(img_bytes, image_name, render_level=None, image_format=None, cascade=None, on_event=None,
+                 explainer=None, budget_ms=None, use_gate=None):
+    """Executor entry point - uses this process's loaded models"""
+    return analyze_image_bytes(img_bytes, models, class_labels, image_name=image_name,
+                               render_level=render_level, image_format=image_format, cascade=cascade,
+                               on_event=on_event, explainer=explainer, budget_ms=budget_ms, use_gate=use_gate)
+
+def disease_status_code(disease_name):
+    """0 = healthy, 1 = known disease, 2 = not a paddy leaf / unknown"""
+    if disease_name == HEALTHY_CLASS:
+        return 0
+    elif disease_name in DISEASE_CLASSES:
+        return 1
+    else:
+        return 2
+
+# -------------------------
+# Response formats
+# -------------------------
+# Picked with ?format= or an Accept header of application/vnd.paddy.<format>+json:
+#   full     - every figure inlined as base64 plus report and summary (the original response)
+#   lean     - the diagnosis and per-model probabilities only
+#   thumbs   - lean plus downscaled JPEG/WebP thumbnails of the figures
+#   heatmaps - lean plus each model's heatmap as a small uint8 array the client overlays itself
+# Full-size figures are served from GET /artifacts/{id}/{name} when WRITE_ARTIFACTS=1.
+RESPONSE_FORMATS = ("full", "lean", "thumbs", "heatmaps")
+RESPONSE_FORMAT = os.environ.get("RESPONSE_FORMAT", "full")
+# Render level when the request does not set one: lean needs no figures or
+# explanations, heatmaps needs the explanations but not the per-model figures
+FORMAT_RENDER_LEVELS = {"lean": "none", "heatmaps": "summary"}
+THUMBNAIL_SIZE = int(os.environ.get("THUMBNAIL_SIZE", "256"))
+THUMBNAIL_FORMAT = os.environ.get("THUMBNAIL_FORMAT", "jpeg")
+THUMBNAIL_QUALITY = int(os.environ.get("THUMBNAIL_QUALITY", "70"))
+HEATMAP_SIZE = int(os.environ.get("HEATMAP_SIZE", "64"))
+FORMAT_MEDIA_TYPE = "application/vnd.paddy.{}+json"
+
+def negotiate_response_format(response_format, accept=None):
+    """?format= first, then the first vendor media type in Accept, then RESPONSE_FORMAT"""
+    if response_format is None:
+        for media_range in (accept or "").split(","):
+            media_type = media_range.split(";")[0].strip().lower()
+            prefix, suffix = FORMAT_MEDIA_TYPE.split("{}")
+            if media_type.startswith(prefix) and media_type.endswith(suffix):
+                response_format = media_type[len(prefix):-len(suffix)]
+                break
+    if response_format is None:
+        response_format = RESPONSE_FORMAT
+    if response_format not in RESPONSE_FORMATS:
+        raise ValueError(f"Unknown response format '{response_format}', expected one of {RESPONSE_FORMATS}")
+    return response_format
+
+def encode_thumbnail(img_bytes):
+    """Downscaled THUMBNAIL_FORMAT copy of an encoded figure"""
+    img = cv2.cvtColor(cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+    return encode_image(bound_resolution(img, THUMBNAIL_SIZE), THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+
+def encode_heatmap(heatmap):
+    """A 0-1 heatmap as a row-major uint8 array at most HEATMAP_SIZE on its longest side"""
+    heatmap = np.clip(np.nan_to_num(np.asarray(heatmap, dtype=np.float32)), 0, 1)
+    height, width = heatmap.shape
+    scale = min(1.0, HEATMAP_SIZE / max(height, width))
+    if scale < 1.0:
+        heatmap = cv2.resize(heatmap, (max(1, round(width * scale)), max(1, round(height * scale))),
+                             interpolation=cv2.INTER_AREA)
+    data = np.round(heatmap * 255).astype(np.uint8)
+    return {"width": data.shape[1], "height": data.shape[0], "dtype": "uint8",
+            "data": base64.b64encode(data.tobytes()).decode("utf-8")}
+
+def lean_response(result):
+    """Diagnosis and per-model probabilities (in the order of "classes")"""
+    return {
+        "disease": result.final_prediction,
+        "status_code": disease_status_code(result.final_prediction),
+        "is_paddy": result.is_paddy,
+        "confidence": round(result.final_confidence, 2),
+        "best_model": result.best_model,
+        "classes": list(class_labels),
+        "predictions": {model_name: {
+            "class": class_labels[data["pred_class"]],
+            "confidence": round(float(data["confidence"]), 2),
+            "probabilities": [round(float(p), 4) for p in data["predictions"]]
+        } for model_name, data in result.analysis_data.items()},
+        "skipped_models": list(result.skipped_models),
+        "explainer": result.explainer,
+        "explanation_samples": dict(result.explanation_samples),
+        "gate_score": result.gate_score
+    }
+
+def build_analysis_response(result, response_format="full"):
+    """Serialize an AnalysisResult into the /analyze response body of a response format"""
+    if result is None and response_format != "full":
+        return {"disease": "Unknown", "status_code": 2, "skipped_models": []}
+    if result is None:
+        # Analysis failed - same shape the client always received
+        return {
+            "disease": "Unknown",
+            "status_code": 2,
+            "report": None,
+            "summary": None,
+            "skipped_models": [],
+            "images": {}
+        }
+
+    if response_format == "full":
+        return {
+            "disease": result.final_prediction,
+            "status_code": disease_status_code(result.final_prediction),
+            "report": result.report,
+            "summary": result.summary_json(),
+            "skipped_models": list(result.skipped_models),
+            "images": {fname: base64.b64encode(img_bytes).decode("utf-8")
+                       for fname, img_bytes in result.images.items()}
+        }
+
+    response = lean_response(result)
+    if response_format == "thumbs":
+        response["thumbnails"] = {
+            image_filename(os.path.splitext(fname)[0], THUMBNAIL_FORMAT):
+                base64.b64encode(encode_thumbnail(img_bytes)).decode("utf-8")
+            for fname, img_bytes in result.images.items()
+        }
+    elif response_format == "heatmaps":
+        response["heatmaps"] = {model_name: encode_heatmap(heatmap) for model_name, heatmap in result.heatmaps.items()}
+    return response
+
 @app.post("/analyze")
-async def analyze_image(file: UploadFile = File(...)):
-    temp_dir = "temp_uploads"
-    os.makedirs(temp_dir, exist_ok=True)
-
-    temp_path = os.path.join(temp_dir, file.filename)
-    with open(temp_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    # Run your model
-    output_dir = generate_multi_model_explanations(temp_path, models, class_labels)
-
-    # Read report file
-    report_file = os.path.join(output_dir, "multi_model_analysis_report.txt")
-    report_content = None
-    if os.path.exists(report_file):
-        with open(report_file, "r") as f:
-            report_content = f.read()
-
-    # Read summary file
-    summary_file = os.path.join(output_dir, "multi_model_summary.json")
-    summary_content = None
-    disease_name = "Unknown"
-    status_code = 2  # default "Not Paddy"
-
-    if os.path.exists(summary_file):
-        with open(summary_file, "r") as f:
-            summary_content = f.read()
+async def analyze_image(request: Request, file: UploadFile = File(...), render: str = None, image_format: str = None,
+                        full_ensemble: bool = False, timings: bool = False, explainer: str = None,
+                        budget_ms: float = None, response_format: str = Query(None, alias="format")):
+    IN_FLIGHT.inc()
+    try:
+        return await handle_analyze(file, render, image_format, full_ensemble, timings, explainer, budget_ms,
+                                    response_format, request.headers.get("accept"))
+    finally:
+        IN_FLIGHT.dec()
+
+def timed_response(content, timer, request_start, cache, include_timings, headers=None, status_code=200,
+                   response_format="full"):
+    """JSONResponse with the request's stage timings attached and recorded"""
+    timer.add("total", time.perf_counter() - request_start)
+    if include_timings:
+        content = dict(content, timings=timings_ms(timer.durations))
+
+    headers = dict(headers or {}, Vary="Accept")
+    if SERVER_TIMING:
+        headers["Server-Timing"] = server_timing_header(timer.durations)
+    response = JSONResponse(status_code=status_code, content=content, headers=headers or None)
+
+    observe_stages({name: seconds for name, seconds in timer.durations.items() if name != "total"})
+    REQUEST_SECONDS.labels(cache=cache).observe(timer.durations["total"])
+    RESPONSE_BYTES.labels(format=response_format).observe(len(response.body))
+    return response
+
+async def off_loop(fn, *args, **kwargs):
+    """
+    Run blocking response work (thumbnail/heatmap encoding, JSON serialization,
+    cache and artifact writes) on a thread, so it does not stall other
+    connections. Uses the loop's default pool: the inference workers stay free
+    for analyses, and a process pool could not take these closures.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, lambda: fn(*args, **kwargs))
+
+async def handle_analyze(file, render, image_format, full_ensemble, include_timings, explainer, budget_ms,
+                         response_format=None, accept=None):
+    request_start = time.perf_counter()
+    timer = StageTimer()
+    try:
+        response_format = negotiate_response_format(response_format, accept)
+        if render is None:
+            render = FORMAT_RENDER_LEVELS.get(response_format)
+        render = validate_render_level(render)
+        image_format = validate_image_format(image_format)
+        if explainer is not None:
+            explainer = validate_explainer(explainer)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+
+    with timer.stage("upload_read"):
+        img_bytes = await file.read()
+    cascade = CASCADE_ENABLED and not full_ensemble
+    use_gate = GATE_ENABLED and not full_ensemble
+
+    # Repeated uploads are answered from the cache
+    if result_cache is not None:
+        variant = cache_variant(render, image_format, cascade, explainer, budget_ms, response_format, use_gate)
+        with timer.stage("cache_lookup"):
+            cache_key, cached = result_cache.get(img_bytes, variant)
+        if cached is not None:
+            REQUESTS.labels(outcome="cache_hit").inc()
+            return await off_loop(timed_response, cached, timer, request_start, "hit", include_timings,
+                                  headers={"X-Cache": "HIT"}, response_format=response_format)
+
+    # Run your model on the inference pool so the event loop stays responsive
+    inference_start = time.perf_counter()
+    try:
+        result = await inference_executor.run(run_analysis, img_bytes, file.filename, render, image_format,
+                                             cascade, None, explainer, budget_ms, use_gate)
+    except QueueFullError as e:
+        REQUESTS.labels(outcome="rejected").inc()
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Server is busy, please retry later"},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except Exception as e:
+        print(f"Error during multi-model analysis: {e}")
+        import traceback
+        traceback.print_exc()
+        result = None
+
+    # Queue wait plus everything the worker did; the worker's own stages are merged below
+    timer.add("inference", time.perf_counter() - inference_start)
+    if result is not None:
+        for name, seconds in result.timings.items():
+            timer.add(name, seconds)
+    REQUESTS.labels(outcome="ok" if result is not None else "error").inc()
+
+    def finish():
+        # Optional disk sink for the generated artifacts
+        artifact_id = None
+        if artifact_store is not None and result is not None:
+            with timer.stage("artifact_write"):
+                artifact_id = save_artifacts(result)
+
+        with timer.stage("serialize"):
+            response = build_analysis_response(result, response_format)
+        if result_cache is not None and result is not None:
+            result_cache.put(cache_key, response, img_bytes, variant)
 
+        # Artifacts expire, so their ID and URLs are not part of the cached response
+        if artifact_id is not None:
+            response = dict(response, artifact_id=artifact_id, artifacts=artifact_urls(artifact_id))
+
+        return timed_response(response, timer, request_start, "miss" if result_cache is not None else "disabled",
+                              include_timings, headers={"X-Cache": "MISS"} if result_cache is not None else None,
+                              response_format=response_format)
+
+    return await off_loop(finish)
+
+# -------------------------
+# Streaming analysis
+# -------------------------
+# /analyze/stream answers with NDJSON events, one JSON object per line:
+#   diagnosis   - predictions and the paddy-leaf determination (first line)
+#   figure      - one summary figure {"name", "image"} as soon as it is encoded
+#   explanation - one model's explanation figure {"model", "name", "image"}
+#   done        - report, summary, timings, time_to_first_result_ms and total_ms
+#   error       - the analysis failed; nothing follows
+def ndjson_line(event, payload):
+    payload = dict(payload, event=event)
+    if payload.get("image") is not None:
+        payload["image"] = base64.b64encode(payload["image"]).decode("utf-8")
+    return (json.dumps(payload, cls=NumpyEncoder) + "\n").encode("utf-8")
+
+def cached_stream_events(cached):
+    """Replay a cached /analyze response as stream events"""
+    yield "diagnosis", {"disease": cached["disease"], "status_code": cached["status_code"],
+                        "skipped_models": cached["skipped_models"], "cached": True}
+    for fname, image in cached["images"].items():
+        yield "figure", {"name": fname, "image": base64.b64decode(image)}
+    yield "done", {"report": cached["report"], "summary": cached["summary"]}
+
+@app.post("/analyze/stream")
+async def analyze_image_stream(file: UploadFile = File(...), render: str = None, image_format: str = None,
+                               full_ensemble: bool = False, explainer: str = None, budget_ms: float = None):
+    request_start = time.perf_counter()
+    timer = StageTimer()
+    try:
+        render_level = validate_render_level(render)
+        image_format = validate_image_format(image_format)
+        if explainer is not None:
+            explainer = validate_explainer(explainer)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+
+    with timer.stage("upload_read"):
+        img_bytes = await file.read()
+    cascade = CASCADE_ENABLED and not full_ensemble
+    use_gate = GATE_ENABLED and not full_ensemble
+
+    cache_key = variant = None
+    if result_cache is not None:
+        variant = cache_variant(render_level, image_format, cascade, explainer, budget_ms, use_gate=use_gate)
+        with timer.stage("cache_lookup"):
+            cache_key, cached = result_cache.get(img_bytes, variant)
+        if cached is not None:
+            REQUESTS.labels(outcome="cache_hit").inc()
+
+            async def replay():
+                for k, (event, payload) in enumerate(cached_stream_events(cached)):
+                    if k == 0:
+                        FIRST_RESULT_SECONDS.labels(cache="hit").observe(time.perf_counter() - request_start)
+                    yield ndjson_line(event, payload)
+            return StreamingResponse(replay(), media_type="application/x-ndjson", headers={"X-Cache": "HIT"})
+
+    # Worker threads hand events to the event loop; a process pool cannot
+    # call back, so there every event arrives when the analysis finishes
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    def on_event(event, payload):
+        loop.call_soon_threadsafe(events.put_nowait, (event, payload))
+
+    try:
+        task = inference_executor.start(run_analysis, img_bytes, file.filename, render_level, image_format, cascade,
+                                        on_event if inference_executor.kind == "thread" else None,
+                                        explainer, budget_ms, use_gate)
+    except QueueFullError as e:
+        REQUESTS.labels(outcome="rejected").inc()
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Server is busy, please retry later"},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+    async def stream():
+        # Counted inside the generator: if the client goes away before the
+        # first chunk, the generator never runs and neither inc nor dec happens
+        IN_FLIGHT.inc()
+        first_result = None
         try:
-            summary_json = json.loads(summary_content)
-            disease_name = summary_json.get("final_prediction", "Unknown")
-
-            # Assign status code
-            if disease_name == HEALTHY_CLASS:
-                status_code = 0
-            elif disease_name in DISEASE_CLASSES:
-                status_code = 1
-            else:
-                status_code = 2
-        except Exception:
-            pass
-
-    # Encode images to base64
-    image_data = {}
-    for fname in os.listdir(output_dir):
-        if fname.endswith(".png"):
-            with open(os.path.join(output_dir, fname), "rb") as img_f:
-                b64_img = base64.b64encode(img_f.read()).decode("utf-8")
-                image_data[fname] = b64_img
-
-    # Clean temp
-    os.remove(temp_path)
-
-    response = {
-        "disease": disease_name,
-        "status_code": status_code,   # New mapped key
-        "report": report_content,
-        "summary": summary_content,
-        "images": image_data
+            while True:
+                next_event = asyncio.ensure_future(events.get())
+                await asyncio.wait({next_event, task}, return_when=asyncio.FIRST_COMPLETED)
+                if not next_event.done():
+                    next_event.cancel()
+                    break
+                event, payload = next_event.result()
+                if event == "diagnosis":
+                    first_result = time.perf_counter() - request_start
+                    FIRST_RESULT_SECONDS.labels(cache="miss").observe(first_result)
+                    payload = dict(payload, status_code=disease_status_code(payload["disease"]),
+                                   elapsed_ms=round(first_result * 1000, 2))
+                yield ndjson_line(event, payload)
+
+            # Events queued just before the task finished
+            while not events.empty():
+                yield ndjson_line(*events.get_nowait())
+
+            try:
+                result = task.result()
+            except Exception as e:
+                print(f"Error during multi-model analysis: {e}")
+                REQUESTS.labels(outcome="error").inc()
+                yield ndjson_line("error", {"detail": "Analysis failed"})
+                return
+
+            response = await off_loop(build_analysis_response, result)
+            if inference_executor.kind != "thread":
+                # No callbacks from a process pool - replay the finished result
+                for event, payload in cached_stream_events(response):
+                    if event == "diagnosis":
+                        first_result = time.perf_counter() - request_start
+                        FIRST_RESULT_SECONDS.labels(cache="miss").observe(first_result)
+                    if event != "done":
+                        yield ndjson_line(event, payload)
+
+            REQUESTS.labels(outcome="ok").inc()
+            for name, seconds in result.timings.items():
+                timer.add(name, seconds)
+            if result_cache is not None:
+                await off_loop(result_cache.put, cache_key, response, img_bytes, variant)
+
+            total = time.perf_counter() - request_start
+            observe_stages(timer.durations)
+            REQUEST_SECONDS.labels(cache="miss" if result_cache is not None else "disabled").observe(total)
+            yield ndjson_line("done", {
+                "report": response["report"],
+                "summary": response["summary"],
+                "timings": timings_ms(timer.durations),
+                "time_to_first_result_ms": round(first_result * 1000, 2) if first_result is not None else None,
+                "total_ms": round(total * 1000, 2)
+            })
+        finally:
+            IN_FLIGHT.dec()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson",
+                             headers={"X-Cache": "MISS"} if result_cache is not None else None)
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    status = models.status()
+    status.setdefault("tflite", sorted(_tflite_models))  # a model host reports its own
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/stats/queue")
+async def queue_stats():
+    stats = inference_executor.stats()
+    stats["batching"] = batching_stats() if BATCHING_ENABLED else None
+    return stats
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    # Gauges that mirror state owned elsewhere are refreshed on scrape
+    status = models.status()
+    MODELS_READY.set(1 if status["ready"] else 0)
+    for model_name, seconds in status["load_seconds"].items():
+        MODEL_LOAD_SECONDS.labels(model=model_name).set(seconds)
+    QUEUE_DEPTH.set(inference_executor.stats()["queue_depth"])
+
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/artifacts/{artifact_id}/{name}")
+async def get_artifact(artifact_id: str, name: str, request: Request):
+    """One stored artifact file, cacheable by ETag and with single-range support"""
+    path = None
+    if artifact_store is not None and artifact_store.exists(artifact_id) and name == os.path.basename(name) \
+            and not name.startswith("."):
+        path = os.path.join(artifact_store.path(artifact_id), name)
+    if path is None or not os.path.isfile(path):
+        return JSONResponse(status_code=404, content={"detail": "Artifact not found"})
+    artifact_store.touch(artifact_id)
+
+    stat = os.stat(path)
+    etag = artifact_etag(artifact_id, name, stat.st_size)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        # Artifacts never change, they only expire with the store's retention
+        "Cache-Control": f"public, max-age={int(ARTIFACT_MAX_AGE_HOURS * 3600)}, immutable",
+        "Accept-Ranges": "bytes"
     }
-
-    return JSONResponse(content=response)    
\ No newline at end of file
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    byte_range = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if byte_range and (if_range is None or if_range.strip() == etag):
+        try:
+            span = parse_byte_range(byte_range, stat.st_size)
+        except ValueError:
+            return Response(status_code=416, headers=dict(headers, **{"Content-Range": f"bytes */{stat.st_size}"}))
+        if span is not None:
+            start, end = span
+            with open(path, "rb") as f:
+                f.seek(start)
+                content = f.read(end - start + 1)
+            return Response(content=content, status_code=206, media_type=media_type,
+                            headers=dict(headers, **{"Content-Range": f"bytes {start}-{end}/{stat.st_size}"}))
+
+    with open(path, "rb") as f:
+        content = f.read()
+    return Response(content=content, media_type=media_type, headers=headers)
+
+@app.get("/stats/artifacts")
+async def artifact_stats():
+    if artifact_store is None:
+        return {"enabled": False}
+    return dict(artifact_store.stats(), enabled=True)
+
+@app.get("/stats/cache")
+async def cache_stats():
+    if result_cache is None:
+        return {"enabled": False}
+    return dict(result_cache.stats(), enabled=True)
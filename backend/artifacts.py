@@ -0,0 +1,210 @@
+"""
+Disk store for per-request analysis artifacts with a retention policy.
+
+Every request gets its own directory named by a collision-free ID
+(timestamp + random suffix). A directory is only visible to the sweeper
+once its writer has finished; if writing raises, it is removed. The
+background sweeper deletes entries older than max_age and then evicts the
+least recently used ones (by mtime, refreshed by touch()) until the store
+fits max_bytes.
+"""
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+ARTIFACT_ID_PATTERN = re.compile(r"^[0-9]{8}_[0-9]{6}_[0-9a-f]{32}$")
+
+
+def new_artifact_id():
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex}"
+
+
+def directory_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for fname in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, fname))
+            except OSError:
+                pass  # removed while walking
+    return total
+
+
+class ArtifactStore:
+    """Per-request artifact directories under root, bounded by age and total size"""
+    def __init__(self, root, max_age_seconds=None, max_bytes=None, sweep_interval=300):
+        self.root = root
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+
+        self._lock = threading.Lock()
+        self._writing = set()
+        self._stop = threading.Event()
+        self._thread = None
+        self._counters = {"created": 0, "failed": 0, "expired": 0, "evicted": 0, "sweeps": 0}
+        self._last_sweep = None
+
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, artifact_id):
+        """Directory of an artifact; rejects anything that is not a store ID"""
+        if not ARTIFACT_ID_PATTERN.match(artifact_id):
+            raise KeyError(artifact_id)
+        return os.path.join(self.root, artifact_id)
+
+    def exists(self, artifact_id):
+        try:
+            return os.path.isdir(self.path(artifact_id))
+        except KeyError:
+            return False
+
+    @contextmanager
+    def reserve(self):
+        """
+        Yield (artifact_id, directory) for one request's artifacts. The
+        directory is deleted again if the block raises.
+        """
+        artifact_id = new_artifact_id()
+        path = self.path(artifact_id)
+        os.makedirs(path)  # never exist_ok: an ID is only used once
+        with self._lock:
+            self._writing.add(artifact_id)
+        try:
+            yield artifact_id, path
+        except BaseException:
+            shutil.rmtree(path, ignore_errors=True)
+            with self._lock:
+                self._counters["failed"] += 1
+            raise
+        else:
+            with self._lock:
+                self._counters["created"] += 1
+        finally:
+            with self._lock:
+                self._writing.discard(artifact_id)
+
+    def touch(self, artifact_id):
+        """Mark an artifact as recently used so LRU eviction keeps it longer"""
+        try:
+            os.utime(self.path(artifact_id))
+        except (KeyError, OSError):
+            pass
+
+    def _entries(self):
+        """(mtime, size, artifact_id) of every finished artifact"""
+        with self._lock:
+            writing = set(self._writing)
+        entries = []
+        for artifact_id in os.listdir(self.root):
+            path = os.path.join(self.root, artifact_id)
+            if artifact_id in writing or not ARTIFACT_ID_PATTERN.match(artifact_id) or not os.path.isdir(path):
+                continue
+            try:
+                entries.append((os.path.getmtime(path), directory_size(path), artifact_id))
+            except OSError:
+                continue
+        return entries
+
+    def _remove(self, artifact_id, counter):
+        shutil.rmtree(os.path.join(self.root, artifact_id), ignore_errors=True)
+        with self._lock:
+            self._counters[counter] += 1
+
+    def sweep(self):
+        """Apply the retention policy once; returns the number of removed artifacts"""
+        entries = sorted(self._entries())
+        removed = 0
+
+        if self.max_age_seconds:
+            cutoff = time.time() - self.max_age_seconds
+            while entries and entries[0][0] < cutoff:
+                self._remove(entries.pop(0)[2], "expired")
+                removed += 1
+
+        if self.max_bytes:
+            total = sum(size for _, size, _ in entries)
+            while entries and total > self.max_bytes:
+                _, size, artifact_id = entries.pop(0)
+                self._remove(artifact_id, "evicted")
+                total -= size
+                removed += 1
+
+        with self._lock:
+            self._counters["sweeps"] += 1
+            self._last_sweep = time.time()
+        return removed
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Artifact sweep failed: {e}")
+
+    def start_sweeper(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._sweep_loop, name="artifact-sweeper", daemon=True)
+            self._thread.start()
+
+    def stop_sweeper(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            stats = dict(self._counters)
+            stats["writing"] = len(self._writing)
+            last_sweep = self._last_sweep
+        stats["entries"] = len(entries)
+        stats["bytes"] = sum(size for _, size, _ in entries)
+        stats["oldest_age_seconds"] = time.time() - min(mtime for mtime, _, _ in entries) if entries else None
+        stats["last_sweep_age_seconds"] = time.time() - last_sweep if last_sweep else None
+        stats["root"] = self.root
+        stats["max_age_seconds"] = self.max_age_seconds
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+def artifact_etag(artifact_id, name, size):
+    """Strong ETag of an artifact file; files never change once their request has written them"""
+    digest = hashlib.sha1(f"{artifact_id}/{name}/{size}".encode("utf-8")).hexdigest()
+    return f'"{digest[:20]}"'
+
+
+def parse_byte_range(header, size):
+    """
+    Inclusive (start, end) of a single-range "bytes=" Range header, or None
+    when the header should be ignored (other units, several ranges, malformed).
+    Raises ValueError when the range cannot be satisfied.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    if not (first.isdigit() or first == "") or not (last.isdigit() or last == "") or first == last == "":
+        return None
+
+    if first == "":
+        # Suffix range: the last N bytes
+        start, end = max(0, size - int(last)), size - 1
+        if int(last) == 0:
+            raise ValueError(header)
+    else:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
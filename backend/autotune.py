@@ -0,0 +1,196 @@
+"""
+Calibrate CPU threading, concurrency and SmoothGrad chunking for this host.
+
+Every (intra-op, inter-op) thread combination runs in its own process,
+because TensorFlow's thread pools cannot be resized once an op has run.
+Each trial loads the models, feeds synthetic inputs at every MODEL_CONFIGS
+input size and measures:
+  - single-request ensemble latency
+  - ensemble throughput with 1, 2, 4, ... concurrent requests
+  - SmoothGrad latency for each chunk size
+The combination with the highest throughput wins (lower latency breaks
+near-ties), and the winning settings are written as a tuning profile that
+app.py applies at startup (see tuning.py).
+
+Usage:
+    python autotune.py --output tuning_profile.json
+    python autotune.py --standin-models --intra 1 2 4 --inter 1 2 --output /tmp/tuning_profile.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from tuning import apply_threading, save_tuning_profile
+
+TRIAL_MARKER = "AUTOTUNE_TRIAL "
+# Throughputs within this fraction of the best count as a tie
+THROUGHPUT_TIE = 0.05
+
+
+def default_thread_candidates():
+    cpus = os.cpu_count() or 1
+    intra = sorted({n for n in (1, 2, cpus // 4, cpus // 2, cpus) if n > 0})
+    inter = sorted({n for n in (1, 2, 4) if n <= cpus})
+    return intra, inter
+
+
+def default_worker_candidates():
+    cpus = os.cpu_count() or 1
+    return sorted({n for n in (1, 2, 4, 8, cpus) if n <= max(cpus, 1)})
+
+
+def run_trial(args):
+    """Measure one thread configuration in this process; prints the result as one marked JSON line"""
+    apply_threading({"intra_op_threads": args.trial_intra, "inter_op_threads": args.trial_inter})
+    with contextlib.redirect_stdout(io.StringIO()):
+        import tensorflow as tf
+        import app
+        if args.standin_models:
+            from standin_models import register_standin_models
+            register_standin_models(app.models, app.MODEL_CONFIGS)
+        app.models.load_all()
+    models = app.models
+    model_names = list(models.keys())
+
+    rng = np.random.default_rng(0)
+    size_inputs = {}
+    for model_name in model_names:
+        input_size = app.MODEL_CONFIGS[model_name]["input_size"]
+        size_inputs[input_size] = tf.constant(
+            rng.uniform(0, 255, (1, input_size[0], input_size[1], 3)).astype(np.float32))
+
+    # Single-request latency of the fused ensemble
+    for _ in range(2):
+        app.run_ensemble(models, size_inputs)
+    latencies = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        app.run_ensemble(models, size_inputs)
+        latencies.append(time.perf_counter() - start)
+
+    # Throughput with n requests in flight at once, as INFERENCE_WORKERS would allow
+    throughput = {}
+    for workers in args.workers:
+        def worker():
+            for _ in range(args.runs):
+                app.run_ensemble(models, size_inputs)
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        throughput[workers] = workers * args.runs / (time.perf_counter() - start)
+
+    # SmoothGrad over every model, per chunk size
+    smoothgrad = {}
+    for chunk_size in args.smoothgrad_chunks:
+        total = 0.0
+        for model_name in model_names:
+            config = app.MODEL_CONFIGS[model_name]
+            img_preprocessed = config["preprocess_func"](size_inputs[config["input_size"]])
+            app.generate_smoothgrad_explanation(img_preprocessed, models[model_name], 0,
+                                                n_samples=args.smoothgrad_samples, batch_size=chunk_size, seed=0)
+            start = time.perf_counter()
+            app.generate_smoothgrad_explanation(img_preprocessed, models[model_name], 0,
+                                                n_samples=args.smoothgrad_samples, batch_size=chunk_size, seed=0)
+            total += time.perf_counter() - start
+        smoothgrad[chunk_size] = total
+
+    result = {
+        "intra_op_threads": args.trial_intra,
+        "inter_op_threads": args.trial_inter,
+        "latency_ms_p50": float(np.percentile(latencies, 50)) * 1000,
+        "throughput_rps": {str(workers): rps for workers, rps in throughput.items()},
+        "smoothgrad_ms": {str(chunk_size): seconds * 1000 for chunk_size, seconds in smoothgrad.items()}
+    }
+    print(TRIAL_MARKER + json.dumps(result), flush=True)
+
+
+def launch_trial(intra, inter, args):
+    command = [sys.executable, os.path.abspath(__file__), "--trial-intra", str(intra), "--trial-inter", str(inter),
+               "--runs", str(args.runs), "--smoothgrad-samples", str(args.smoothgrad_samples),
+               "--workers", *map(str, args.workers), "--smoothgrad-chunks", *map(str, args.smoothgrad_chunks)]
+    if args.standin_models:
+        command.append("--standin-models")
+
+    # Trials must measure the defaults, not a previously written profile
+    env = dict(os.environ, TUNING_PROFILE="", TF_CPP_MIN_LOG_LEVEL="2")
+    completed = subprocess.run(command, env=env, capture_output=True, text=True)
+    for line in completed.stdout.splitlines():
+        if line.startswith(TRIAL_MARKER):
+            return json.loads(line[len(TRIAL_MARKER):])
+    print(completed.stderr[-2000:])
+    raise RuntimeError(f"Trial intra={intra} inter={inter} failed with code {completed.returncode}")
+
+
+def choose_settings(trials):
+    """Highest-throughput trial (lower latency breaks near-ties) and its best worker count / chunk size"""
+    def best_throughput(trial):
+        return max(trial["throughput_rps"].values())
+
+    top = max(best_throughput(trial) for trial in trials)
+    contenders = [trial for trial in trials if best_throughput(trial) >= (1 - THROUGHPUT_TIE) * top]
+    best = min(contenders, key=lambda trial: trial["latency_ms_p50"])
+
+    return {
+        "intra_op_threads": best["intra_op_threads"],
+        "inter_op_threads": best["inter_op_threads"],
+        "inference_workers": int(max(best["throughput_rps"], key=best["throughput_rps"].get)),
+        "smoothgrad_batch_size": int(min(best["smoothgrad_ms"], key=best["smoothgrad_ms"].get))
+    }
+
+
+def main():
+    intra_candidates, inter_candidates = default_thread_candidates()
+    parser = argparse.ArgumentParser(description="Sweep threading/concurrency settings and write a tuning profile")
+    parser.add_argument("--intra", type=int, nargs="+", default=intra_candidates, help="intra-op thread counts")
+    parser.add_argument("--inter", type=int, nargs="+", default=inter_candidates, help="inter-op thread counts")
+    parser.add_argument("--workers", type=int, nargs="+", default=default_worker_candidates(),
+                        help="concurrent request counts")
+    parser.add_argument("--smoothgrad-chunks", type=int, nargs="+", default=[5, 10, 15, 30])
+    parser.add_argument("--smoothgrad-samples", type=int, default=30)
+    parser.add_argument("--runs", type=int, default=10, help="measured calls per setting (and per worker)")
+    parser.add_argument("--standin-models", action="store_true", help="Use stand-ins instead of the .h5 models")
+    parser.add_argument("--output", default=None,
+                        help="Profile path (default tuning_profile.json; required with --standin-models)")
+    parser.add_argument("--trial-intra", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--trial-inter", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.trial_intra is not None:
+        run_trial(args)
+        return
+    if args.output is None:
+        if args.standin_models:
+            parser.error("--standin-models needs an explicit --output, so the server's tuning_profile.json "
+                         "is not replaced with settings tuned on stand-ins")
+        args.output = "tuning_profile.json"
+
+    trials = []
+    for intra in args.intra:
+        for inter in args.inter:
+            print(f"intra={intra} inter={inter}...")
+            trial = launch_trial(intra, inter, args)
+            trials.append(trial)
+            best_workers = max(trial["throughput_rps"], key=trial["throughput_rps"].get)
+            print(f"  p50 {trial['latency_ms_p50']:.1f} ms, "
+                  f"{trial['throughput_rps'][best_workers]:.2f} req/s with {best_workers} concurrent")
+
+    settings = choose_settings(trials)
+    save_tuning_profile(args.output, settings, trials, "stand-in" if args.standin_models else "real")
+    print(f"Tuned settings: {settings}")
+    print(f"Profile saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
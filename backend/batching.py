@@ -0,0 +1,100 @@
+"""
+Dynamic micro-batching for calls coming from concurrent inference workers.
+
+A MicroBatcher owns one dispatcher thread. Worker threads call submit(item)
+and block; the dispatcher collects items until max_batch_size is reached or
+max_delay has passed since the first one arrived, runs fn(items) once and
+hands each caller its own entry of the returned list. close() stops the
+dispatcher once the items queued before it are done.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """Collect items from concurrent callers and process them in one batch"""
+    def __init__(self, fn, max_batch_size=8, max_delay=0.005, name="batcher"):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._largest_batch = 0
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch_loop, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, item):
+        """Queue an item and block until its result is ready"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future))
+        return future.result()
+
+    def close(self):
+        """Stop the dispatcher thread, so fn (and whatever it references) can be freed"""
+        with self._start_lock:
+            if self._thread is not None:
+                self._queue.put((_STOP, None))
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        if batch[0][0] is _STOP:
+            return None
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry[0] is _STOP:
+                self._queue.put(entry)  # stop after this batch
+                break
+            batch.append(entry)
+        return batch
+
+    def _dispatch_loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            items = [item for item, _ in batch]
+            try:
+                results = self.fn(items)
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._largest_batch = max(self._largest_batch, len(batch))
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "batches": self._batches,
+                "items": self._items,
+                "mean_batch_size": self._items / self._batches if self._batches else 0.0,
+                "largest_batch": self._largest_batch,
+                "max_batch_size": self.max_batch_size,
+                "max_delay_ms": self.max_delay * 1000
+            }
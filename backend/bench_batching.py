@@ -0,0 +1,81 @@
+"""
+Throughput vs latency of batched ensemble prediction and SmoothGrad passes.
+
+For each batch size the ensemble runner and each model's per-sample
+gradient step are timed on synthetic inputs; results are written as JSON.
+
+Usage:
+    python bench_batching.py --batch-sizes 1 2 4 8 16 32 --runs 10 --output batching_cpu.json
+"""
+import argparse
+import json
+import os
+import platform
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from app import models, MODEL_CONFIGS, get_ensemble_runner, get_per_sample_gradient_step
+
+
+def time_call(fn, runs):
+    fn()  # warm-up / tracing
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return np.array(latencies)
+
+
+def summarize(latencies, batch_size):
+    return {
+        "batch_size": batch_size,
+        "latency_ms_p50": float(np.percentile(latencies, 50) * 1000),
+        "latency_ms_p90": float(np.percentile(latencies, 90) * 1000),
+        "throughput_per_s": float(batch_size / latencies.mean())
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-batching throughput/latency sweep")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", default="batching_benchmark.json")
+    args = parser.parse_args()
+
+    runner = get_ensemble_runner(models)
+    results = {
+        "host": {"machine": platform.machine(), "processor": platform.processor(), "cpus": os.cpu_count()},
+        "ensemble": [],
+        "smoothgrad": {model_name: [] for model_name in models}
+    }
+
+    for batch_size in args.batch_sizes:
+        size_inputs = {
+            size: tf.random.uniform((batch_size, size[0], size[1], 3), 0, 255)
+            for size in runner.input_sizes
+        }
+        row = summarize(time_call(lambda: runner(size_inputs), args.runs), batch_size)
+        results["ensemble"].append(row)
+        print(f"ensemble   batch {batch_size:>3}: p50 {row['latency_ms_p50']:9.2f} ms | "
+              f"{row['throughput_per_s']:8.2f} images/s")
+
+        for model_name, model in models.items():
+            input_size = MODEL_CONFIGS[model_name]["input_size"]
+            step = get_per_sample_gradient_step(model, (input_size[0], input_size[1], 3))
+            noisy = tf.random.normal((batch_size, input_size[0], input_size[1], 3))
+            class_indices = tf.zeros((batch_size,), dtype=tf.int32)
+            row = summarize(time_call(lambda: step(noisy, class_indices), args.runs), batch_size)
+            results["smoothgrad"][model_name].append(row)
+            print(f"{model_name:<10} batch {batch_size:>3}: p50 {row['latency_ms_p50']:9.2f} ms | "
+                  f"{row['throughput_per_s']:8.2f} samples/s")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
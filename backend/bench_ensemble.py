@@ -0,0 +1,60 @@
+"""
+Benchmark the fused EnsembleRunner against sequential model.predict calls.
+
+Usage:
+    python bench_ensemble.py --image "Leaf scald.jpg" --runs 20 [--jit]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app import models, preprocess_for_models, size_inputs_from, get_ensemble_runner
+
+
+def time_runs(fn, runs):
+    """Call fn `runs` times and return the latencies in milliseconds"""
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies)
+
+
+def report(name, latencies):
+    print(f"{name:<22}: mean {latencies.mean():8.2f} ms | p50 {np.percentile(latencies, 50):8.2f} ms | "
+          f"p90 {np.percentile(latencies, 90):8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sequential predict vs fused ensemble inference")
+    parser.add_argument("--image", default="Leaf scald.jpg")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--jit", action="store_true", help="Compile the fused graph with XLA")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        img_bytes = f.read()
+    _, model_inputs, _ = preprocess_for_models(img_bytes, list(models.keys()))
+
+    def sequential():
+        return np.stack([model.predict(model_inputs[name][1], verbose=0) for name, model in models.items()])
+
+    runner = get_ensemble_runner(models, jit_compile=args.jit)
+    size_inputs = size_inputs_from(model_inputs)
+
+    def fused():
+        return runner(size_inputs)
+
+    # Warm up both paths (tracing / adapter creation) before timing
+    sequential_probs = sequential()
+    fused_probs = fused()
+    print(f"Max abs probability difference: {np.abs(sequential_probs - fused_probs).max():.2e}")
+
+    report("sequential predict", time_runs(sequential, args.runs))
+    report("fused ensemble" + (" (XLA)" if args.jit else ""), time_runs(fused, args.runs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Memory and throughput of multi-worker serving, with and without the model host.
+
+For every worker count the server is started through serve.py twice:
+"replicated" (every uvicorn worker loads its own models) and "shared" (one
+model host process owns the models, the workers reach it through shared
+memory). Once /ready answers, the script records the resident memory of the
+whole process tree (RSS, and PSS, which splits shared pages fairly between
+processes) and then measures /analyze throughput and latency at a fixed
+client concurrency. Stand-in models are used unless --real-models is given;
+--weight-mb pads them to a realistic weight size.
+
+Usage:
+    python bench_serving.py --image "Leaf scald.jpg" --workers 1 2 4 8 --output serving_benchmark.json
+"""
+import argparse
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODES = ("replicated", "shared")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_tree(root_pid):
+    """root_pid and all its descendants, from /proc"""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; the ppid follows the closing parenthesis
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    pids, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def read_kb(path, field):
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def tree_memory_mb(root_pid):
+    pids = process_tree(root_pid)
+    return {
+        "processes": len(pids),
+        "rss_mb": sum(read_kb(f"/proc/{pid}/status", "VmRSS") for pid in pids) / 1024,
+        "pss_mb": sum(read_kb(f"/proc/{pid}/smaps_rollup", "Pss") for pid in pids) / 1024
+    }
+
+
+def multipart_body(img_bytes, filename):
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: image/jpeg\r\n\r\n").encode("utf-8") + img_bytes + f"\r\n--{boundary}--\r\n".encode("utf-8")
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def wait_ready(base_url, process, timeout, consecutive=8):
+    """
+    Wait until /ready answers 200 several times in a row (each worker answers
+    for itself); process is None for a server this script did not start
+    """
+    deadline = time.time() + timeout
+    ready_in_a_row = 0
+    while ready_in_a_row < consecutive:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        if time.time() > deadline:
+            raise RuntimeError(f"Server was not ready within {timeout}s")
+        try:
+            with urllib.request.urlopen(base_url + "/ready", timeout=5) as response:
+                ready_in_a_row = ready_in_a_row + 1 if response.status == 200 else 0
+        except (urllib.error.URLError, OSError):
+            ready_in_a_row = 0
+            time.sleep(0.5)
+
+
+def run_load(url, body, content_type, requests, concurrency):
+    """Send `requests` POSTs with `concurrency` clients; returns latencies (s), errors and wall time"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def one(_):
+        request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=300) as response:
+                response.read()
+            with lock:
+                latencies.append(time.perf_counter() - start)
+        except (urllib.error.URLError, OSError) as e:
+            with lock:
+                errors.append(str(e))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def bench_config(mode, workers, args, body, content_type):
+    port = free_port()
+    host_address = os.path.join(tempfile.gettempdir(), f"paddy-bench-{uuid.uuid4().hex[:8]}.sock")
+    env = dict(os.environ, CACHE_ENABLED="0", WRITE_ARTIFACTS="0")
+    env.pop("MODEL_HOST", None)
+    if not args.real_models:
+        env.update(STANDIN_MODELS="1", STANDIN_WEIGHT_MB=str(args.weight_mb))
+
+    command = [sys.executable, os.path.join(HERE, "serve.py"), "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(workers)]
+    if mode == "shared":
+        command += ["--model-host", "--host-address", host_address]
+
+    base_url = f"http://127.0.0.1:{port}"
+    url = f"{base_url}/analyze?render={args.render}&full_ensemble=true"
+    log = open(os.path.join(tempfile.gettempdir(), f"bench_serving_{mode}_{workers}.log"), "w")
+    process = subprocess.Popen(command, cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT,
+                               start_new_session=True)
+    try:
+        start = time.perf_counter()
+        wait_ready(base_url, process, args.startup_timeout, consecutive=2 * workers)
+        startup_seconds = time.perf_counter() - start
+
+        # Every worker traces its graphs on its first requests
+        run_load(url, body, content_type, args.concurrency * workers, args.concurrency)
+        memory = tree_memory_mb(process.pid)
+
+        latencies, errors, wall = run_load(url, body, content_type, args.requests, args.concurrency)
+        latencies_ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+        memory_after = tree_memory_mb(process.pid)
+        return {
+            "mode": mode,
+            "workers": workers,
+            "startup_seconds": startup_seconds,
+            "memory_idle": memory,
+            "memory_after_load": memory_after,
+            "requests": args.requests,
+            "errors": len(errors),
+            "error_samples": errors[:3],
+            "throughput_rps": len(latencies) / wall,
+            "latency_ms": {
+                "mean": float(latencies_ms.mean()),
+                "p50": float(np.percentile(latencies_ms, 50)),
+                "p95": float(np.percentile(latencies_ms, 95)),
+                "max": float(latencies_ms.max())
+            }
+        }
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+        log.close()
+        if os.path.exists(host_address):
+            os.unlink(host_address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RSS and throughput of replicated vs shared-model serving")
+    parser.add_argument("--image", default="Leaf scald.jpg")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--render", default="none", help="render level of the benchmark requests")
+    parser.add_argument("--weight-mb", type=float, default=100.0,
+                        help="Weight size of each stand-in model (ignored with --real-models)")
+    parser.add_argument("--real-models", action="store_true", help="Use the .h5 models instead of stand-ins")
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    parser.add_argument("--output", default="serving_benchmark.json")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        body, content_type = multipart_body(f.read(), os.path.basename(args.image))
+
+    results = {
+        "host": {"machine": platform.machine(), "processor": platform.processor(), "cpus": os.cpu_count()},
+        "config": {"requests": args.requests, "concurrency": args.concurrency, "render": args.render,
+                   "models": "real" if args.real_models else f"stand-in ({args.weight_mb:g} MB each)"},
+        "runs": []
+    }
+    for workers in args.workers:
+        for mode in args.modes:
+            print(f"{mode} x{workers}...")
+            run = bench_config(mode, workers, args, body, content_type)
+            results["runs"].append(run)
+            print(f"  PSS {run['memory_after_load']['pss_mb']:.0f} MB, RSS {run['memory_after_load']['rss_mb']:.0f} MB, "
+                  f"{run['throughput_rps']:.2f} req/s, p50 {run['latency_ms']['p50']:.0f} ms, "
+                  f"p95 {run['latency_ms']['p95']:.0f} ms, {run['errors']} errors")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
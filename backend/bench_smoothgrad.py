@@ -0,0 +1,139 @@
+"""
+Adaptive SmoothGrad against the fixed 30-sample baseline.
+
+For every model, the baseline heatmap uses SMOOTHGRAD_SAMPLES samples with
+seed 0. Each adaptive setting (a convergence tolerance, or a per-model time
+budget) reuses seed 0, so its samples are a prefix of the baseline's, and is
+compared with it by:
+  - samples used and saved
+  - latency
+  - normalized L2 distance (as used for the stopping rule)
+  - Spearman rank correlation of the pixel saliencies
+  - IoU of the top 10% most salient pixels
+A second fixed run with another seed gives the noise floor: how far two
+equally good 30-sample heatmaps already are from each other. By default the
+real models are replaced with stand-ins (standin_models.py).
+
+Usage:
+    python bench_smoothgrad.py --image "Leaf scald.jpg" --output smoothgrad_adaptive.json
+    python bench_smoothgrad.py --tolerances 0.01 0.02 0.05 --budgets-ms 50 100 --real-models
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import time
+
+import numpy as np
+
+from app import (models, MODEL_CONFIGS, SMOOTHGRAD_SAMPLES, SMOOTHGRAD_MIN_SAMPLES, preprocess_for_models,
+                 size_inputs_from, predict_ensemble, run_smoothgrad, heatmap_change)
+from standin_models import register_standin_models
+
+TOP_FRACTION = 0.1
+
+
+def spearman(a, b):
+    """Rank correlation of two heatmaps (ties broken by position)"""
+    ranks_a = np.argsort(np.argsort(a.ravel())).astype(np.float64)
+    ranks_b = np.argsort(np.argsort(b.ravel())).astype(np.float64)
+    return float(np.corrcoef(ranks_a, ranks_b)[0, 1])
+
+
+def top_iou(a, b, fraction=TOP_FRACTION):
+    k = max(1, int(a.size * fraction))
+    top_a = set(np.argpartition(a.ravel(), -k)[-k:])
+    top_b = set(np.argpartition(b.ravel(), -k)[-k:])
+    return len(top_a & top_b) / len(top_a | top_b)
+
+
+def fidelity(heatmap, baseline):
+    return {"l2": heatmap_change(baseline, heatmap), "spearman": spearman(heatmap, baseline),
+            "top_iou": top_iou(heatmap, baseline)}
+
+
+def timed_smoothgrad(img_preprocessed, model, class_index, runs, **kwargs):
+    """(heatmap, samples, p50 ms) of run_smoothgrad; the first call warms it up"""
+    run_smoothgrad(img_preprocessed, model, class_index, **kwargs)
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        heatmap, samples = run_smoothgrad(img_preprocessed, model, class_index, **kwargs)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return heatmap, samples, float(np.percentile(latencies, 50))
+
+
+def bench_model(model_name, img_preprocessed, class_index, args):
+    model = models[model_name]
+    common = {"max_samples": args.samples, "min_samples": args.min_samples}
+    baseline, _, baseline_ms = timed_smoothgrad(img_preprocessed, model, class_index, args.runs,
+                                                max_samples=args.samples, seed=0)
+    other_seed, _ = run_smoothgrad(img_preprocessed, model, class_index, max_samples=args.samples, seed=1)
+
+    settings = [("tolerance", tolerance, {"tolerance": tolerance}) for tolerance in args.tolerances]
+    settings += [("budget_ms", budget_ms, {"time_budget": budget_ms / 1000}) for budget_ms in args.budgets_ms]
+    rows = []
+    for mode, value, kwargs in settings:
+        heatmap, samples, ms = timed_smoothgrad(img_preprocessed, model, class_index, args.runs, seed=0,
+                                                **common, **kwargs)
+        rows.append(dict({"mode": mode, "value": value, "samples": samples,
+                          "samples_saved": args.samples - samples, "p50_ms": ms,
+                          "speedup": baseline_ms / ms if ms else None}, **fidelity(heatmap, baseline)))
+
+    return {"baseline": {"samples": args.samples, "p50_ms": baseline_ms},
+            "noise_floor": fidelity(other_seed, baseline), "adaptive": rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Samples saved and heatmap fidelity of adaptive SmoothGrad")
+    parser.add_argument("--image", default="Leaf scald.jpg")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--samples", type=int, default=SMOOTHGRAD_SAMPLES, help="Baseline (and maximum) samples")
+    parser.add_argument("--min-samples", type=int, default=SMOOTHGRAD_MIN_SAMPLES)
+    parser.add_argument("--tolerances", type=float, nargs="*", default=[0.01, 0.02, 0.05, 0.1])
+    parser.add_argument("--budgets-ms", type=float, nargs="*", default=[])
+    parser.add_argument("--real-models", action="store_true", help="Use the .h5 models instead of stand-ins")
+    parser.add_argument("--output", default="smoothgrad_adaptive.json")
+    args = parser.parse_args()
+
+    if not args.real_models:
+        register_standin_models(models, MODEL_CONFIGS)
+
+    with open(args.image, "rb") as f:
+        img_bytes = f.read()
+    model_names = list(models.keys())
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, model_inputs, _ = preprocess_for_models(img_bytes, model_names)
+        stacked = predict_ensemble(models, size_inputs_from(model_inputs))
+
+    per_model = {}
+    for i, model_name in enumerate(model_names):
+        class_index = int(np.argmax(stacked[i][0]))
+        per_model[model_name] = result = bench_model(model_name, model_inputs[model_name][1], class_index, args)
+        floor = result["noise_floor"]
+        print(f"\n{model_name}: baseline {args.samples} samples in {result['baseline']['p50_ms']:.1f} ms "
+              f"(another seed: L2 {floor['l2']:.3f}, spearman {floor['spearman']:.3f}, "
+              f"top-10% IoU {floor['top_iou']:.3f})")
+        for row in result["adaptive"]:
+            print(f"  {row['mode']}={row['value']:<6g}: {row['samples']:>3} samples ({row['samples_saved']} saved), "
+                  f"{row['p50_ms']:7.1f} ms, L2 {row['l2']:.3f}, spearman {row['spearman']:.3f}, "
+                  f"top-10% IoU {row['top_iou']:.3f}")
+
+    results = {
+        "host": {"machine": platform.machine(), "processor": platform.processor(), "cpus": os.cpu_count(),
+                 "python": platform.python_version()},
+        "models": "real" if args.real_models else "standin",
+        "image": args.image,
+        "baseline_samples": args.samples,
+        "min_samples": args.min_samples,
+        "per_model": per_model
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Stage-level timings of the /analyze pipeline.
+
+Each stage (decode, prediction, gradient and SmoothGrad explanations, heatmap
+overlay, figure saving, JSON/report writing, base64 encoding) is timed on its
+own and written as JSON, together with the response body size of every
+/analyze response format. By default the real models are replaced with
+stand-ins (standin_models.py), so the suite runs without the .h5 files.
+With --compare, p50 timings are checked against a stored baseline and the
+script exits with status 1 if any stage regressed.
+
+Usage:
+    python bench_stages.py --image "Leaf scald.jpg" --runs 10 --output stages.json
+    python bench_stages.py --output stages_new.json --compare stages.json --tolerance 0.2
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from app import (models, class_labels, MODEL_CONFIGS, preprocess_image, preprocess_for_models, size_inputs_from,
+                 predict_ensemble, generate_gradient_explanation, generate_smoothgrad_explanation,
+                 save_model_explanation, analyze_image_bytes, build_json_summary, build_report, NumpyEncoder,
+                 build_analysis_response, RESPONSE_FORMATS, FORMAT_RENDER_LEVELS)
+from rendering import create_heatmap_overlay, image_filename
+from standin_models import register_standin_models
+
+STAGES = ("decode", "preprocess_all", "predict", "gradient_explanation", "smoothgrad_explanation",
+          "heatmap_overlay", "figure_saving", "json_report_writing", "base64_encoding", "end_to_end")
+
+
+def time_stage(fn, runs, warmup=1):
+    """Latency summary of fn() in milliseconds; its printing is silenced"""
+    latencies = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(warmup):
+            fn()
+        for _ in range(runs):
+            start = time.perf_counter()
+            fn()
+            latencies.append((time.perf_counter() - start) * 1000)
+    latencies = np.array(latencies)
+    return {
+        "runs": runs,
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p90_ms": float(np.percentile(latencies, 90))
+    }
+
+
+def run_stages(img_path, runs, smoothgrad_samples, work_dir):
+    with open(img_path, "rb") as f:
+        img_bytes = f.read()
+    model_names = list(models.keys())
+
+    original_img, model_inputs, _ = preprocess_for_models(img_bytes, model_names)
+    size_inputs = size_inputs_from(model_inputs)
+    stacked = predict_ensemble(models, size_inputs)
+    pred_classes = {model_name: int(np.argmax(stacked[i][0])) for i, model_name in enumerate(model_names)}
+    explanations = {
+        model_name: generate_gradient_explanation(model_inputs[model_name][1], models[model_name],
+                                                  pred_classes[model_name])
+        for model_name in model_names
+    }
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = analyze_image_bytes(img_bytes, models, class_labels, image_name=img_path, render_level="full",
+                                     cascade=False)
+
+    def gradient_all():
+        for model_name in model_names:
+            generate_gradient_explanation(model_inputs[model_name][1], models[model_name], pred_classes[model_name])
+
+    def smoothgrad_all():
+        for model_name in model_names:
+            generate_smoothgrad_explanation(model_inputs[model_name][1], models[model_name],
+                                            pred_classes[model_name], n_samples=smoothgrad_samples, seed=0)
+
+    def overlay_all():
+        for explanation in explanations.values():
+            create_heatmap_overlay(original_img, explanation)
+
+    def save_all():
+        for model_name, explanation in explanations.items():
+            save_model_explanation(original_img, explanation, model_name, pred_classes[model_name], 50.0,
+                                   image_filename(f"{model_name}_explanation"), work_dir)
+
+    def write_json_report():
+        summary = build_json_summary(result, class_labels)
+        with open(os.path.join(work_dir, "multi_model_summary.json"), "w") as f:
+            json.dump(summary, f, indent=4, cls=NumpyEncoder)
+        with open(os.path.join(work_dir, "multi_model_analysis_report.txt"), "w") as f:
+            f.write(build_report(result, class_labels))
+
+    stage_fns = {
+        "decode": lambda: preprocess_image(img_path, model_names[0]),
+        "preprocess_all": lambda: preprocess_for_models(img_bytes, model_names),
+        "predict": lambda: predict_ensemble(models, size_inputs),
+        "gradient_explanation": gradient_all,
+        "smoothgrad_explanation": smoothgrad_all,
+        "heatmap_overlay": overlay_all,
+        "figure_saving": save_all,
+        "json_report_writing": write_json_report,
+        "base64_encoding": lambda: build_analysis_response(result),
+        "end_to_end": lambda: analyze_image_bytes(img_bytes, models, class_labels, image_name=img_path,
+                                                  render_level="full", cascade=False, use_gate=False)
+    }
+
+    stages = {}
+    for stage in STAGES:
+        stages[stage] = time_stage(stage_fns[stage], runs)
+        print(f"{stage:<24}: p50 {stages[stage]['p50_ms']:9.2f} ms | p90 {stages[stage]['p90_ms']:9.2f} ms")
+    return stages
+
+
+def response_sizes(img_path):
+    """Bytes of the /analyze JSON body per response format, rendered as the endpoint does by default"""
+    with open(img_path, "rb") as f:
+        img_bytes = f.read()
+    sizes = {}
+    for response_format in RESPONSE_FORMATS:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = analyze_image_bytes(img_bytes, models, class_labels, image_name=img_path, cascade=False, use_gate=False,
+                                         render_level=FORMAT_RENDER_LEVELS.get(response_format))
+        sizes[response_format] = len(json.dumps(build_analysis_response(result, response_format)).encode("utf-8"))
+        print(f"{response_format:<24}: {sizes[response_format] / 1024:9.1f} KB")
+    return sizes
+
+
+def compare(stages, baseline, tolerance, min_delta_ms):
+    """Stages whose p50 grew by more than tolerance (and min_delta_ms) over the baseline"""
+    regressions = []
+    print(f"\n{'stage':<24} {'baseline':>10} {'current':>10} {'change':>8}")
+    for stage, timing in stages.items():
+        if stage not in baseline:
+            print(f"{stage:<24} {'-':>10} {timing['p50_ms']:10.2f}      new")
+            continue
+        before, after = baseline[stage]["p50_ms"], timing["p50_ms"]
+        change = (after - before) / before if before > 0 else 0.0
+        regressed = change > tolerance and after - before > min_delta_ms
+        print(f"{stage:<24} {before:10.2f} {after:10.2f} {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(stage)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage timings of the analysis pipeline")
+    parser.add_argument("--image", default="Leaf scald.jpg")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--smoothgrad-samples", type=int, default=30)
+    parser.add_argument("--real-models", action="store_true", help="Use the .h5 models instead of stand-ins")
+    parser.add_argument("--output", default="stage_benchmark.json")
+    parser.add_argument("--compare", default=None, help="Baseline JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p50 slowdown (0.2 = 20%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    if not args.real_models:
+        register_standin_models(models, MODEL_CONFIGS)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        stages = run_stages(args.image, args.runs, args.smoothgrad_samples, work_dir)
+    print("\nResponse sizes:")
+    sizes = response_sizes(args.image)
+
+    results = {
+        "host": {"machine": platform.machine(), "processor": platform.processor(), "cpus": os.cpu_count(),
+                 "python": platform.python_version()},
+        "models": "real" if args.real_models else "standin",
+        "image": args.image,
+        "smoothgrad_samples": args.smoothgrad_samples,
+        "stages": stages,
+        "response_bytes": sizes
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("models") != results["models"]:
+            print(f"Warning: baseline used {baseline.get('models')} models, this run used {results['models']}")
+        regressions = compare(stages, baseline["stages"], args.tolerance, args.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} stage(s) regressed: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
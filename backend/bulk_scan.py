@@ -0,0 +1,227 @@
+"""
+Offline bulk scan of a folder (or file list) of leaf photos.
+
+Files are read with an interleaved tf.data pipeline, decoded and resized in
+parallel (map with AUTOTUNE) and prefetched while the previous batch runs
+through the ensemble. The agreement rule is applied to each batch at once
+and one result per image is streamed to a JSONL or CSV file; files that
+cannot be read or decoded get an error row instead of stopping the scan. Processed paths
+are appended to a checkpoint file, so an interrupted scan resumes where it
+stopped. Explanation figures are only rendered with --render.
+
+Usage:
+    python bulk_scan.py survey_2024/ --output results.jsonl --batch-size 32
+    python bulk_scan.py --file-list files.txt --output results.csv --render summary
+"""
+import argparse
+import csv
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from app import (models, class_labels, MODEL_CONFIGS, decode_image, resize_for_model, run_ensemble,
+                 is_paddy_leaf_batch, analyze_image_bytes, write_artifacts)
+from rendering import RENDER_LEVELS
+from tflite_backend import IMAGE_FILE_EXTENSIONS
+
+
+def find_images(root):
+    """All image files under a directory, in a stable order"""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for fname in sorted(filenames):
+            if fname.lower().endswith(IMAGE_FILE_EXTENSIONS):
+                paths.append(os.path.join(dirpath, fname))
+    return paths
+
+
+def read_file_list(file_list):
+    with open(file_list) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def load_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path) as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+def read_file(path):
+    """(bytes, error) - a missing or unreadable file gives an error instead of stopping the scan"""
+    try:
+        with open(path.decode("utf-8"), "rb") as f:
+            return f.read(), b""
+    except OSError as e:
+        return b"", f"Could not read file: {e.strerror or e}".encode("utf-8")
+
+
+def build_dataset(paths, input_sizes, batch_size, read_parallelism):
+    """tf.data pipeline yielding (paths, errors, *raw batches per input size); error is "" when the image is usable"""
+    def decode_and_resize(img_bytes, error):
+        if not error:
+            try:
+                stored_img, _ = decode_image(img_bytes)
+                return (b"",) + tuple(resize_for_model(stored_img, size) for size in input_sizes)
+            except Exception:
+                error = b"Could not decode image"
+        return (error,) + tuple(np.zeros((size[0], size[1], 3), np.float32) for size in input_sizes)
+
+    def read(path):
+        img_bytes, error = tf.numpy_function(read_file, [path], [tf.string, tf.string])
+        img_bytes.set_shape(())
+        error.set_shape(())
+        return tf.data.Dataset.from_tensors((path, img_bytes, error))
+
+    def load(path, img_bytes, error):
+        outputs = tf.numpy_function(decode_and_resize, [img_bytes, error],
+                                    [tf.string] + [tf.float32] * len(input_sizes))
+        error, resized = outputs[0], outputs[1:]
+        for img, size in zip(resized, input_sizes):
+            img.set_shape((size[0], size[1], 3))
+        error.set_shape(())
+        return (path, error) + tuple(resized)
+
+    dataset = tf.data.Dataset.from_tensor_slices(paths)
+    # Interleave the file reads so slow storage is read from several files at once
+    dataset = dataset.interleave(read, cycle_length=read_parallelism, num_parallel_calls=tf.data.AUTOTUNE,
+                                 deterministic=True)
+    dataset = dataset.map(load, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+class ResultWriter:
+    """Append scan rows to a JSONL or CSV file"""
+    def __init__(self, path, model_names):
+        self.format = "csv" if path.lower().endswith(".csv") else "jsonl"
+        self.fieldnames = ["path", "is_paddy", "prediction", "confidence", "best_model", "error"] + \
+            [f"{model_name}_{field}" for model_name in model_names for field in ("class", "confidence")]
+
+        write_header = self.format == "csv" and (not os.path.exists(path) or os.path.getsize(path) == 0)
+        self.file = open(path, "a", newline="")
+        if self.format == "csv":
+            self.writer = csv.DictWriter(self.file, fieldnames=self.fieldnames)
+            if write_header:
+                self.writer.writeheader()
+
+    def write(self, row):
+        if self.format == "csv":
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + "\n")
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def batch_rows(paths, errors, probabilities, model_names):
+    """Result rows for one batch of stacked (n_models, batch, n_classes) probabilities"""
+    is_paddy, final_class, confidence, best_model = is_paddy_leaf_batch(probabilities)
+    pred_classes = probabilities.argmax(axis=-1)
+    pred_confidences = probabilities.max(axis=-1) * 100
+
+    rows = []
+    for k, path in enumerate(paths):
+        row = {"path": path, "is_paddy": None, "prediction": None, "confidence": None, "best_model": None,
+               "error": None}
+        if errors[k]:
+            row["error"] = errors[k]
+        else:
+            row["is_paddy"] = bool(is_paddy[k])
+            row["prediction"] = class_labels[final_class[k]] if is_paddy[k] else "Not a paddy leaf"
+            row["confidence"] = round(float(confidence[k]), 4)
+            row["best_model"] = model_names[best_model[k]] if is_paddy[k] else None
+            for i, model_name in enumerate(model_names):
+                row[f"{model_name}_class"] = class_labels[pred_classes[i, k]]
+                row[f"{model_name}_confidence"] = round(float(pred_confidences[i, k]), 4)
+        rows.append(row)
+    return rows
+
+
+def scan_root(paths):
+    """Deepest directory containing every path, so figures keep their subfolders"""
+    return os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+
+
+def render_explanations(path, render_level, output_dir, root):
+    """Run the full single-image analysis and write its figures under output_dir, mirroring the tree below root
+    (a/leaf.jpg and b/leaf.jpg go to output_dir/a/leaf and output_dir/b/leaf)"""
+    with open(path, "rb") as f:
+        img_bytes = f.read()
+    result = analyze_image_bytes(img_bytes, models, class_labels, image_name=path, render_level=render_level)
+    relative = os.path.relpath(os.path.abspath(path), root)
+    write_artifacts(result, os.path.join(output_dir, os.path.splitext(relative)[0]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch-score a folder of leaf photos with the ensemble")
+    parser.add_argument("directory", nargs="?", help="Directory to scan recursively")
+    parser.add_argument("--file-list", help="Text file with one image path per line")
+    parser.add_argument("--output", default="scan_results.jsonl", help=".jsonl or .csv")
+    parser.add_argument("--checkpoint", default=None, help="Processed-files log (default: <output>.done)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--read-parallelism", type=int, default=8)
+    parser.add_argument("--render", default="none", choices=RENDER_LEVELS,
+                        help="Also render explanation figures for paddy leaves")
+    parser.add_argument("--render-dir", default="output/bulk_scan")
+    args = parser.parse_args()
+
+    if bool(args.directory) == bool(args.file_list):
+        parser.error("Pass either a directory or --file-list")
+
+    paths = find_images(args.directory) if args.directory else read_file_list(args.file_list)
+    checkpoint_path = args.checkpoint or args.output + ".done"
+    done = load_checkpoint(checkpoint_path)
+    pending = [path for path in paths if path not in done]
+    print(f"{len(paths)} images, {len(paths) - len(pending)} already processed, {len(pending)} to scan")
+    if not pending:
+        return
+
+    render_root = os.path.abspath(args.directory) if args.directory else scan_root(paths)
+    model_names = list(models.keys())
+    input_sizes = sorted({MODEL_CONFIGS[model_name]["input_size"] for model_name in model_names})
+    dataset = build_dataset(pending, input_sizes, args.batch_size, args.read_parallelism)
+
+    writer = ResultWriter(args.output, model_names)
+    scanned = 0
+    paddy = 0
+    start = time.perf_counter()
+    try:
+        with open(checkpoint_path, "a") as checkpoint:
+            for batch in dataset:
+                batch_paths = [path.decode("utf-8") for path in batch[0].numpy()]
+                errors = [error.decode("utf-8") for error in batch[1].numpy()]
+                size_inputs = dict(zip(input_sizes, batch[2:]))
+
+                probabilities = run_ensemble(models, size_inputs)
+                rows = batch_rows(batch_paths, errors, probabilities, model_names)
+                for row in rows:
+                    writer.write(row)
+                    if args.render != "none" and row["is_paddy"]:
+                        render_explanations(row["path"], args.render, args.render_dir, render_root)
+
+                # Results first, then the checkpoint, so a crash never marks unwritten rows as done
+                writer.flush()
+                checkpoint.write("".join(path + "\n" for path in batch_paths))
+                checkpoint.flush()
+
+                scanned += len(rows)
+                paddy += sum(1 for row in rows if row["is_paddy"])
+                elapsed = time.perf_counter() - start
+                print(f"{scanned}/{len(pending)} images ({scanned / elapsed:.1f} images/s, {paddy} paddy leaves)")
+    finally:
+        writer.close()
+
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Content-addressed cache of /analyze responses.
+
+Entries are keyed on a hash of the uploaded bytes plus a "variant" string
+(model set/version and response options). An in-memory LRU tier sits in
+front of an optional on-disk tier; both evict by total size. In perceptual
+mode a 64-bit difference hash of the image also matches re-encoded copies
+of the same photo within a small Hamming distance.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def content_key(img_bytes, variant):
+    """sha256 of the upload bytes and the variant string"""
+    digest = hashlib.sha256()
+    digest.update(variant.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(img_bytes)
+    return digest.hexdigest()
+
+
+def perceptual_hash(img_bytes):
+    """64-bit difference hash of the image, or None if it cannot be decoded"""
+    # A reduced-resolution grayscale decode is all a 9x8 thumbnail needs
+    img = cv2.imdecode(np.frombuffer(img_bytes, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if img is None:
+        return None
+    thumbnail = cv2.resize(img, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class ResultCache:
+    """LRU memory tier plus optional size-bounded disk tier for response dicts"""
+    def __init__(self, memory_max_bytes, disk_dir=None, disk_max_bytes=0, perceptual=False, max_distance=4):
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.perceptual = perceptual
+        self.max_distance = max_distance
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (payload bytes, response)
+        self._memory_bytes = 0
+        self._phash_index = OrderedDict()  # key -> (variant, phash)
+        self._counters = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "perceptual_hits": 0,
+                          "misses": 0, "stores": 0, "evictions": 0}
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _memory_put(self, key, payload, response):
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key)[0])
+        self._memory[key] = (payload, response)
+        self._memory_bytes += len(payload)
+        while self._memory_bytes > self.memory_max_bytes and len(self._memory) > 1:
+            old_key, (old_payload, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old_payload)
+            self._counters["evictions"] += 1
+
+    def _lookup(self, key):
+        """Memory tier first, then disk; promotes disk hits to memory"""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self._counters["memory_hits"] += 1
+            return self._memory[key][1]
+
+        if self.disk_dir and os.path.exists(self._disk_path(key)):
+            path = self._disk_path(key)
+            with open(path, "rb") as f:
+                payload = f.read()
+            os.utime(path)  # mtime tracks recency for disk eviction
+            response = json.loads(payload)
+            self._memory_put(key, payload, response)
+            self._counters["disk_hits"] += 1
+            return response
+        return None
+
+    def get(self, img_bytes, variant):
+        """Return (key, cached response or None) for an upload"""
+        key = content_key(img_bytes, variant)
+        with self._lock:
+            response = self._lookup(key)
+
+        if response is None and self.perceptual:
+            phash = perceptual_hash(img_bytes)
+            if phash is not None:
+                with self._lock:
+                    for other_key, (other_variant, other_phash) in reversed(self._phash_index.items()):
+                        if other_variant == variant and hamming_distance(phash, other_phash) <= self.max_distance:
+                            response = self._lookup(other_key)
+                            if response is not None:
+                                self._counters["perceptual_hits"] += 1
+                                break
+
+        with self._lock:
+            if response is None:
+                self._counters["misses"] += 1
+            else:
+                self._counters["hits"] += 1
+        return key, response
+
+    def put(self, key, response, img_bytes=None, variant=None):
+        """Store a response dict under key (from get)"""
+        payload = json.dumps(response).encode("utf-8")
+        phash = perceptual_hash(img_bytes) if self.perceptual and img_bytes is not None else None
+
+        with self._lock:
+            self._memory_put(key, payload, response)
+            if phash is not None:
+                self._phash_index[key] = (variant, phash)
+                self._phash_index.move_to_end(key)
+                # Keep the index from growing past what the tiers can hold
+                while len(self._phash_index) > max(1024, len(self._memory)):
+                    self._phash_index.popitem(last=False)
+            self._counters["stores"] += 1
+
+            if self.disk_dir and self.disk_max_bytes > 0:
+                with open(self._disk_path(key), "wb") as f:
+                    f.write(payload)
+                self._evict_disk()
+
+    def _evict_disk(self):
+        """Delete least recently used disk entries until the tier fits disk_max_bytes"""
+        entries = []
+        for fname in os.listdir(self.disk_dir):
+            if fname.endswith(".json"):
+                stat = os.stat(os.path.join(self.disk_dir, fname))
+                entries.append((stat.st_mtime, stat.st_size, fname))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, fname in sorted(entries):
+            if total <= self.disk_max_bytes:
+                break
+            os.remove(os.path.join(self.disk_dir, fname))
+            total -= size
+            self._counters["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["perceptual"] = self.perceptual
+        stats["disk_dir"] = self.disk_dir
+        return stats
@@ -0,0 +1,121 @@
+"""
+Bounded worker pool for running blocking inference off the event loop.
+
+Requests beyond the pool size wait in a bounded admission queue; once the
+queue is full, run() raises QueueFullError immediately so the endpoint can
+reject with 503 + Retry-After instead of piling up work.
+"""
+import asyncio
+import functools
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+EXECUTOR_KINDS = ("thread", "process")
+
+
+class QueueFullError(Exception):
+    """Raised when the admission queue has no free slot"""
+    def __init__(self, retry_after):
+        super().__init__(f"Inference queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _run_timed(fn, submitted_at, args, kwargs):
+    """Run fn in the worker and report how long the call waited for it"""
+    # time.time() rather than perf_counter so the wait is comparable across processes
+    wait = time.time() - submitted_at
+    return wait, fn(*args, **kwargs)
+
+
+class InferenceExecutor:
+    """
+    Thread or process pool with a bounded admission queue.
+    At most `workers` calls run at once and at most `max_queue` more wait.
+    """
+    def __init__(self, workers, max_queue, kind="thread", retry_after=5, window=1000):
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(f"Unknown executor kind '{kind}', expected one of {EXECUTOR_KINDS}")
+        self.workers = workers
+        self.max_queue = max_queue
+        self.kind = kind
+        self.retry_after = retry_after
+
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._wait_times = deque(maxlen=window)
+        self._completed = 0
+        self._rejected = 0
+
+    def _get_pool(self):
+        # Created lazily so spawned worker processes that import the app
+        # do not start pools of their own
+        if self._pool is None:
+            if self.kind == "process":
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="inference")
+        return self._pool
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the pool; raises QueueFullError when saturated"""
+        return await self.start(fn, *args, **kwargs)
+
+    def start(self, fn, *args, **kwargs):
+        """
+        Admit fn(*args, **kwargs) and schedule it on the pool without waiting.
+        Raises QueueFullError right away when saturated; otherwise returns an
+        asyncio future for the result. Must be called from the event loop.
+        """
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self._rejected += 1
+                raise QueueFullError(self.retry_after)
+            self._pending += 1
+        return asyncio.ensure_future(self._run_admitted(fn, args, kwargs))
+
+    async def _run_admitted(self, fn, args, kwargs):
+        try:
+            loop = asyncio.get_running_loop()
+            call = functools.partial(_run_timed, fn, time.time(), args, kwargs)
+            wait, result = await loop.run_in_executor(self._get_pool(), call)
+            with self._lock:
+                self._wait_times.append(wait)
+                self._completed += 1
+            return result
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self):
+        """Queue depth, in-flight count and wait-time statistics"""
+        with self._lock:
+            wait_times = list(self._wait_times)
+            pending = self._pending
+            completed = self._completed
+            rejected = self._rejected
+
+        wait_times.sort()
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": min(pending, self.workers),
+            "queue_depth": max(0, pending - self.workers),
+            "completed": completed,
+            "rejected": rejected,
+            "wait_seconds": {
+                "mean": sum(wait_times) / len(wait_times) if wait_times else 0.0,
+                "p50": wait_times[len(wait_times) // 2] if wait_times else 0.0,
+                "p99": wait_times[min(len(wait_times) - 1, int(len(wait_times) * 0.99))] if wait_times else 0.0,
+                "max": wait_times[-1] if wait_times else 0.0
+            }
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
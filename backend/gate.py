@@ -0,0 +1,83 @@
+"""
+Lightweight "is this a rice leaf" gate in front of the ensemble.
+
+A small CNN scores a downscaled copy of the upload in a few milliseconds on
+CPU. Uploads that score below the threshold (blurry shots, soil, hands) are
+declared not a paddy leaf without running the four backbones or any
+explanation. train_gate.py trains the gate on the ensemble's own decisions
+and stores the calibrated threshold next to the model as <model>.json.
+"""
+import json
+import os
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+GATE_INPUT_SIZE = (96, 96)
+GATE_FILTERS = (16, 32, 64, 128)
+DEFAULT_THRESHOLD = 0.5
+
+
+def build_gate_model(input_size=GATE_INPUT_SIZE, filters=GATE_FILTERS, seed=0):
+    """Strided conv stack on raw 0-255 RGB, ending in one sigmoid "is a paddy leaf" unit"""
+    inputs = tf.keras.Input(shape=(input_size[0], input_size[1], 3))
+    x = tf.keras.layers.Rescaling(1 / 255, name="rescale")(inputs)
+    for i, n_filters in enumerate(filters):
+        x = tf.keras.layers.Conv2D(
+            n_filters, 3, strides=2, padding="same", use_bias=False,
+            kernel_initializer=tf.keras.initializers.HeNormal(seed=seed + i), name=f"conv_{i}"
+        )(x)
+        x = tf.keras.layers.BatchNormalization(name=f"bn_{i}")(x)
+        x = tf.keras.layers.ReLU(name=f"relu_{i}")(x)
+    x = tf.keras.layers.GlobalAveragePooling2D(name="pool")(x)
+    x = tf.keras.layers.Dropout(0.2, seed=seed, name="dropout")(x)
+    outputs = tf.keras.layers.Dense(1, activation="sigmoid", name="is_paddy")(x)
+    return tf.keras.Model(inputs, outputs, name="paddy_gate")
+
+
+def gate_input(img, input_size=GATE_INPUT_SIZE):
+    """RGB uint8 image -> float32 (h, w, 3) gate input in 0-255"""
+    return cv2.resize(img, (input_size[1], input_size[0]), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def metadata_path(model_path):
+    """Threshold and training report of a gate model"""
+    return os.path.splitext(model_path)[0] + ".json"
+
+
+class Gate:
+    """A gate model with its decision threshold and a compiled forward pass"""
+    def __init__(self, model, threshold=DEFAULT_THRESHOLD):
+        self.model = model
+        self.threshold = threshold
+        self.input_size = tuple(model.input_shape[1:3])
+        self._forward = tf.function(
+            lambda batch: self.model(batch, training=False),
+            input_signature=[tf.TensorSpec((None, self.input_size[0], self.input_size[1], 3), tf.float32)]
+        )
+
+    @classmethod
+    def load(cls, path, threshold=None):
+        """Load a gate; the threshold comes from its metadata file unless given"""
+        model = tf.keras.models.load_model(path, compile=False)
+        if threshold is None:
+            try:
+                with open(metadata_path(path)) as f:
+                    threshold = json.load(f)["threshold"]
+            except (OSError, ValueError, KeyError):
+                print(f"No calibrated threshold for {path}, using {DEFAULT_THRESHOLD}")
+                threshold = DEFAULT_THRESHOLD
+        gate = cls(model, threshold)
+        gate.scores(np.zeros((1,) + gate.input_size + (3,), np.float32))  # trace once
+        return gate
+
+    def scores(self, batch):
+        """(n,) probabilities that each gate input shows a paddy leaf"""
+        return self._forward(tf.convert_to_tensor(batch, dtype=tf.float32)).numpy()[:, 0]
+
+    def score(self, img):
+        return float(self.scores(gate_input(img, self.input_size)[np.newaxis])[0])
+
+    def passes(self, score):
+        return score >= self.threshold
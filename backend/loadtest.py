@@ -0,0 +1,388 @@
+"""
+End-to-end load test of the /analyze endpoint.
+
+The server is started through serve.py with stand-in models
+(standin_models.py) in place of the .h5 files in MODEL_PATHS, unless
+--real-models is given or --url points at a server that is already running.
+An async client then sends uploads:
+  - with at most --concurrency requests in flight
+  - at --rate requests per second (Poisson arrivals), or as fast as the
+    concurrency allows with --rate 0
+  - with image sizes drawn from --sizes (WxH:weight,...), all resized from --image
+  - with --duplicates of the uploads repeating an earlier upload byte for
+    byte (result cache hits); the others are unique files of the same picture
+While the test runs, the resident memory of the server's process tree is
+sampled every --sample-interval seconds.
+
+The JSON report has latency percentiles (overall, per image size and for
+first uploads vs duplicates), error and rejection rates (503 busy and 413
+too large count as rejections), response sizes and the memory timeline.
+With --compare, the run is checked against an earlier report and the script
+exits with status 1 if throughput, p99 latency, errors or peak memory got
+worse by more than --tolerance.
+
+Usage:
+    python loadtest.py --image "Leaf scald.jpg" --requests 200 --concurrency 8 --output loadtest.json
+    python loadtest.py --rate 5 --duration 60 --sizes 640x480:3,1920x1080:1 --duplicates 0.3 --workers 2
+    python loadtest.py --output loadtest_new.json --compare loadtest.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import cv2
+import httpx
+import numpy as np
+
+from bench_serving import free_port, tree_memory_mb, wait_ready
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REJECTION_STATUSES = (413, 503)
+PERCENTILES = (50, 90, 95, 99)
+
+
+def parse_sizes(spec):
+    """'640x480:3,1920x1080:1' -> [((640, 480), 0.75), ((1920, 1080), 0.25)]"""
+    sizes = []
+    for item in spec.split(","):
+        size, _, weight = item.partition(":")
+        width, height = (int(dim) for dim in size.lower().split("x"))
+        sizes.append(((width, height), float(weight or 1)))
+    total = sum(weight for _, weight in sizes)
+    return [(size, weight / total) for size, weight in sizes]
+
+
+def size_name(size):
+    return f"{size[0]}x{size[1]}"
+
+
+def encode_sizes(img_path, sizes, quality):
+    """JPEG bytes of the image resized to each (width, height)"""
+    img = cv2.imread(img_path)
+    if img is None:
+        raise SystemExit(f"Cannot read {img_path}")
+    encoded = {}
+    for size, _ in sizes:
+        ok, buffer = cv2.imencode(".jpg", cv2.resize(img, size, interpolation=cv2.INTER_AREA),
+                                  [cv2.IMWRITE_JPEG_QUALITY, quality])
+        encoded[size] = buffer.tobytes()
+    return encoded
+
+
+def unique_jpeg(jpeg_bytes, tag):
+    """Same picture, different bytes: a JPEG comment segment right after the start-of-image marker"""
+    comment = tag.encode("utf-8")
+    return jpeg_bytes[:2] + b"\xff\xfe" + (len(comment) + 2).to_bytes(2, "big") + comment + jpeg_bytes[2:]
+
+
+def plan_requests(n_requests, sizes, duplicates, seed):
+    """(size, upload id, is duplicate) per request; a duplicate repeats an earlier upload of its size"""
+    rng = random.Random(seed)
+    sent = {}
+    plan = []
+    for k in range(n_requests):
+        size = rng.choices([size for size, _ in sizes], weights=[weight for _, weight in sizes])[0]
+        if sent.get(size) and rng.random() < duplicates:
+            plan.append((size, rng.choice(sent[size]), True))
+        else:
+            sent.setdefault(size, []).append(k)
+            plan.append((size, k, False))
+    return plan
+
+
+def latency_summary(latencies_ms):
+    if not latencies_ms:
+        return {"count": 0}
+    latencies_ms = np.array(latencies_ms)
+    summary = {"count": int(len(latencies_ms)), "mean": float(latencies_ms.mean())}
+    for p in PERCENTILES:
+        summary[f"p{p}"] = float(np.percentile(latencies_ms, p))
+    summary["max"] = float(latencies_ms.max())
+    return summary
+
+
+async def sample_memory(pid, interval, start, samples, stop):
+    while not stop.is_set():
+        memory = tree_memory_mb(pid)
+        samples.append({"t": round(time.perf_counter() - start, 3), "rss_mb": memory["rss_mb"],
+                        "pss_mb": memory["pss_mb"], "processes": memory["processes"]})
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_load(url, plan, payloads, args, server_pid=None, warmup=False):
+    """Send the planned requests; returns one record per request, the memory samples and the wall time"""
+    records = []
+    memory = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+    rng = random.Random(args.seed + 1)
+    stop = asyncio.Event()
+    start = time.perf_counter()
+    rate = 0.0 if warmup else args.rate
+    deadline = start + args.duration if args.duration and not warmup else None
+
+    async def one(client, size, upload_id, duplicate, arrival, holds_slot):
+        """One upload; latency counts from its arrival, including any wait for a free client slot"""
+        if not holds_slot:
+            await semaphore.acquire()
+        record = {"size": size_name(size), "duplicate": duplicate, "status": None, "bytes": 0,
+                  "sent_at": arrival - start}
+        try:
+            response = await client.post(url, files={"file": (f"upload_{upload_id}.jpg", payloads[upload_id],
+                                                              "image/jpeg")})
+            record["status"] = response.status_code
+            record["bytes"] = len(response.content)
+        except httpx.HTTPError as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+        finally:
+            semaphore.release()
+        record["latency_ms"] = (time.perf_counter() - arrival) * 1000
+        records.append(record)
+
+    sampler = None
+    if server_pid is not None:
+        sampler = asyncio.create_task(sample_memory(server_pid, args.sample_interval, start, memory, stop))
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        tasks = []
+        for size, upload_id, duplicate in plan:
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            if rate:
+                # Open loop: arrivals keep coming whether or not earlier requests finished
+                await asyncio.sleep(rng.expovariate(rate))
+            else:
+                # Closed loop: the next request arrives once a client slot is free
+                await semaphore.acquire()
+            tasks.append(asyncio.create_task(one(client, size, upload_id, duplicate, time.perf_counter(),
+                                                 holds_slot=not rate)))
+        await asyncio.gather(*tasks)
+    wall = time.perf_counter() - start
+
+    stop.set()
+    if sampler is not None:
+        await sampler
+        memory_now = tree_memory_mb(server_pid)
+        memory.append({"t": round(wall, 3), "rss_mb": memory_now["rss_mb"], "pss_mb": memory_now["pss_mb"],
+                       "processes": memory_now["processes"]})
+    return records, memory, wall
+
+
+def outcome(record):
+    if record["status"] is not None and 200 <= record["status"] < 300:
+        return "ok"
+    return "rejected" if record["status"] in REJECTION_STATUSES else "error"
+
+
+def summarize(records, memory, wall):
+    ok = [r for r in records if outcome(r) == "ok"]
+    rejected = [r for r in records if outcome(r) == "rejected"]
+    errors = [r for r in records if outcome(r) == "error"]
+    status_counts = {}
+    for record in records:
+        key = str(record["status"]) if record["status"] is not None else "transport_error"
+        status_counts[key] = status_counts.get(key, 0) + 1
+    response_bytes = np.array([r["bytes"] for r in ok]) if ok else np.zeros(1)
+
+    by_size = {}
+    for record in ok:
+        by_size.setdefault(record["size"], []).append(record["latency_ms"])
+    return {
+        "requests": len(records),
+        "ok": len(ok),
+        "rejected": len(rejected),
+        "errors": len(errors),
+        "rejection_rate": len(rejected) / len(records) if records else 0.0,
+        "error_rate": len(errors) / len(records) if records else 0.0,
+        "status_counts": status_counts,
+        "error_samples": [r.get("error", f"HTTP {r['status']}") for r in errors[:5]],
+        "wall_seconds": wall,
+        "throughput_rps": len(ok) / wall if wall else 0.0,
+        "latency_ms": latency_summary([r["latency_ms"] for r in ok]),
+        "latency_ms_by_size": {size: latency_summary(latencies) for size, latencies in sorted(by_size.items())},
+        "latency_ms_first_upload": latency_summary([r["latency_ms"] for r in ok if not r["duplicate"]]),
+        "latency_ms_duplicate": latency_summary([r["latency_ms"] for r in ok if r["duplicate"]]),
+        "response_bytes": {"mean": float(response_bytes.mean()), "p50": float(np.percentile(response_bytes, 50)),
+                           "max": int(response_bytes.max()), "total": int(response_bytes.sum())},
+        "memory": {
+            "peak_rss_mb": max((m["rss_mb"] for m in memory), default=None),
+            "peak_pss_mb": max((m["pss_mb"] for m in memory), default=None),
+            "timeline": memory
+        }
+    }
+
+
+def compare(summary, baseline, tolerance):
+    """Metrics that got worse than the baseline by more than tolerance"""
+    checks = [
+        ("throughput_rps", summary["throughput_rps"], baseline["throughput_rps"], False),
+        ("latency_ms.p99", summary["latency_ms"].get("p99"), baseline["latency_ms"].get("p99"), True),
+        ("latency_ms.p50", summary["latency_ms"].get("p50"), baseline["latency_ms"].get("p50"), True),
+        ("peak_rss_mb", summary["memory"]["peak_rss_mb"], baseline["memory"]["peak_rss_mb"], True)
+    ]
+    regressions = []
+    print(f"\n{'metric':<18} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, current, previous, lower_is_better in checks:
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        worse = change > tolerance if lower_is_better else change < -tolerance
+        print(f"{name:<18} {previous:>12.2f} {current:>12.2f} {change:>+8.1%}{'  REGRESSED' if worse else ''}")
+        if worse:
+            regressions.append(name)
+    for name in ("error_rate", "rejection_rate"):
+        print(f"{name:<18} {baseline[name]:>12.4f} {summary[name]:>12.4f}")
+        if summary[name] > baseline[name] + tolerance * max(baseline[name], 0.01):
+            regressions.append(name)
+    return regressions
+
+
+def start_server(args):
+    """serve.py on a free port; returns (process, base url, log path)"""
+    port = free_port()
+    env = dict(os.environ, WRITE_ARTIFACTS="0")
+    env.pop("MODEL_HOST", None)
+    if not args.real_models:
+        env.update(STANDIN_MODELS="1", STANDIN_WEIGHT_MB=str(args.weight_mb))
+    for item in args.server_env:
+        name, _, value = item.partition("=")
+        env[name] = value
+
+    command = [sys.executable, os.path.join(HERE, "serve.py"), "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(args.workers)]
+    if args.model_host:
+        command += ["--model-host", "--host-address",
+                    os.path.join(tempfile.gettempdir(), f"paddy-loadtest-{uuid.uuid4().hex[:8]}.sock")]
+    log_path = os.path.join(tempfile.gettempdir(), f"loadtest_server_{port}.log")
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(command, cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT,
+                                   start_new_session=True)
+    return process, f"http://127.0.0.1:{port}", log_path
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /analyze and write a comparable JSON report")
+    parser.add_argument("--image", default="Leaf scald.jpg", help="Picture every upload is made from")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=None, help="Stop sending after this many seconds")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at most")
+    parser.add_argument("--rate", type=float, default=0.0, help="Requests per second, 0 for closed loop")
+    parser.add_argument("--sizes", default="1280x960:1", help="Image size mix, WxH:weight,...")
+    parser.add_argument("--duplicates", type=float, default=0.0, help="Fraction of uploads that repeat an earlier one")
+    parser.add_argument("--jpeg-quality", type=int, default=90)
+    parser.add_argument("--query", default="render=none", help="Query string of the /analyze requests")
+    parser.add_argument("--warmup", type=int, default=4, help="Unmeasured requests sent first")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Client timeout per request (s)")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="Seconds between memory samples")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", default=None, help="Base URL of a running server instead of starting one")
+    parser.add_argument("--server-pid", type=int, default=None, help="Process to sample memory of with --url")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--model-host", action="store_true", help="Serve the workers from one model host")
+    parser.add_argument("--server-env", nargs="*", default=[], help="NAME=value settings for the server")
+    parser.add_argument("--weight-mb", type=float, default=0.0,
+                        help="Weight size of each stand-in model (ignored with --real-models)")
+    parser.add_argument("--real-models", action="store_true", help="Use the .h5 models instead of stand-ins")
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    parser.add_argument("--output", default="loadtest.json")
+    parser.add_argument("--compare", default=None, help="Earlier report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    sizes = parse_sizes(args.sizes)
+    encoded = encode_sizes(args.image, sizes, args.jpeg_quality)
+    plan = plan_requests(args.requests, sizes, args.duplicates, args.seed)
+    run_id = uuid.uuid4().hex[:8]
+    payloads = {upload_id: unique_jpeg(encoded[size], f"loadtest {run_id} {upload_id}")
+                for size, upload_id, duplicate in plan if not duplicate}
+
+    process = None
+    server_pid = args.server_pid
+    base_url = args.url
+    if base_url is None:
+        process, base_url, log_path = start_server(args)
+        server_pid = process.pid
+        print(f"Server starting on {base_url} (log: {log_path})")
+    try:
+        start = time.perf_counter()
+        wait_ready(base_url.rstrip("/"), process, args.startup_timeout, consecutive=2 * args.workers)
+        startup_seconds = time.perf_counter() - start if process else None
+        url = f"{base_url.rstrip('/')}/analyze?{args.query}"
+
+        # Unmeasured warm-up with its own uploads, so it neither traces graphs in the
+        # measured run nor fills the result cache for it
+        warmup_payloads = {k: unique_jpeg(encoded[sizes[k % len(sizes)][0]], f"warmup {run_id} {k}")
+                           for k in range(args.warmup)}
+        warmup_plan = [(sizes[k % len(sizes)][0], k, False) for k in range(args.warmup)]
+        asyncio.run(run_load(url, warmup_plan, warmup_payloads, args, warmup=True))
+
+        print(f"Sending {len(plan)} requests ({len(payloads)} unique uploads), concurrency {args.concurrency}, "
+              f"rate {args.rate or 'unlimited'}")
+        records, memory, wall = asyncio.run(run_load(url, plan, payloads, args, server_pid))
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    summary = summarize(records, memory, wall)
+    report = {
+        "host": {"machine": platform.machine(), "processor": platform.processor(), "cpus": os.cpu_count(),
+                 "python": platform.python_version()},
+        "config": {
+            "requests": args.requests, "duration": args.duration, "concurrency": args.concurrency,
+            "rate": args.rate, "sizes": {size_name(size): weight for size, weight in sizes},
+            "duplicates": args.duplicates, "query": args.query, "warmup": args.warmup, "seed": args.seed,
+            "server": args.url or {"workers": args.workers, "model_host": args.model_host,
+                                   "env": args.server_env},
+            "models": "as served" if args.url else
+                      "real" if args.real_models else f"stand-in ({args.weight_mb:g} MB each)"
+        },
+        "startup_seconds": startup_seconds,
+        "summary": summary
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+
+    latency = summary["latency_ms"]
+    print(f"{summary['ok']}/{summary['requests']} ok, {summary['rejected']} rejected, {summary['errors']} errors "
+          f"in {wall:.1f}s ({summary['throughput_rps']:.2f} req/s)")
+    if latency["count"]:
+        print(f"Latency p50 {latency['p50']:.0f} ms, p95 {latency['p95']:.0f} ms, p99 {latency['p99']:.0f} ms, "
+              f"max {latency['max']:.0f} ms; mean response {summary['response_bytes']['mean'] / 1024:.1f} KB")
+    if summary["memory"]["peak_rss_mb"] is not None:
+        print(f"Peak server RSS {summary['memory']['peak_rss_mb']:.0f} MB, "
+              f"PSS {summary['memory']['peak_pss_mb']:.0f} MB")
+    print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["config"] != report["config"]:
+            print("Warning: the baseline was run with a different configuration")
+        regressions = compare(summary, baseline["summary"], args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Per-request stage timing and Prometheus metrics.
+
+A StageTimer collects named durations while one image is analysed. Stage
+names are "<stage>" or "<stage>.<model>" (e.g. "smoothgrad.vgg16"), which
+are also valid Server-Timing metric names. The FastAPI app feeds the
+durations into the histograms below and serves them on /metrics.
+"""
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7)
+
+STAGE_SECONDS = Histogram("paddy_stage_seconds", "Duration of one stage of an /analyze request",
+                          ["stage", "model"], buckets=STAGE_BUCKETS)
+REQUEST_SECONDS = Histogram("paddy_request_seconds", "End-to-end /analyze latency",
+                            ["cache"], buckets=STAGE_BUCKETS)
+FIRST_RESULT_SECONDS = Histogram("paddy_time_to_first_result_seconds",
+                                 "Time until /analyze/stream sent the diagnosis", ["cache"], buckets=STAGE_BUCKETS)
+RESPONSE_BYTES = Histogram("paddy_response_bytes", "Size of the /analyze response body by response format",
+                           ["format"], buckets=SIZE_BUCKETS)
+REQUESTS = Counter("paddy_requests", "/analyze requests by outcome", ["outcome"])
+IN_FLIGHT = Gauge("paddy_requests_in_flight", "/analyze requests currently being handled")
+QUEUE_DEPTH = Gauge("paddy_inference_queue_depth", "Requests waiting for an inference worker")
+MODEL_LOAD_SECONDS = Gauge("paddy_model_load_seconds", "Time it took to load each model", ["model"])
+MODELS_READY = Gauge("paddy_models_ready", "1 once every model is loaded and warmed up")
+
+
+class StageTimer:
+    """Named durations of one request; repeated stages add up"""
+    def __init__(self):
+        self.durations = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+
+def observe_stages(durations):
+    """Record a request's stage durations in the stage histogram"""
+    for name, seconds in durations.items():
+        stage, _, model = name.partition(".")
+        STAGE_SECONDS.labels(stage=stage, model=model).observe(seconds)
+
+
+def server_timing_header(durations):
+    """Server-Timing header value, durations in milliseconds"""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in durations.items())
+
+
+def timings_ms(durations):
+    return {name: round(seconds * 1000, 2) for name, seconds in durations.items()}
+
+
+def render_metrics():
+    """(body, content type) of the Prometheus text exposition"""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,370 @@
+"""
+Model host: one process that owns the ensemble for several HTTP workers.
+
+`python model_host.py` loads the models once, with the same configuration
+and loader as the server, and listens on a local socket. HTTP workers
+started with MODEL_HOST=<address> get a RemoteModels mapping instead of a
+ModelRegistry and load no weights themselves. For every predict or explain
+call the worker writes its input tensors into a multiprocessing.shared_memory
+block and sends only the block name and array layout over the socket; the
+host writes the probabilities or the heatmap back into the same block, so
+image tensors and heatmaps are never pickled.
+
+    export MODEL_HOST_AUTHKEY=$(python -c "import secrets; print(secrets.token_hex(32))")
+    python model_host.py --address /tmp/paddy-model-host.sock
+    MODEL_HOST=/tmp/paddy-model-host.sock uvicorn app:app --workers 4
+
+Messages are pickled, so anyone who can connect can run code in the host:
+both sides must share MODEL_HOST_AUTHKEY, and there is no default. serve.py
+starts both and generates a random key unless one is set.
+"""
+import argparse
+import os
+import threading
+import time
+from collections.abc import Mapping
+from multiprocessing import AuthenticationError, resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+DEFAULT_ADDRESS = "/tmp/paddy-model-host.sock"
+# Arrays in a block start on cache-line boundaries
+BLOCK_ALIGNMENT = 64
+
+
+def parse_address(address):
+    """'host:port' is a TCP address, anything else a Unix socket path"""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and not address.startswith("/"):
+        return (host or "127.0.0.1", int(port))
+    return address
+
+
+def host_authkey():
+    """Shared secret for host connections; there is no default since messages are pickled"""
+    key = os.environ.get("MODEL_HOST_AUTHKEY")
+    if not key:
+        raise RuntimeError("MODEL_HOST_AUTHKEY is not set; serve.py generates one, "
+                           "otherwise give the host and the workers the same secret")
+    return key.encode("utf-8")
+
+
+class SharedArrays:
+    """float32 arrays laid out back to back in one shared memory block"""
+    def __init__(self, shm, layout):
+        self.shm = shm
+        self.layout = layout  # [(offset, shape)]
+
+    @classmethod
+    def create(cls, shapes):
+        layout = []
+        offset = 0
+        for shape in shapes:
+            shape = tuple(int(dim) for dim in shape)
+            layout.append((offset, shape))
+            nbytes = int(np.prod(shape)) * 4
+            offset += -(-nbytes // BLOCK_ALIGNMENT) * BLOCK_ALIGNMENT
+        return cls(shared_memory.SharedMemory(create=True, size=max(offset, 1)), layout)
+
+    @classmethod
+    def attach(cls, name, layout):
+        shm = shared_memory.SharedMemory(name=name)
+        # Only the creating worker unlinks the block; without this the host's
+        # resource tracker would unlink it (and warn) on shutdown as well
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, [(offset, tuple(shape)) for offset, shape in layout])
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def array(self, k):
+        """View of the k-th array; drop it before close()"""
+        offset, shape = self.layout[k]
+        return np.ndarray(shape, dtype=np.float32, buffer=self.shm.buf, offset=offset)
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.close()
+        self.shm.unlink()
+
+
+# -------------------------
+# Worker side
+# -------------------------
+class HostClient:
+    """Request/reply calls to the model host, one connection per calling thread"""
+    def __init__(self, address):
+        self.address = address
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = Client(parse_address(self.address), authkey=host_authkey())
+            self._local.conn = conn
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def call(self, message):
+        try:
+            conn = self._connection()
+            conn.send(message)
+            reply = conn.recv()
+        except (OSError, EOFError) as e:
+            self._drop_connection()
+            raise ConnectionError(f"Model host at {self.address} is unreachable: {e}") from e
+        if "error" in reply:
+            raise RuntimeError(f"Model host failed: {reply['error']}")
+        return reply
+
+    def call_with_arrays(self, message, inputs, output_shapes):
+        """Send inputs through shared memory; returns copies of the output arrays and the host's reply"""
+        block = SharedArrays.create([array.shape for array in inputs] + list(output_shapes))
+        try:
+            for k, array in enumerate(inputs):
+                block.array(k)[...] = array
+            reply = self.call(dict(message, block=block.name, layout=block.layout))
+            return [block.array(len(inputs) + k).copy() for k in range(len(output_shapes))], reply
+        finally:
+            block.unlink()
+
+
+class RemoteModel:
+    """Stand-in for one model that lives in the model host"""
+    def __init__(self, models, name):
+        self.models = models
+        self.name = name
+
+    def count_params(self):
+        return self.models.host_info()["models"].get(self.name, {}).get("params") or 0
+
+    def predict(self, size_inputs):
+        return self.models.predict([self.name], size_inputs)[0]
+
+    def explain(self, explainer, img_preprocessed, class_index, time_budget=None):
+        return self.models.explain(explainer, self.name, img_preprocessed, class_index, time_budget)
+
+
+class RemoteModels(Mapping):
+    """
+    name -> RemoteModel mapping with the ModelRegistry interface the app
+    uses. Nothing is loaded in this process; readiness is the host's.
+    """
+    def __init__(self, address, model_names):
+        self.address = address
+        self.model_names = list(model_names)
+        self.client = HostClient(address)
+        self.on_load = None  # the host warms up its own models
+
+        self._stubs = {name: RemoteModel(self, name) for name in self.model_names}
+        self._info = None
+        self._ready = threading.Event()
+
+    def __getitem__(self, name):
+        if name not in list(iter(self)):
+            raise KeyError(name)
+        return self._stubs[name]
+
+    def __iter__(self):
+        if self._info is None:
+            return iter(self.model_names)
+        return iter([name for name in self.model_names if name in self._info["models"]])
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def host_info(self):
+        if self._info is None:
+            self.refresh()
+        return self._info
+
+    def refresh(self):
+        self._info = self.client.call({"op": "info"})
+        if self._info["status"]["ready"]:
+            self._ready.set()
+        return self._info
+
+    # -------------------------
+    # Inference
+    # -------------------------
+    def predict(self, model_names, size_inputs):
+        """Stacked (n_models, batch, n_classes) probabilities from the host"""
+        sizes = list(size_inputs)
+        inputs = [np.asarray(size_inputs[size], dtype=np.float32) for size in sizes]
+        output_shape = (len(model_names), inputs[0].shape[0], self.host_info()["n_classes"])
+        (probabilities,), _ = self.client.call_with_arrays(
+            {"op": "predict", "models": list(model_names), "sizes": sizes}, inputs, [output_shape])
+        return probabilities
+
+    def explain(self, explainer, model_name, img_preprocessed, class_index, time_budget=None):
+        """((h, w) heatmap, samples used) for one model, computed by the host"""
+        img_preprocessed = np.asarray(img_preprocessed, dtype=np.float32)
+        (heatmap,), reply = self.client.call_with_arrays(
+            {"op": "explain", "explainer": explainer, "model": model_name, "class_index": int(class_index),
+             "time_budget": time_budget},
+            [img_preprocessed], [img_preprocessed.shape[1:3]])
+        return heatmap, reply["samples"]
+
+    # -------------------------
+    # Readiness
+    # -------------------------
+    def start_background_load(self, loader=None, poll_interval=0.5):
+        """Wait for the host to finish loading on a background thread; loader is the host's business"""
+        def wait():
+            while not self._ready.is_set():
+                try:
+                    self.refresh()
+                except (ConnectionError, RuntimeError):
+                    pass
+                self._ready.wait(poll_interval)
+            print(f"Model host at {self.address} is ready")
+
+        thread = threading.Thread(target=wait, name="model-host-wait", daemon=True)
+        thread.start()
+        return thread
+
+    def mark_ready(self):
+        self._ready.set()
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def status(self):
+        try:
+            status = dict(self.refresh()["status"])
+        except (ConnectionError, RuntimeError) as e:
+            return {"ready": False, "loaded": [], "failed": {}, "pending": list(self.model_names),
+                    "load_seconds": {}, "startup_seconds": None, "host": self.address, "error": str(e)}
+        status["host"] = self.address
+        return status
+
+
+# -------------------------
+# Host side
+# -------------------------
+class ModelHost:
+    """Serves predict/explain calls from the workers with this process's models"""
+    def __init__(self, app):
+        self.app = app
+        self._subsets = {}
+        self._subsets_lock = threading.Lock()
+
+    def subset(self, model_names):
+        """Cached models dict for a set of names, so runners and batchers are reused"""
+        key = tuple(model_names)
+        with self._subsets_lock:
+            if key not in self._subsets:
+                self._subsets[key] = {name: self.app.models[name] for name in model_names}
+            return self._subsets[key]
+
+    def info(self):
+        status = self.app.models.status()
+        status["tflite"] = sorted(self.app._tflite_models)
+        loaded = set(status["loaded"])
+        return {
+            "models": {name: {"params": int(self.app.models[name].count_params()) if name in loaded else None}
+                       for name in self.app.models.keys()},
+            "n_classes": len(self.app.class_labels),
+            "status": status
+        }
+
+    def handle(self, message):
+        if message["op"] == "info":
+            return self.info()
+
+        block = SharedArrays.attach(message["block"], message["layout"])
+        try:
+            if message["op"] == "predict":
+                self.predict(block, message["models"], message["sizes"])
+                return {}
+            elif message["op"] == "explain":
+                samples = self.explain(block, message["explainer"], message["model"], message["class_index"],
+                                       message.get("time_budget"))
+                return {"samples": samples}
+            else:
+                raise ValueError(f"Unknown op '{message['op']}'")
+        finally:
+            block.close()
+
+    def predict(self, block, model_names, sizes):
+        # Copies: TensorFlow may keep aliasing a numpy buffer, which would keep the block open
+        size_inputs = {tuple(size): self.app.tf.constant(block.array(k).copy()) for k, size in enumerate(sizes)}
+        if len(model_names) == 1:
+            probabilities = self.app.predict_model(self.app.models, model_names[0], size_inputs)[np.newaxis]
+        else:
+            probabilities = self.app.predict_ensemble(self.subset(model_names), size_inputs)
+        block.array(len(sizes))[...] = probabilities
+
+    def explain(self, block, explainer, model_name, class_index, time_budget=None):
+        img_preprocessed = block.array(0).copy()
+        heatmap, samples = self.app.explain_model(explainer, model_name, self.app.models[model_name],
+                                                  img_preprocessed, class_index, time_budget)
+        block.array(1)[...] = np.asarray(heatmap, dtype=np.float32)
+        return samples
+
+    def serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return  # worker went away
+                try:
+                    reply = self.handle(message)
+                except Exception as e:
+                    reply = {"error": f"{type(e).__name__}: {e}"}
+                try:
+                    conn.send(reply)
+                except OSError:
+                    return
+
+    def serve_forever(self, address):
+        address = parse_address(address)
+        if isinstance(address, str) and os.path.exists(address):
+            os.unlink(address)  # left over from a previous host
+        listener = Listener(address, authkey=host_authkey())
+        print(f"Model host listening on {address}")
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, OSError) as e:
+                print(f"Rejected model host connection: {e}")
+                continue
+            threading.Thread(target=self.serve_connection, args=(conn,), name="model-host-conn",
+                             daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the model ensemble to HTTP workers over shared memory")
+    parser.add_argument("--address", default=os.environ.get("MODEL_HOST_ADDRESS", DEFAULT_ADDRESS),
+                        help="Unix socket path or host:port to listen on")
+    args = parser.parse_args()
+    host_authkey()  # fail before loading anything
+
+    # The host itself must load real models, not talk to another host
+    os.environ.pop("MODEL_HOST", None)
+    import app
+
+    start = time.perf_counter()
+    if app.LAZY_MODEL_LOADING:
+        app.models.mark_ready()
+    else:
+        app.models.start_background_load(loader=app.load_for_serving)
+    print(f"Model host started in {time.perf_counter() - start:.2f}s, loading models in the background")
+    ModelHost(app).serve_forever(args.address)
+
+
+if __name__ == "__main__":
+    main()
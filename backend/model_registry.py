@@ -0,0 +1,178 @@
+"""
+Registry that loads the ensemble's Keras models in parallel or on first use.
+
+ModelRegistry behaves like the read-only `models` dict the pipeline always
+used (name -> keras.Model), but a model is only loaded when it is first
+looked up or when load_all() / start_background_load() runs. The first
+time a .h5 file is loaded it is re-saved in the native .keras format under
+cache_dir, and later starts load that copy instead.
+"""
+import os
+import threading
+import time
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+
+from tensorflow.keras.models import load_model
+
+
+class ModelRegistry(Mapping):
+    """Lazily loaded, thread-safe name -> model mapping"""
+    def __init__(self, model_paths, cache_dir=None, on_load=None, max_workers=None):
+        self.model_paths = dict(model_paths)
+        self.cache_dir = cache_dir
+        self.on_load = on_load  # called as on_load(name, model) after loading, e.g. warm-up
+        self.max_workers = max_workers or len(self.model_paths) or 1
+
+        self._models = {}
+        self._failed = {}
+        self._load_times = {}
+        self._locks = {name: threading.Lock() for name in self.model_paths}
+        self._ready = threading.Event()
+        self._startup_seconds = None
+        self.generation = 0  # bumped whenever a model is loaded, fails, is registered or unloaded
+
+    # -------------------------
+    # Mapping interface
+    # -------------------------
+    def __getitem__(self, name):
+        model = self.get(name)
+        if model is None:
+            raise KeyError(name)
+        return model
+
+    def __iter__(self):
+        return iter([name for name in self.model_paths if name not in self._failed])
+
+    def __len__(self):
+        return len([name for name in self.model_paths if name not in self._failed])
+
+    def items(self):
+        """(name, model) pairs for every model that loads; missing ones are loaded in parallel first"""
+        self.load_all()
+        return [(name, self._models[name]) for name in self.model_paths if name in self._models]
+
+    def values(self):
+        return [model for _, model in self.items()]
+
+    # -------------------------
+    # Loading
+    # -------------------------
+    def cached_path(self, name):
+        """Path of the converted .keras copy of a model"""
+        return os.path.join(self.cache_dir, f"{name}.keras") if self.cache_dir else None
+
+    def _load_file(self, name):
+        """Load from the converted copy when it is up to date, else from the original file"""
+        path = self.model_paths[name]
+        cached_path = self.cached_path(name)
+        if cached_path and os.path.exists(cached_path) and \
+                (not os.path.exists(path) or os.path.getmtime(cached_path) >= os.path.getmtime(path)):
+            return load_model(cached_path, compile=False), cached_path
+
+        model = load_model(path, compile=False)
+        if cached_path and not path.endswith(".keras"):
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                # Write to a temp name first so a half-written file is never picked up
+                tmp_path = cached_path + ".tmp.keras"
+                model.save(tmp_path)
+                os.replace(tmp_path, cached_path)
+                print(f"Converted {name} model to {cached_path}")
+            except Exception as e:
+                print(f"Could not cache {name} model as .keras: {e}")
+        return model, path
+
+    def get(self, name):
+        """Return the model, loading it on first use; None if it failed to load"""
+        if name in self._models:
+            return self._models[name]
+        if name in self._failed or name not in self._locks:
+            return None
+
+        with self._locks[name]:
+            if name in self._models:
+                return self._models[name]
+            if name in self._failed:
+                return None
+
+            start = time.perf_counter()
+            try:
+                model, source = self._load_file(name)
+                if self.on_load is not None:
+                    self.on_load(name, model)
+            except Exception as e:
+                self._failed[name] = str(e)
+                self.generation += 1
+                print(f"Failed to load {name} model: {e}")
+                return None
+
+            self._load_times[name] = time.perf_counter() - start
+            self._models[name] = model
+            self.generation += 1
+            print(f"Loaded {name} model from {source} in {self._load_times[name]:.2f}s")
+            return model
+
+    def register(self, name, model):
+        """Use an already built model (e.g. a stand-in) instead of loading one"""
+        self._locks.setdefault(name, threading.Lock())
+        self.model_paths[name] = None  # never reload the file over a registered model
+        self._failed.pop(name, None)
+        self._models[name] = model
+        self.generation += 1
+
+    def unload(self, name):
+        """Drop a loaded model so its memory can be freed; it is reloaded on next use"""
+        if self.model_paths.get(name) is None:
+            return  # registered models cannot be reloaded
+        with self._locks[name]:
+            self._models.pop(name, None)
+            self.generation += 1
+
+    def load_all(self):
+        """Load every model that is not loaded yet, in parallel"""
+        pending = [name for name in self.model_paths if name not in self._models and name not in self._failed]
+        if len(pending) > 1:
+            with ThreadPoolExecutor(min(self.max_workers, len(pending)), thread_name_prefix="model-load") as pool:
+                list(pool.map(self.get, pending))
+        elif pending:
+            self.get(pending[0])
+
+    def start_background_load(self, loader=None):
+        """
+        Load and warm up all models on a background thread; is_ready() flips when done.
+        loader(name) replaces the default self.get, e.g. to prepare another backend;
+        it returns None when the model could not be prepared.
+        """
+        loader = loader or self.get
+
+        def load():
+            start = time.perf_counter()
+            names = [name for name in self.model_paths if name not in self._failed]
+            with ThreadPoolExecutor(min(self.max_workers, max(1, len(names))), thread_name_prefix="model-load") as pool:
+                prepared = [result is not None for result in pool.map(loader, names)]
+            self._startup_seconds = time.perf_counter() - start
+            print(f"Model startup finished in {self._startup_seconds:.2f}s "
+                  f"({sum(prepared)} ready, {len(prepared) - sum(prepared)} failed)")
+            if any(prepared):
+                self._ready.set()
+
+        thread = threading.Thread(target=load, name="model-startup", daemon=True)
+        thread.start()
+        return thread
+
+    def mark_ready(self):
+        self._ready.set()
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def status(self):
+        return {
+            "ready": self.is_ready(),
+            "loaded": sorted(self._models),
+            "failed": dict(self._failed),
+            "pending": [name for name in self.model_paths if name not in self._models and name not in self._failed],
+            "load_seconds": dict(self._load_times),
+            "startup_seconds": self._startup_seconds
+        }
@@ -0,0 +1,354 @@
+"""
+OpenCV/NumPy rendering of the analysis figures.
+
+Every render_* function composes its figure straight into an RGB uint8
+array; encode_image turns a rendered array into PNG, JPEG or WebP bytes.
+"""
+import os
+
+import cv2
+import numpy as np
+
+# -------------------------
+# Render configuration
+# -------------------------
+# none    - no figures (and no explanations) are produced
+# summary - comparison, confidence and agreement figures only
+# full    - summary figures plus one explanation figure per model
+RENDER_LEVELS = ("none", "summary", "full")
+RENDER_LEVEL = os.environ.get("RENDER_LEVEL", "full")
+RENDER_FORMAT = os.environ.get("RENDER_FORMAT", "png")
+RENDER_PANEL_SIZE = int(os.environ.get("RENDER_PANEL_SIZE", "512"))
+PNG_COMPRESSION = int(os.environ.get("RENDER_PNG_COMPRESSION", "3"))
+JPEG_QUALITY = int(os.environ.get("RENDER_JPEG_QUALITY", "90"))
+WEBP_QUALITY = int(os.environ.get("RENDER_WEBP_QUALITY", "80"))
+
+IMAGE_EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "jpg": ".jpg", "webp": ".webp"}
+
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+GRID = (225, 225, 225)
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+# Line colours for the per-model confidence series
+LINE_COLORS = [(31, 119, 180), (255, 127, 14), (44, 160, 44), (214, 39, 40),
+               (148, 103, 189), (140, 86, 75), (227, 119, 194), (127, 127, 127)]
+
+# Anchor colours of the RdYlGn colormap used for the agreement matrix
+RDYLGN_ANCHORS = np.array([
+    (165, 0, 38), (215, 48, 39), (244, 109, 67), (253, 174, 97), (254, 224, 139),
+    (255, 255, 191), (217, 239, 139), (166, 217, 106), (102, 189, 99), (26, 152, 80),
+    (0, 104, 55)
+], dtype=np.float32)
+
+
+def validate_render_level(render_level):
+    """Return the render level, falling back to RENDER_LEVEL when None"""
+    if render_level is None:
+        render_level = RENDER_LEVEL
+    if render_level not in RENDER_LEVELS:
+        raise ValueError(f"Unknown render level '{render_level}', expected one of {RENDER_LEVELS}")
+    return render_level
+
+
+def validate_image_format(image_format):
+    """Return the image format, falling back to RENDER_FORMAT when None"""
+    if image_format is None:
+        image_format = RENDER_FORMAT
+    if image_format.lower() not in IMAGE_EXTENSIONS:
+        raise ValueError(f"Unknown image format '{image_format}', expected one of {tuple(IMAGE_EXTENSIONS)}")
+    return image_format.lower()
+
+
+def image_filename(stem, image_format=None):
+    """File name for a rendered figure in the given encoder format"""
+    return stem + IMAGE_EXTENSIONS[(image_format or RENDER_FORMAT).lower()]
+
+
+# -------------------------
+# Heatmaps
+# -------------------------
+def create_heatmap_overlay(original_img, heatmap, colormap=cv2.COLORMAP_JET, alpha=0.4):
+    """Create heatmap overlay on original image"""
+    # Resize heatmap to match original image
+    heatmap_resized = cv2.resize(heatmap, (original_img.shape[1], original_img.shape[0]))
+
+    # Convert to 0-255 range
+    heatmap_uint8 = np.uint8(255 * heatmap_resized)
+
+    # Apply colormap
+    heatmap_colored = cv2.applyColorMap(heatmap_uint8, colormap)
+    heatmap_colored = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
+
+    # Create overlay
+    overlay = cv2.addWeighted(original_img, 1-alpha, heatmap_colored, alpha, 0)
+    return overlay, heatmap_colored
+
+
+def colorize(heatmap, colormap=cv2.COLORMAP_HOT):
+    """Map a 0-1 heatmap to RGB with an OpenCV colormap"""
+    heatmap_colored = cv2.applyColorMap(np.uint8(255 * np.clip(heatmap, 0, 1)), colormap)
+    return cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
+
+
+def rdylgn(value):
+    """RdYlGn colour for a value in [0, 1]"""
+    position = float(np.clip(value, 0, 1)) * (len(RDYLGN_ANCHORS) - 1)
+    low = int(np.floor(position))
+    high = min(low + 1, len(RDYLGN_ANCHORS) - 1)
+    color = RDYLGN_ANCHORS[low] + (RDYLGN_ANCHORS[high] - RDYLGN_ANCHORS[low]) * (position - low)
+    return tuple(int(c) for c in color)
+
+
+# -------------------------
+# Drawing helpers
+# -------------------------
+def blank(height, width):
+    return np.full((height, width, 3), 255, dtype=np.uint8)
+
+
+def put_text(canvas, text, org, scale=0.6, color=BLACK, thickness=1, align="left"):
+    """Draw text with its baseline at org; align is left, center or right"""
+    (width, _), _ = cv2.getTextSize(text, FONT, scale, thickness)
+    x, y = org
+    if align == "center":
+        x -= width // 2
+    elif align == "right":
+        x -= width
+    cv2.putText(canvas, text, (int(x), int(y)), FONT, scale, color, thickness, cv2.LINE_AA)
+
+
+def text_patch(text, scale=0.5, thickness=1, rotate=None):
+    """Render text onto its own white patch, optionally rotated by a cv2.ROTATE_* code"""
+    (width, height), baseline = cv2.getTextSize(text, FONT, scale, thickness)
+    patch = blank(height + baseline + 4, width + 4)
+    cv2.putText(patch, text, (2, height + 2), FONT, scale, BLACK, thickness, cv2.LINE_AA)
+    if rotate is not None:
+        patch = cv2.rotate(patch, rotate)
+    return patch
+
+
+def paste(canvas, patch, x, y):
+    """Paste a patch with its top-left corner at (x, y), clipped to the canvas"""
+    x, y = int(max(0, x)), int(max(0, y))
+    height = min(patch.shape[0], canvas.shape[0] - y)
+    width = min(patch.shape[1], canvas.shape[1] - x)
+    if height > 0 and width > 0:
+        canvas[y:y + height, x:x + width] = patch[:height, :width]
+
+
+def fit_panel(img, size):
+    """Scale an image to fit a size x size panel, keeping its aspect ratio"""
+    scale = size / max(img.shape[0], img.shape[1])
+    width = max(1, int(round(img.shape[1] * scale)))
+    height = max(1, int(round(img.shape[0] * scale)))
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    resized = cv2.resize(img, (width, height), interpolation=interpolation)
+
+    panel = blank(size, size)
+    paste(panel, resized, (size - width) // 2, (size - height) // 2)
+    return panel
+
+
+def titled_panel(img, title, size):
+    """Image panel with a centered title above it"""
+    title_height = max(24, size // 12)
+    panel = blank(size + title_height, size)
+    if img is not None:
+        panel[title_height:] = fit_panel(img, size)
+    if title:
+        put_text(panel, title, (size // 2, title_height - 8), scale=size / 900, align="center")
+    return panel
+
+
+def stack(images, axis=1, gap=16):
+    """Stack images side by side (axis=1) or top to bottom (axis=0) with white gaps"""
+    if axis == 1:
+        height = max(img.shape[0] for img in images)
+        canvas = blank(height, sum(img.shape[1] for img in images) + gap * (len(images) - 1))
+        offset = 0
+        for img in images:
+            paste(canvas, img, offset, 0)
+            offset += img.shape[1] + gap
+    else:
+        width = max(img.shape[1] for img in images)
+        canvas = blank(sum(img.shape[0] for img in images) + gap * (len(images) - 1), width)
+        offset = 0
+        for img in images:
+            paste(canvas, img, 0, offset)
+            offset += img.shape[0] + gap
+    return canvas
+
+
+def with_header(body, title, scale=1.0):
+    """Add a centered title band above a figure body"""
+    header_height = int(50 * scale)
+    canvas = blank(body.shape[0] + header_height, body.shape[1])
+    put_text(canvas, title, (body.shape[1] // 2, int(header_height * 0.7)), scale=scale,
+             thickness=2, align="center")
+    paste(canvas, body, 0, header_height)
+    return canvas
+
+
+# -------------------------
+# Figures
+# -------------------------
+def render_model_explanation(original_img, explanation, model_name, title, panel_size=None):
+    """Original / heatmap / overlay panels for a single model"""
+    panel_size = panel_size or RENDER_PANEL_SIZE
+    overlay, _ = create_heatmap_overlay(original_img, explanation, cv2.COLORMAP_JET)
+    body = stack([
+        titled_panel(original_img, "Original Image", panel_size),
+        titled_panel(colorize(explanation, cv2.COLORMAP_HOT), f"{model_name} Heatmap", panel_size),
+        titled_panel(overlay, f"{model_name} Overlay", panel_size)
+    ])
+    return with_header(body, title, scale=panel_size / 500)
+
+
+def render_comparison(original_img, rows, title="Multi-Model Explainable AI Analysis", panel_size=None):
+    """
+    One row per model: original (first row only), heatmap, overlay and text.
+    rows: list of dicts with "model_name", "explanation" and "lines" (text lines)
+    """
+    panel_size = panel_size or RENDER_PANEL_SIZE
+    row_images = []
+    for i, row in enumerate(rows):
+        model_name = row["model_name"]
+        overlay, _ = create_heatmap_overlay(original_img, row["explanation"], cv2.COLORMAP_JET)
+
+        text_panel = blank(panel_size, panel_size)
+        line_height = int(panel_size / 10)
+        top = panel_size // 2 - line_height * (len(row["lines"]) - 1) // 2
+        for j, line in enumerate(row["lines"]):
+            put_text(text_panel, line, (panel_size // 10, top + j * line_height), scale=panel_size / 800)
+
+        row_images.append(stack([
+            titled_panel(original_img if i == 0 else None, "Original Image" if i == 0 else "", panel_size),
+            titled_panel(colorize(row["explanation"], cv2.COLORMAP_HOT), f"{model_name} Heatmap", panel_size),
+            titled_panel(overlay, f"{model_name} Overlay", panel_size),
+            titled_panel(text_panel, "", panel_size)
+        ]))
+    return with_header(stack(row_images, axis=0), title, scale=panel_size / 400)
+
+
+def render_confidence_chart(series, class_labels, width=None, height=None,
+                            title="Model Confidence Comparison Across Classes"):
+    """
+    Line chart of each model's class probabilities.
+    series: model_name -> probabilities (0-1) in class_labels order
+    """
+    width = width or RENDER_PANEL_SIZE * 2
+    height = height or int(RENDER_PANEL_SIZE * 1.3)
+    label_scale = 0.45
+
+    tick_labels = [text_patch(label, label_scale, rotate=cv2.ROTATE_90_COUNTERCLOCKWISE) for label in class_labels]
+    left, right, top = 80, 20, 50
+    bottom = max(patch.shape[0] for patch in tick_labels) + 40
+    plot_width = width - left - right
+    plot_height = height - top - bottom
+    canvas = blank(height, width)
+
+    def to_xy(class_index, percent):
+        x = left + (class_index + 0.5) * plot_width / len(class_labels)
+        y = top + plot_height * (1 - percent / 100)
+        return int(round(x)), int(round(y))
+
+    # Grid and y axis
+    for percent in range(0, 101, 20):
+        _, y = to_xy(0, percent)
+        cv2.line(canvas, (left, y), (left + plot_width, y), GRID, 1)
+        put_text(canvas, str(percent), (left - 8, y + 5), scale=label_scale, align="right")
+    for i in range(len(class_labels)):
+        x, _ = to_xy(i, 0)
+        cv2.line(canvas, (x, top), (x, top + plot_height), GRID, 1)
+        patch = tick_labels[i]
+        paste(canvas, patch, x - patch.shape[1] // 2, top + plot_height + 8)
+    cv2.rectangle(canvas, (left, top), (left + plot_width, top + plot_height), BLACK, 1)
+
+    # One line per model
+    for j, (model_name, probabilities) in enumerate(series.items()):
+        color = LINE_COLORS[j % len(LINE_COLORS)]
+        points = np.array([to_xy(i, p * 100) for i, p in enumerate(probabilities)], dtype=np.int32)
+        cv2.polylines(canvas, [points], False, color, 2, cv2.LINE_AA)
+        for point in points:
+            cv2.circle(canvas, tuple(int(v) for v in point), 5, color, -1, cv2.LINE_AA)
+
+    # Legend in the top-right corner of the plot
+    legend_width = 30 + max(cv2.getTextSize(name, FONT, label_scale, 1)[0][0] for name in series) + 16
+    legend_x = left + plot_width - legend_width - 10
+    cv2.rectangle(canvas, (legend_x, top + 10), (legend_x + legend_width, top + 14 + 20 * len(series)), GRID, 1)
+    for j, model_name in enumerate(series):
+        y = top + 24 + 20 * j
+        cv2.line(canvas, (legend_x + 6, y), (legend_x + 26, y), LINE_COLORS[j % len(LINE_COLORS)], 2, cv2.LINE_AA)
+        put_text(canvas, model_name, (legend_x + 32, y + 5), scale=label_scale)
+
+    # Axis labels and title
+    put_text(canvas, "Class Labels", (left + plot_width // 2, height - 10), scale=0.55, align="center")
+    y_label = text_patch("Confidence (%)", 0.55, rotate=cv2.ROTATE_90_COUNTERCLOCKWISE)
+    paste(canvas, y_label, 8, top + (plot_height - y_label.shape[0]) // 2)
+    put_text(canvas, title, (width // 2, 32), scale=0.8, thickness=2, align="center")
+    return canvas
+
+
+def render_agreement_matrix(agreement_matrix, model_names, cell_size=None, title="Model Agreement Matrix"):
+    """Annotated RdYlGn agreement matrix with a colour bar"""
+    cell_size = cell_size or RENDER_PANEL_SIZE // 4
+    label_scale = 0.5
+    n = len(model_names)
+
+    left = max(cv2.getTextSize(name, FONT, label_scale, 1)[0][0] for name in model_names) + 20
+    top, bottom = 60, 50
+    bar_width, bar_gap, bar_labels = 24, 30, 110
+    width = left + n * cell_size + bar_gap + bar_width + bar_labels
+    height = top + n * cell_size + bottom
+    canvas = blank(height, width)
+
+    for i in range(n):
+        for j in range(n):
+            value = float(agreement_matrix[i, j])
+            x0, y0 = left + j * cell_size, top + i * cell_size
+            cv2.rectangle(canvas, (x0, y0), (x0 + cell_size, y0 + cell_size), rdylgn(value), -1)
+            put_text(canvas, f"{value:.2f}", (x0 + cell_size // 2, y0 + cell_size // 2 + 6),
+                     scale=cell_size / 220, align="center")
+
+    for i, name in enumerate(model_names):
+        put_text(canvas, name, (left - 10, top + i * cell_size + cell_size // 2 + 5),
+                 scale=label_scale, align="right")
+        put_text(canvas, name, (left + i * cell_size + cell_size // 2, top + n * cell_size + 25),
+                 scale=label_scale, align="center")
+
+    # Colour bar from 0 (bottom) to 1 (top)
+    bar_x = left + n * cell_size + bar_gap
+    bar_height = n * cell_size
+    for k in range(bar_height):
+        cv2.line(canvas, (bar_x, top + k), (bar_x + bar_width, top + k), rdylgn(1 - k / max(1, bar_height - 1)), 1)
+    cv2.rectangle(canvas, (bar_x, top), (bar_x + bar_width, top + bar_height), BLACK, 1)
+    for value in (0.0, 0.5, 1.0):
+        y = int(top + (1 - value) * bar_height)
+        put_text(canvas, f"{value:.1f}", (bar_x + bar_width + 6, y + 5), scale=label_scale)
+    bar_label = text_patch("Agreement Score", label_scale, rotate=cv2.ROTATE_90_CLOCKWISE)
+    paste(canvas, bar_label, bar_x + bar_width + 45, top + (bar_height - bar_label.shape[0]) // 2)
+
+    put_text(canvas, title, (width // 2, 38), scale=0.8, thickness=2, align="center")
+    return canvas
+
+
+# -------------------------
+# Encoding
+# -------------------------
+def encode_image(img, image_format=None, quality=None):
+    """Encode an RGB array as PNG, JPEG or WebP bytes; quality overrides the JPEG/WebP default"""
+    image_format = (image_format or RENDER_FORMAT).lower()
+    if image_format == "png":
+        params = [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+    elif image_format in ("jpeg", "jpg"):
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality or JPEG_QUALITY]
+    elif image_format == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality or WEBP_QUALITY]
+    else:
+        raise ValueError(f"Unsupported image format '{image_format}'")
+
+    success, buffer = cv2.imencode(IMAGE_EXTENSIONS[image_format], cv2.cvtColor(img, cv2.COLOR_RGB2BGR), params)
+    if not success:
+        raise ValueError(f"Could not encode image as {image_format}")
+    return buffer.tobytes()
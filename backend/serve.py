@@ -0,0 +1,84 @@
+"""
+Start the API with several uvicorn workers.
+
+    python serve.py --workers 4                  # every worker loads its own copy of the models
+    python serve.py --workers 4 --model-host     # one model host process, shared by all workers
+
+With --model-host the host is started first and the workers get
+MODEL_HOST=<address>, so the weights are in memory once instead of once per
+worker. Host and workers share a random MODEL_HOST_AUTHKEY generated here
+unless one is set; it must be set explicitly when the host listens on TCP.
+The host is stopped again when the server exits.
+"""
+import argparse
+import os
+import secrets
+import subprocess
+import sys
+import time
+
+import uvicorn
+
+from model_host import DEFAULT_ADDRESS, HostClient, parse_address
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_model_host(address, timeout):
+    """Start model_host.py and wait until it accepts connections (models may still be loading)"""
+    env = dict(os.environ)
+    env.pop("MODEL_HOST", None)
+    process = subprocess.Popen([sys.executable, os.path.join(HERE, "model_host.py"), "--address", address], env=env)
+
+    client = HostClient(address)
+    deadline = time.time() + timeout
+    while True:
+        if process.poll() is not None:
+            raise SystemExit(f"Model host exited with code {process.returncode}")
+        try:
+            client.call({"op": "info"})
+            return process
+        except ConnectionError:
+            if time.time() > deadline:
+                process.terminate()
+                raise SystemExit(f"Model host did not come up within {timeout}s")
+            time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the paddy leaf API with several workers")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--model-host", action="store_true",
+                        help="Load the models once in a separate host process shared by the workers")
+    parser.add_argument("--host-address", default=os.environ.get("MODEL_HOST_ADDRESS", DEFAULT_ADDRESS),
+                        help="Unix socket path or host:port of the model host")
+    parser.add_argument("--host-timeout", type=float, default=120.0,
+                        help="Seconds to wait for the model host to accept connections")
+    args = parser.parse_args()
+
+    host_process = None
+    if args.model_host:
+        if not os.environ.get("MODEL_HOST_AUTHKEY"):
+            if not isinstance(parse_address(args.host_address), str):
+                raise SystemExit("Set MODEL_HOST_AUTHKEY to use a TCP model host address")
+            # inherited by the host and the workers
+            os.environ["MODEL_HOST_AUTHKEY"] = secrets.token_hex(32)
+        host_process = start_model_host(args.host_address, args.host_timeout)
+        os.environ["MODEL_HOST"] = args.host_address  # inherited by the workers
+        print(f"Model host running (pid {host_process.pid}) on {args.host_address}")
+
+    try:
+        uvicorn.run("app:app", host=args.host, port=args.port, workers=args.workers)
+    finally:
+        if host_process is not None:
+            host_process.terminate()
+            try:
+                host_process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                host_process.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Small stand-in Keras models for benchmarks and load tests.
+
+Each stand-in takes the real backbone's input size and ends in the same
+9-class softmax head, so the whole pipeline (preprocessing, fused ensemble,
+explanations, rendering) runs on a CPU box without the .h5 files. Weights
+come from a fixed seed, so repeated runs see the same predictions.
+"""
+import tensorflow as tf
+
+STANDIN_FILTERS = (16, 32, 64)
+
+
+def build_standin_model(input_size, n_classes=9, filters=STANDIN_FILTERS, seed=0, name="standin", weight_mb=0):
+    """
+    Strided conv stack + global pooling + softmax head for an (h, w) input size.
+    weight_mb > 0 adds a wide dense layer so the model holds about that many
+    MB of float32 weights, e.g. to measure memory like a real backbone.
+    """
+    inputs = tf.keras.Input(shape=(input_size[0], input_size[1], 3))
+    x = inputs
+    for i, n_filters in enumerate(filters):
+        x = tf.keras.layers.Conv2D(
+            n_filters, 3, strides=2, padding="same", activation="relu",
+            kernel_initializer=tf.keras.initializers.GlorotUniform(seed=seed + i), name=f"conv_{i}"
+        )(x)
+    x = tf.keras.layers.GlobalAveragePooling2D(name="pool")(x)
+    if weight_mb > 0:
+        units = max(1, int(weight_mb * 1e6 / 4 / (filters[-1] + 1 + n_classes)))
+        x = tf.keras.layers.Dense(
+            units, kernel_initializer=tf.keras.initializers.GlorotUniform(seed=seed + len(filters) + 1),
+            name="padding"
+        )(x)
+    outputs = tf.keras.layers.Dense(
+        n_classes, activation="softmax",
+        kernel_initializer=tf.keras.initializers.GlorotUniform(seed=seed + len(filters)), name="predictions"
+    )(x)
+    return tf.keras.Model(inputs, outputs, name=name)
+
+
+def register_standin_models(registry, model_configs, n_classes=9, filters=STANDIN_FILTERS, seed=0, weight_mb=0):
+    """Replace every model of a ModelRegistry with a stand-in of the same input size"""
+    for i, model_name in enumerate(list(registry.model_paths)):
+        model = build_standin_model(model_configs[model_name]["input_size"], n_classes=n_classes,
+                                    filters=filters, seed=seed + 10 * i, name=f"{model_name}_standin",
+                                    weight_mb=weight_mb)
+        registry.register(model_name, model)
+    registry.mark_ready()
+    return registry
@@ -0,0 +1,54 @@
+"""Artifact store: unique IDs, cleanup of failed writes and the retention sweep."""
+import os
+import time
+
+import pytest
+
+from artifacts import ArtifactStore
+
+
+def write_artifact(store, size, age=0):
+    """A finished artifact of `size` bytes whose mtime is `age` seconds in the past"""
+    with store.reserve() as (artifact_id, path):
+        with open(os.path.join(path, "report.json"), "wb") as f:
+            f.write(b"x" * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return artifact_id
+
+
+def test_failed_write_leaves_nothing_behind(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    with pytest.raises(RuntimeError):
+        with store.reserve() as (artifact_id, path):
+            open(os.path.join(path, "partial.png"), "wb").close()
+            raise RuntimeError("render failed")
+    assert not store.exists(artifact_id)
+    assert store.stats()["failed"] == 1
+
+
+def test_path_rejects_anything_but_store_ids(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    with pytest.raises(KeyError):
+        store.path("../etc")
+    assert not store.exists("../etc")
+
+
+def test_sweep_expires_old_artifacts(tmp_path):
+    store = ArtifactStore(str(tmp_path), max_age_seconds=60)
+    old = write_artifact(store, 10, age=120)
+    new = write_artifact(store, 10)
+    assert store.sweep() == 1
+    assert not store.exists(old) and store.exists(new)
+
+
+def test_sweep_evicts_least_recently_used_over_max_bytes(tmp_path):
+    store = ArtifactStore(str(tmp_path), max_bytes=250)
+    first = write_artifact(store, 100, age=30)
+    second = write_artifact(store, 100, age=20)
+    third = write_artifact(store, 100, age=10)
+    store.touch(first)  # used again, so second is now the least recent
+
+    assert store.sweep() == 1
+    assert store.exists(first) and not store.exists(second) and store.exists(third)
+    assert store.stats()["evicted"] == 1
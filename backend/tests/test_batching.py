@@ -0,0 +1,63 @@
+"""MicroBatcher groups concurrent calls and hands each caller its own result."""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from batching import MicroBatcher
+
+
+def test_concurrent_calls_share_a_batch():
+    batches = []
+    release = threading.Event()
+
+    def fn(items):
+        release.wait(5)
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    batcher = MicroBatcher(fn, max_batch_size=8, max_delay=0.2)
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(batcher.submit, i) for i in range(4)]
+        release.set()
+        results = [future.result(5) for future in futures]
+    batcher.close()
+
+    assert results == [0, 10, 20, 30]
+    assert sum(len(batch) for batch in batches) == 4
+    assert batcher.stats()["largest_batch"] > 1
+
+
+def test_batches_are_capped_at_max_batch_size():
+    batches = []
+
+    def fn(items):
+        batches.append(len(items))
+        return items
+
+    batcher = MicroBatcher(fn, max_batch_size=2, max_delay=0.2)
+    with ThreadPoolExecutor(5) as pool:
+        assert sorted(pool.map(batcher.submit, range(5))) == list(range(5))
+    batcher.close()
+    assert max(batches) <= 2
+
+
+def test_errors_reach_every_caller_in_the_batch():
+    def fn(items):
+        raise RuntimeError("boom")
+
+    batcher = MicroBatcher(fn, max_batch_size=4, max_delay=0.05)
+    with ThreadPoolExecutor(3) as pool:
+        futures = [pool.submit(batcher.submit, i) for i in range(3)]
+        for future in futures:
+            with pytest.raises(RuntimeError, match="boom"):
+                future.result(5)
+    batcher.close()
+
+
+def test_close_stops_the_dispatcher():
+    batcher = MicroBatcher(lambda items: items, max_delay=0.001)
+    assert batcher.submit(1) == 1
+    batcher.close()
+    batcher._thread.join(5)
+    assert not batcher._thread.is_alive()
@@ -0,0 +1,50 @@
+"""Bulk scan: the batched agreement rule and guarded file reads."""
+import numpy as np
+
+import app
+from bulk_scan import batch_rows, read_file
+
+N_MODELS = 4
+
+
+def one_hot_votes(votes, confidences):
+    """(1, n_classes) probabilities per model from its vote and confidence"""
+    n_classes = len(app.class_labels)
+    probabilities = np.full((len(votes), 1, n_classes), 0.0, np.float32)
+    for i, (vote, confidence) in enumerate(zip(votes, confidences)):
+        probabilities[i, 0, :] = (1 - confidence) / (n_classes - 1)
+        probabilities[i, 0, vote] = confidence
+    return probabilities
+
+
+def test_batch_rule_matches_the_single_image_rule():
+    rng = np.random.default_rng(0)
+    images = [one_hot_votes(rng.integers(0, 3, N_MODELS), rng.uniform(0.4, 0.99, N_MODELS)) for _ in range(50)]
+    is_paddy, final_class, confidence, best_model = app.is_paddy_leaf_batch(np.concatenate(images, axis=1))
+
+    model_names = [f"m{i}" for i in range(N_MODELS)]
+    for k, probabilities in enumerate(images):
+        predictions = {name: {"pred_class": int(np.argmax(probabilities[i, 0])),
+                              "confidence": float(probabilities[i, 0].max() * 100)}
+                       for i, name in enumerate(model_names)}
+        expected = app.is_paddy_leaf(predictions, app.class_labels)
+        assert bool(is_paddy[k]) == expected[0]
+        if expected[0]:
+            assert app.class_labels[final_class[k]] == expected[1]
+            assert np.isclose(confidence[k], expected[2])
+            assert model_names[best_model[k]] == expected[3]
+        else:
+            assert final_class[k] == -1 and best_model[k] == -1
+
+
+def test_unreadable_files_become_error_rows(tmp_path):
+    good = tmp_path / "leaf.jpg"
+    good.write_bytes(b"bytes")
+    assert read_file(str(good).encode()) == (b"bytes", b"")
+
+    img_bytes, error = read_file(str(tmp_path / "missing.jpg").encode())
+    assert img_bytes == b"" and error.startswith(b"Could not read file")
+
+    probabilities = one_hot_votes([0] * N_MODELS, [0.9] * N_MODELS)
+    rows = batch_rows(["missing.jpg"], [error.decode()], probabilities, [f"m{i}" for i in range(N_MODELS)])
+    assert rows[0]["error"].startswith("Could not read file") and rows[0]["is_paddy"] is None
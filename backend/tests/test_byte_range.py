@@ -0,0 +1,66 @@
+"""Range requests on /artifacts: header parsing, 206, 416 and ETag revalidation."""
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+from artifacts import ArtifactStore, parse_byte_range
+
+SIZE = 1000
+
+
+@pytest.mark.parametrize("header, span", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=900-", (900, 999)),
+    ("bytes=-100", (900, 999)),      # suffix range
+    ("bytes=-5000", (0, 999)),       # suffix longer than the file
+    ("bytes=500-5000", (500, 999)),  # end past the file is clamped
+    ("items=0-99", None),            # other units are ignored
+    ("bytes=0-1,5-6", None),         # so are several ranges
+    ("bytes=abc", None),
+    ("bytes=5-1", None),
+])
+def test_parse_byte_range(header, span):
+    assert parse_byte_range(header, SIZE) == span
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=5000-6000", "bytes=-0"])
+def test_unsatisfiable_ranges_raise(header):
+    with pytest.raises(ValueError):
+        parse_byte_range(header, SIZE)
+
+
+@pytest.fixture
+def artifact(tmp_path, monkeypatch):
+    store = ArtifactStore(str(tmp_path))
+    monkeypatch.setattr(app, "artifact_store", store)
+    with store.reserve() as (artifact_id, path):
+        with open(os.path.join(path, "report.json"), "wb") as f:
+            f.write(bytes(range(256)) * 4)
+    return f"/artifacts/{artifact_id}/report.json"
+
+
+def test_artifact_route_serves_ranges(artifact):
+    # No lifespan: the route only needs the artifact store, not the models
+    client = TestClient(app.app)
+    full = client.get(artifact)
+    assert full.status_code == 200 and len(full.content) == 1024
+
+    partial = client.get(artifact, headers={"Range": "bytes=-24"})
+    assert partial.status_code == 206
+    assert partial.headers["content-range"] == "bytes 1000-1023/1024"
+    assert partial.content == full.content[-24:]
+
+    overflow = client.get(artifact, headers={"Range": "bytes=2000-"})
+    assert overflow.status_code == 416
+    assert overflow.headers["content-range"] == "bytes */1024"
+
+    cached = client.get(artifact, headers={"If-None-Match": full.headers["etag"]})
+    assert cached.status_code == 304
+
+
+def test_artifact_route_rejects_unknown_ids(artifact):
+    client = TestClient(app.app)
+    assert client.get("/artifacts/not-an-id/report.json").status_code == 404
+    assert client.get(artifact.replace("report.json", ".hidden")).status_code == 404
@@ -0,0 +1,59 @@
+"""Result cache keys, LRU eviction and perceptual (dHash) matching."""
+import cv2
+import numpy as np
+import pytest
+
+from cache import ResultCache, content_key, hamming_distance, perceptual_hash
+
+
+@pytest.fixture(scope="module")
+def photo():
+    """A smooth synthetic photo, so re-encoding barely changes its dHash"""
+    y, x = np.mgrid[0:128, 0:128]
+    img = np.stack([x * 2, y * 2, (x + y)], axis=-1).astype(np.uint8)
+    return img
+
+
+def encode(img, ext=".png", params=()):
+    ok, buffer = cv2.imencode(ext, img, list(params))
+    assert ok
+    return buffer.tobytes()
+
+
+def test_content_key_depends_on_bytes_and_variant():
+    assert content_key(b"abc", "v1") == content_key(b"abc", "v1")
+    assert content_key(b"abc", "v1") != content_key(b"abc", "v2")
+    assert content_key(b"abc", "v1") != content_key(b"abd", "v1")
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResultCache(memory_max_bytes=80)  # room for two entries
+    for name in ("a", "b"):
+        key, _ = cache.get(name.encode(), "v")
+        cache.put(key, {"name": name, "pad": "x" * 10})
+    cache.get(b"a", "v")  # a is now more recent than b
+    key, _ = cache.get(b"c", "v")
+    cache.put(key, {"name": "c", "pad": "x" * 10})
+
+    assert cache.get(b"a", "v")[1] == {"name": "a", "pad": "x" * 10}
+    assert cache.get(b"b", "v")[1] is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_perceptual_hash_matches_a_reencoded_copy(photo):
+    png = encode(photo)
+    jpeg = encode(photo, ".jpg", (cv2.IMWRITE_JPEG_QUALITY, 70))
+    assert hamming_distance(perceptual_hash(png), perceptual_hash(jpeg)) <= 4
+    assert perceptual_hash(b"not an image") is None
+
+
+def test_perceptual_lookup_respects_variant(photo):
+    png = encode(photo)
+    jpeg = encode(photo, ".jpg", (cv2.IMWRITE_JPEG_QUALITY, 70))
+    cache = ResultCache(memory_max_bytes=1 << 20, perceptual=True, max_distance=4)
+    key, _ = cache.get(png, "v")
+    cache.put(key, {"disease": "Brown Spot"}, img_bytes=png, variant="v")
+
+    assert cache.get(jpeg, "v")[1] == {"disease": "Brown Spot"}
+    assert cache.get(jpeg, "other")[1] is None
+    assert cache.stats()["perceptual_hits"] == 1
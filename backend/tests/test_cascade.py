@@ -0,0 +1,33 @@
+"""Early-exit cascade: when the 3-of-4 vote is decided and which model runs first."""
+import pytest
+
+import app
+
+
+class FakeModel:
+    def __init__(self, params):
+        self.params = params
+
+    def count_params(self):
+        return self.params
+
+
+@pytest.mark.parametrize("pred_classes, n_remaining, decided", [
+    ([], 4, False),
+    ([1], 3, False),
+    ([1, 1], 2, False),
+    ([1, 1, 1], 1, True),   # three agree, the last vote cannot change it
+    ([1, 2], 2, False),     # class 1 or 2 can still reach three
+    ([1, 2, 3], 1, True),   # nothing can reach three any more
+    ([1, 1, 2], 1, False),  # the last model decides
+    ([1, 1, 2, 2], 0, True),
+])
+def test_vote_decided(pred_classes, n_remaining, decided):
+    assert app.vote_decided(pred_classes, n_remaining) == decided
+
+
+def test_cascade_order_prefers_measured_then_estimated_cost(monkeypatch):
+    models = {"big": FakeModel(1000), "small": FakeModel(10), "timed": FakeModel(500)}
+    # "timed" is measured as cheap; the others are estimated from their size at its seconds per byte
+    monkeypatch.setattr(app, "_model_costs", {"timed": 0.001})
+    assert app.cascade_order(models) == ["small", "timed", "big"]
@@ -0,0 +1,41 @@
+"""Explainer choice by name or by latency budget."""
+import pytest
+
+import app
+
+MODEL_NAMES = ["m1", "m2"]
+
+
+@pytest.fixture
+def measured_costs(monkeypatch):
+    costs = {"smoothgrad": 1.0, "gradcam": 0.02, "gradient": 0.01}
+    monkeypatch.setattr(app, "_explainer_costs",
+                        {(explainer, model_name): seconds for explainer, seconds in costs.items()
+                         for model_name in MODEL_NAMES})
+
+
+def test_named_explainer_wins_over_the_budget(measured_costs):
+    assert app.choose_explainer("gradient", 1.0, MODEL_NAMES) == "gradient"
+    assert app.choose_explainer(None, None, MODEL_NAMES) == app.EXPLAINER
+
+
+def test_unknown_explainer_is_rejected():
+    with pytest.raises(ValueError, match="Unknown explainer"):
+        app.choose_explainer("lime", None, MODEL_NAMES)
+
+
+def test_budget_picks_the_most_detailed_explainer_that_fits(measured_costs):
+    smoothgrad = app.EXPLAINERS["smoothgrad"]
+    # SmoothGrad fits once the budget covers its fewest passes for both models
+    smoothgrad_ms = 2 * 1000 * smoothgrad["min_passes"] / smoothgrad["passes"] * 1.01
+    assert app.choose_explainer(None, smoothgrad_ms, MODEL_NAMES) == "smoothgrad"
+    assert app.choose_explainer(None, 50, MODEL_NAMES) == "gradcam"
+    # Nothing fits: the cheapest one
+    assert app.choose_explainer(None, 1, MODEL_NAMES) == "gradient"
+
+
+def test_unmeasured_costs_are_estimated_from_the_predict_cost(monkeypatch):
+    monkeypatch.setattr(app, "_explainer_costs", {})
+    monkeypatch.setattr(app, "_model_costs", {"m1": 0.1, "m2": 0.1})
+    expected = 2 * app.EXPLAINERS["gradcam"]["passes"] * app.BACKWARD_COST_FACTOR * 0.1
+    assert app.estimate_explainer_cost("gradcam", MODEL_NAMES) == pytest.approx(expected)
@@ -0,0 +1,44 @@
+"""Batched SmoothGrad must match the original one-sample-at-a-time loop."""
+import numpy as np
+import pytest
+import tensorflow as tf
+
+import app
+from standin_models import build_standin_model
+
+INPUT_SIZE = (32, 32)
+NOISE_LEVEL = 0.1
+SEED = 0
+
+
+@pytest.fixture(scope="module")
+def model():
+    return build_standin_model(INPUT_SIZE, n_classes=4, filters=(4, 8), seed=SEED)
+
+
+@pytest.fixture(scope="module")
+def img():
+    rng = np.random.default_rng(SEED)
+    return tf.constant(rng.uniform(-1, 1, (1,) + INPUT_SIZE + (3,)).astype(np.float32))
+
+
+def looped_smoothgrad(img, model, class_index, n_samples):
+    """The per-sample loop SmoothGrad used before batching, with the same seeded noise"""
+    gradients_sum = tf.zeros_like(img)
+    for i in range(n_samples):
+        noise = tf.random.stateless_normal(img.shape[1:], seed=[SEED, i])[tf.newaxis] * NOISE_LEVEL
+        noisy = img + noise
+        with tf.GradientTape() as tape:
+            tape.watch(noisy)
+            class_output = model(noisy, training=False)[:, class_index]
+        gradients_sum += tape.gradient(class_output, noisy)
+    return app.smoothgrad_map(gradients_sum, n_samples)
+
+
+@pytest.mark.parametrize("batch_size", [1, 4, 10, 30])
+def test_batched_matches_loop(img, model, batch_size):
+    expected = looped_smoothgrad(img, model, 1, 30)
+    batched = app.generate_smoothgrad_explanation(img, model, 1, noise_level=NOISE_LEVEL, n_samples=30,
+                                                  batch_size=batch_size, seed=SEED)
+    np.testing.assert_allclose(batched, expected, atol=1e-4)
+
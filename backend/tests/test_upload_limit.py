@@ -0,0 +1,48 @@
+"""Upload size cap: declared and streamed bodies over the limit get 413."""
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from upload_limit import UploadLimitMiddleware
+
+MAX_BYTES = 1000
+
+
+@pytest.fixture(scope="module")
+def client():
+    api = FastAPI()
+
+    @api.post("/analyze")
+    @api.post("/other")
+    async def echo(request: Request):
+        return {"received": len(await request.body())}
+
+    api.add_middleware(UploadLimitMiddleware, max_bytes=MAX_BYTES, paths=["/analyze"])
+    return TestClient(api)
+
+
+def chunks(total, size=100):
+    for _ in range(total // size):
+        yield b"x" * size
+
+
+def test_body_within_the_limit_passes(client):
+    response = client.post("/analyze", content=b"x" * MAX_BYTES)
+    assert response.status_code == 200 and response.json() == {"received": MAX_BYTES}
+
+
+def test_declared_content_length_over_the_limit_is_rejected(client):
+    response = client.post("/analyze", content=b"x" * (MAX_BYTES + 1))
+    assert response.status_code == 413
+    assert "larger than" in response.json()["detail"]
+
+
+def test_streamed_body_over_the_limit_is_rejected(client):
+    # No Content-Length: the middleware has to count the chunks
+    response = client.post("/analyze", content=chunks(3 * MAX_BYTES))
+    assert response.status_code == 413
+
+
+def test_other_paths_are_not_limited(client):
+    response = client.post("/other", content=b"x" * (3 * MAX_BYTES))
+    assert response.status_code == 200 and response.json() == {"received": 3 * MAX_BYTES}
@@ -0,0 +1,112 @@
+"""
+TFLite inference backend for the ensemble backbones.
+
+convert_to_tflite turns a Keras model into a (quantized) TFLite flatbuffer;
+TFLiteModel runs it through the TFLite interpreter, whose default op
+resolver applies the XNNPACK delegate on CPU. Converted files are cached
+next to each other as <name>.<quantization>.tflite.
+"""
+import os
+import threading
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+QUANTIZATION_MODES = ("none", "dynamic", "float16", "int8")
+IMAGE_FILE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def load_calibration_images(calibration_dir, input_size, limit=100):
+    """Raw RGB float32 images (0-255) from a directory, resized to input_size"""
+    images = []
+    for fname in sorted(os.listdir(calibration_dir)):
+        if not fname.lower().endswith(IMAGE_FILE_EXTENSIONS):
+            continue
+        img = cv2.imread(os.path.join(calibration_dir, fname), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        if img is None:
+            continue
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        img = cv2.resize(img, (input_size[1], input_size[0]), interpolation=cv2.INTER_NEAREST_EXACT)
+        images.append(img.astype(np.float32))
+        if len(images) >= limit:
+            break
+    return images
+
+
+def convert_to_tflite(model, quantization="dynamic", calibration_images=None, preprocess_func=None):
+    """
+    Convert a Keras model to a TFLite flatbuffer.
+    quantization: none, dynamic (int8 weights), float16 (fp16 weights) or
+    int8 (full-integer, needs calibration_images). Inputs and outputs stay
+    float32 so callers do not change.
+    """
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization '{quantization}', expected one of {QUANTIZATION_MODES}")
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization != "none":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if not calibration_images:
+            raise ValueError("Full-integer quantization needs a calibration set")
+
+        def representative_dataset():
+            for img in calibration_images:
+                batch = tf.convert_to_tensor(img[np.newaxis], dtype=tf.float32)
+                if preprocess_func is not None:
+                    batch = preprocess_func(batch)
+                yield [batch]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    return converter.convert()
+
+
+class TFLiteModel:
+    """Thread-safe wrapper around a TFLite interpreter with a float32 predict()"""
+    def __init__(self, model_content, num_threads=None):
+        self.interpreter = tf.lite.Interpreter(
+            model_content=model_content,
+            num_threads=num_threads or os.cpu_count(),
+            # AUTO is the builtin resolver with the XNNPACK delegate applied
+            experimental_op_resolver_type=tf.lite.experimental.OpResolverType.AUTO
+        )
+        self.interpreter.allocate_tensors()
+        self.input_index = self.interpreter.get_input_details()[0]["index"]
+        self.output_index = self.interpreter.get_output_details()[0]["index"]
+        self.size_bytes = len(model_content)
+        self._batch_size = 1
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, num_threads=None):
+        with open(path, "rb") as f:
+            return cls(f.read(), num_threads=num_threads)
+
+    def predict(self, batch):
+        """Class probabilities for a preprocessed float32 batch"""
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self.input_index, batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self.interpreter.set_tensor(self.input_index, batch)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output_index).copy()
+
+
+def tflite_path(cache_dir, model_name, quantization):
+    return os.path.join(cache_dir, f"{model_name}.{quantization}.tflite")
+
+
+def save_tflite(model_content, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(model_content)
+    os.replace(tmp_path, path)
@@ -0,0 +1,134 @@
+"""
+Accuracy drift, latency and size of TFLite copies against the float Keras models.
+
+Every model is converted with each requested quantization mode and run on the
+images of a directory; top-1 agreement and probability differences are
+measured against the float model. Results are written as JSON.
+
+Usage:
+    python tflite_report.py --images ./test_images --quantization dynamic float16 int8 \
+        --calibration ./calibration --output tflite_report.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import time
+
+import numpy as np
+
+from app import (models, MODEL_CONFIGS, MODEL_PATHS, get_ensemble_runner, preprocess_for_models,
+                 size_inputs_from)
+from tflite_backend import (IMAGE_FILE_EXTENSIONS, QUANTIZATION_MODES, TFLiteModel, convert_to_tflite,
+                            load_calibration_images)
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_images(image_dir, limit):
+    images = []
+    for fname in sorted(os.listdir(image_dir)):
+        if fname.lower().endswith(IMAGE_FILE_EXTENSIONS):
+            with open(os.path.join(image_dir, fname), "rb") as f:
+                images.append(f.read())
+        if len(images) >= limit:
+            break
+    return images
+
+
+def latency_ms(fn, runs):
+    fn()  # warm-up
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return float(np.percentile(latencies, 50))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TFLite vs Keras accuracy drift and latency report")
+    parser.add_argument("--images", default=".", help="Directory of evaluation images")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--quantization", nargs="+", default=["dynamic", "float16"], choices=QUANTIZATION_MODES)
+    parser.add_argument("--calibration", default=None, help="Calibration image directory (int8)")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", default="tflite_report.json")
+    args = parser.parse_args()
+
+    images = load_images(args.images, args.limit)
+    if not images:
+        raise SystemExit(f"No images found in {args.images}")
+    print(f"Evaluating on {len(images)} images")
+
+    results = {
+        "host": {"machine": platform.machine(), "processor": platform.processor(), "cpus": os.cpu_count()},
+        "images": len(images),
+        "models": {}
+    }
+
+    for model_name, model in models.items():
+        config = MODEL_CONFIGS[model_name]
+        size = config["input_size"]
+
+        raw_inputs = []
+        for img_bytes in images:
+            _, model_inputs, _ = preprocess_for_models(img_bytes, [model_name])
+            raw_inputs.append(size_inputs_from(model_inputs)[size])
+        preprocessed = [config["preprocess_func"](raw).numpy() for raw in raw_inputs]
+
+        runner = get_ensemble_runner({model_name: model})
+        float_probs = np.concatenate([runner({size: raw})[0] for raw in raw_inputs])
+        path = MODEL_PATHS.get(model_name)
+        row = {
+            "keras": {
+                "weights_mb": os.path.getsize(path) / 1e6 if path and os.path.exists(path) else None,
+                "latency_ms_p50": latency_ms(lambda: runner({size: raw_inputs[0]}), args.runs)
+            }
+        }
+        print(f"{model_name:<12} keras   : p50 {row['keras']['latency_ms_p50']:8.2f} ms")
+
+        for quantization in args.quantization:
+            calibration_images = None
+            if quantization == "int8":
+                if not args.calibration:
+                    print(f"{model_name:<12} int8    : skipped (no --calibration)")
+                    continue
+                calibration_images = load_calibration_images(args.calibration, size)
+
+            start = time.perf_counter()
+            content = convert_to_tflite(model, quantization, calibration_images, config["preprocess_func"])
+            convert_seconds = time.perf_counter() - start
+
+            rss_before = peak_rss_mb()
+            tflite_model = TFLiteModel(content)
+            tflite_probs = np.concatenate([tflite_model.predict(batch) for batch in preprocessed])
+            diff = np.abs(tflite_probs - float_probs)
+
+            row[quantization] = {
+                "size_mb": tflite_model.size_bytes / 1e6,
+                "convert_seconds": convert_seconds,
+                "latency_ms_p50": latency_ms(lambda: tflite_model.predict(preprocessed[0]), args.runs),
+                "top1_agreement": float(np.mean(tflite_probs.argmax(axis=1) == float_probs.argmax(axis=1))),
+                "mean_abs_prob_diff": float(diff.mean()),
+                "max_abs_prob_diff": float(diff.max()),
+                "peak_rss_growth_mb": peak_rss_mb() - rss_before
+            }
+            print(f"{model_name:<12} {quantization:<8}: p50 {row[quantization]['latency_ms_p50']:8.2f} ms | "
+                  f"{row[quantization]['size_mb']:8.2f} MB | "
+                  f"top-1 agreement {row[quantization]['top1_agreement']:.3f} | "
+                  f"max prob diff {row[quantization]['max_abs_prob_diff']:.4f}")
+
+        results["models"][model_name] = row
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Train and calibrate the paddy-leaf gate (gate.py) on the ensemble's own decisions.
+
+Every image is labelled by the four-backbone ensemble and the agreement
+rule, exactly as the server would decide it; folders passed with
+--negatives (soil, hands, blurry shots, ...) are added as "not a paddy
+leaf" without running the ensemble. The gate is trained on one part of the
+images and calibrated on the rest: the threshold is the highest score that
+still lets --target-recall of the validation leaves through, so the gate
+almost never rejects a real leaf.
+
+The report (printed and stored next to the model as <model>.json, which the
+server reads the threshold from) gives the precision and recall of the
+gate's rejections, the fraction of leaves it would wrongly reject, and the
+latency it saves per request given the measured gate and ensemble costs.
+
+Usage:
+    python train_gate.py uploads_sample/ --negatives not_leaves/ --output model/gate_model.keras
+    python train_gate.py uploads_sample/ --standin-models --epochs 2 --output /tmp/gate_model.keras
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import tensorflow as tf
+
+from app import models, MODEL_CONFIGS, decode_image, resize_for_model, run_ensemble, is_paddy_leaf_batch
+from bulk_scan import find_images
+from gate import GATE_INPUT_SIZE, Gate, build_gate_model, gate_input, metadata_path
+
+
+def read_image(path):
+    """(stored_img, original_img) of a file, or None if it cannot be decoded"""
+    try:
+        with open(path, "rb") as f:
+            return decode_image(f.read())
+    except Exception:
+        return None
+
+
+def label_with_ensemble(paths, batch_size, input_size):
+    """Gate inputs and ensemble is_paddy labels of every decodable image"""
+    input_sizes = sorted({config["input_size"] for config in MODEL_CONFIGS.values()})
+    gate_inputs, labels = [], []
+    for start in range(0, len(paths), batch_size):
+        decoded = [img for img in map(read_image, paths[start:start + batch_size]) if img is not None]
+        if not decoded:
+            continue
+        size_inputs = {size: tf.constant(np.stack([resize_for_model(stored_img, size) for stored_img, _ in decoded]))
+                       for size in input_sizes}
+        is_paddy = is_paddy_leaf_batch(run_ensemble(models, size_inputs))[0]
+        gate_inputs += [gate_input(original_img, input_size) for _, original_img in decoded]
+        labels += [float(label) for label in is_paddy]
+        print(f"Labelled {min(start + batch_size, len(paths))}/{len(paths)} images")
+    return gate_inputs, labels
+
+
+def load_negatives(paths, input_size):
+    gate_inputs = []
+    for path in paths:
+        decoded = read_image(path)
+        if decoded is not None:
+            gate_inputs.append(gate_input(decoded[1], input_size))
+    return gate_inputs, [0.0] * len(gate_inputs)
+
+
+def train(x_train, y_train, input_size, epochs, batch_size, seed):
+    """Fit a gate model with flip augmentation and classes weighted by frequency"""
+    tf.keras.utils.set_random_seed(seed)
+    model = build_gate_model(input_size, seed=seed)
+    model.compile(optimizer=tf.keras.optimizers.Adam(1e-3), loss="binary_crossentropy",
+                  metrics=[tf.keras.metrics.AUC(name="auc")])
+
+    n_positive = float(y_train.sum())
+    n_negative = float(len(y_train) - n_positive)
+    class_weight = {0: len(y_train) / (2 * max(n_negative, 1)), 1: len(y_train) / (2 * max(n_positive, 1))}
+
+    def augment(x, y):
+        x = tf.image.random_flip_left_right(x)
+        x = tf.image.random_flip_up_down(x)
+        return x, y
+
+    dataset = tf.data.Dataset.from_tensor_slices((x_train, y_train)).shuffle(len(y_train), seed=seed)
+    dataset = dataset.map(augment, num_parallel_calls=tf.data.AUTOTUNE).batch(batch_size).prefetch(tf.data.AUTOTUNE)
+    model.fit(dataset, epochs=epochs, class_weight=class_weight, verbose=2)
+    return model
+
+
+def calibrate(scores, labels, target_recall):
+    """Highest threshold that keeps at least target_recall of the leaves"""
+    positive_scores = np.sort(scores[labels == 1])
+    if len(positive_scores) == 0:
+        return None
+    k = int(np.floor((1 - target_recall) * len(positive_scores)))
+    return float(positive_scores[min(k, len(positive_scores) - 1)])
+
+
+def rejection_metrics(scores, labels, threshold):
+    """Precision/recall of the gate's "not a paddy leaf" decisions at a threshold"""
+    rejected = scores < threshold
+    negatives = labels == 0
+    true_rejections = int((rejected & negatives).sum())
+    return {
+        "images": int(len(labels)),
+        "leaves": int((~negatives).sum()),
+        "not_leaves": int(negatives.sum()),
+        "rejected": int(rejected.sum()),
+        "rejection_rate": float(rejected.mean()) if len(labels) else 0.0,
+        "rejection_precision": true_rejections / int(rejected.sum()) if rejected.any() else None,
+        "rejection_recall": true_rejections / int(negatives.sum()) if negatives.any() else None,
+        "leaf_recall": float((~rejected[~negatives]).mean()) if (~negatives).any() else None
+    }
+
+
+def latency_ms(fn, runs=20):
+    fn()
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return float(np.percentile(latencies, 50))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the paddy-leaf gate on the ensemble's decisions")
+    parser.add_argument("images", nargs="+", help="Folders of representative uploads, labelled by the ensemble")
+    parser.add_argument("--negatives", nargs="*", default=[], help="Folders of known non-leaf images")
+    parser.add_argument("--output", default="./model/gate_model.keras")
+    parser.add_argument("--input-size", type=int, default=GATE_INPUT_SIZE[0])
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--val-fraction", type=float, default=0.2)
+    parser.add_argument("--target-recall", type=float, default=0.99,
+                        help="Fraction of validation leaves the gate must let through")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--standin-models", action="store_true", help="Label with stand-ins instead of the .h5 models")
+    args = parser.parse_args()
+
+    if args.standin_models:
+        from standin_models import register_standin_models
+        register_standin_models(models, MODEL_CONFIGS)
+    input_size = (args.input_size, args.input_size)
+
+    paths = [path for root in args.images for path in find_images(root)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        models.load_all()
+    gate_inputs, labels = label_with_ensemble(paths, args.batch_size, input_size)
+    negative_inputs, negative_labels = load_negatives(
+        [path for root in args.negatives for path in find_images(root)], input_size)
+    x = np.stack(gate_inputs + negative_inputs).astype(np.float32)
+    y = np.array(labels + negative_labels, dtype=np.float32)
+    print(f"{len(y)} images: {int(y.sum())} paddy leaves, {int(len(y) - y.sum())} not")
+    if len(y) < 2 or y.min() == y.max():
+        raise SystemExit("Need both paddy leaves and other images to train the gate")
+
+    order = np.random.default_rng(args.seed).permutation(len(y))
+    n_val = max(1, int(len(y) * args.val_fraction))
+    val, train_idx = order[:n_val], order[n_val:]
+    model = train(x[train_idx], y[train_idx], input_size, args.epochs, args.batch_size, args.seed)
+
+    gate = Gate(model)
+    val_scores = gate.scores(x[val])
+    threshold = calibrate(val_scores, y[val], args.target_recall)
+    if threshold is None:
+        print(f"No paddy leaves in the validation split, keeping threshold {gate.threshold}")
+        threshold = gate.threshold
+    gate.threshold = threshold
+    validation = rejection_metrics(val_scores, y[val], threshold)
+
+    # A rejected upload skips the ensemble; every upload pays for the gate
+    input_sizes = sorted({config["input_size"] for config in MODEL_CONFIGS.values()})
+    size_inputs = {size: tf.zeros((1, size[0], size[1], 3)) for size in input_sizes}
+    gate_ms = latency_ms(lambda: gate.scores(x[:1]))
+    ensemble_ms = latency_ms(lambda: run_ensemble(models, size_inputs))
+    saved_ms = validation["rejection_rate"] * ensemble_ms - gate_ms
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    model.save(args.output)
+    report = {
+        "created": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "threshold": threshold,
+        "target_recall": args.target_recall,
+        "input_size": list(input_size),
+        "labels": "ensemble" + (" + negatives" if negative_inputs else ""),
+        "models": "stand-in" if args.standin_models else "real",
+        "train_images": int(len(train_idx)),
+        "validation": validation,
+        "latency_ms": {"gate": gate_ms, "ensemble": ensemble_ms, "saved_per_request": saved_ms}
+    }
+    with open(metadata_path(args.output), "w") as f:
+        json.dump(report, f, indent=4)
+
+    print(f"\nThreshold: {threshold:.4f} (keeps {args.target_recall:.0%} of validation leaves)")
+    for name, value in validation.items():
+        print(f"  {name:<20}: {value if value is None or isinstance(value, int) else round(value, 4)}")
+    print(f"Gate {gate_ms:.2f} ms vs ensemble {ensemble_ms:.2f} ms per image, "
+          f"about {saved_ms:.2f} ms saved per request")
+    print(f"Gate saved to {args.output} (report in {metadata_path(args.output)})")
+
+
+if __name__ == "__main__":
+    main()
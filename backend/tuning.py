@@ -0,0 +1,70 @@
+"""
+Tuning profile written by autotune.py and applied by the server at startup.
+
+The profile is a JSON file with the TensorFlow thread pool sizes, the
+SmoothGrad chunk size and the number of concurrent inference workers that
+measured fastest on this host. TensorFlow's thread pools can only be sized
+before its first op runs, so app.py applies the profile right after its
+imports. Explicit environment variables (SMOOTHGRAD_BATCH_SIZE,
+INFERENCE_WORKERS) still take precedence over the profile.
+"""
+import json
+import os
+import platform
+from datetime import datetime
+
+import tensorflow as tf
+
+TUNED_SETTINGS = ("intra_op_threads", "inter_op_threads", "smoothgrad_batch_size", "inference_workers")
+
+
+def host_description():
+    return {"machine": platform.machine(), "processor": platform.processor(), "cpus": os.cpu_count(),
+            "tensorflow": tf.__version__}
+
+
+def load_tuning_profile(path, standin_models=False):
+    """Tuned settings from a profile file; {} if there is none, it was tuned for another CPU count,
+    or it was tuned on stand-in models and the real ones are being served"""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            profile = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring tuning profile {path}: {e}")
+        return {}
+
+    cpus = profile.get("host", {}).get("cpus")
+    if cpus is not None and cpus != os.cpu_count():
+        print(f"Ignoring tuning profile {path}: tuned for {cpus} CPUs, this host has {os.cpu_count()}")
+        return {}
+    if profile.get("models") == "stand-in" and not standin_models:
+        print(f"Ignoring tuning profile {path}: tuned on stand-in models, not the real ones")
+        return {}
+    settings = profile.get("settings", {})
+    return {name: int(settings[name]) for name in TUNED_SETTINGS if settings.get(name)}
+
+
+def apply_threading(settings):
+    """Size TensorFlow's intra/inter-op thread pools; only works before the first op runs"""
+    try:
+        if settings.get("intra_op_threads"):
+            tf.config.threading.set_intra_op_parallelism_threads(settings["intra_op_threads"])
+        if settings.get("inter_op_threads"):
+            tf.config.threading.set_inter_op_parallelism_threads(settings["inter_op_threads"])
+    except RuntimeError as e:
+        print(f"Could not apply the tuned thread counts, TensorFlow is already initialized: {e}")
+
+
+def save_tuning_profile(path, settings, trials, models):
+    profile = {
+        "created": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "host": host_description(),
+        "models": models,
+        "settings": settings,
+        "trials": trials
+    }
+    with open(path, "w") as f:
+        json.dump(profile, f, indent=4)
+    return profile
@@ -0,0 +1,66 @@
+"""
+ASGI middleware that caps request body size while the body is streamed.
+
+A declared Content-Length over the limit is rejected before any body is
+read. Chunked or mis-declared bodies are counted as they arrive; once the
+limit is crossed the client gets 413 and the application sees a disconnect,
+so nothing beyond the limit is buffered or parsed.
+"""
+import json
+
+
+class UploadLimitMiddleware:
+    """Reject request bodies larger than max_bytes with 413 on the given paths"""
+    def __init__(self, app, max_bytes, paths=None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = tuple(paths) if paths else None
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": f"Upload larger than {self.max_bytes} bytes"}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        (b"connection", b"close")]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.max_bytes <= 0 or \
+                (self.paths is not None and not scope["path"].startswith(self.paths)):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers", []))
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    rejected = True
+                    await self._reject(send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            # The 413 has already been sent - drop whatever the app answers
+            if not rejected:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise